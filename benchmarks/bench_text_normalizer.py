@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Text normalizer benchmark
+Compares the legacy multi-pass optimize_text_for_speech against the
+single-pass normalizer on a synthetic manuscript, and times the text
+front-end (number/abbreviation expansion) on the same text, reporting
+throughput and peak memory (tracemalloc).
+
+    python benchmarks/bench_text_normalizer.py [--words 1000000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.text_normalizer import normalize_text, iter_normalized
+from services.text_frontend import get_frontend
+
+WORDS = (
+    "the night was dark and the wind carried voices from the old mill "
+    "she said nothing but her eyes followed the lantern across the field "
+    "Chapter Elara Dr Smith 1984 river stone silver whisper kingdom"
+).split()
+
+
+def legacy_optimize_text_for_speech(text):
+    """The multi-pass implementation normalize_text replaced"""
+    if not text or not text.strip():
+        return ""
+    optimized = text.strip()
+    optimized = optimized.replace('\n\n\n', '.\n\n')
+    optimized = optimized.replace('\n', '. ')
+    optimized = optimized.replace('Chapter ', '... Chapter ')
+    lines = optimized.split('. ')
+    lines = [line.strip() + '.' if line.strip() and not line.strip().endswith(('.', '!', '?')) else line.strip() for line in lines]
+    return ' '.join(lines)
+
+
+def build_chapters(word_count, chapter_words=25_000, seed=7):
+    """Synthetic chapters of paragraphs and sentences totalling word_count words"""
+    rng = random.Random(seed)
+    chapters = []
+    remaining = word_count
+    number = 1
+    while remaining > 0:
+        size = min(chapter_words, remaining)
+        paragraphs = [f"Chapter {number}"]
+        written = 0
+        while written < size:
+            sentences = []
+            for _ in range(rng.randint(2, 8)):
+                length = rng.randint(4, 24)
+                sentences.append(' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + rng.choice('.!?.'))
+                written += length
+            paragraphs.append(' '.join(sentences))
+        chapters.append('\n\n'.join(paragraphs))
+        remaining -= size
+        number += 1
+    return chapters
+
+
+def measure(label, fn, size_bytes, word_count):
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed:8.3f}s {size_bytes / elapsed / 1e6:9.1f} MB/s "
+          f"{word_count / elapsed / 1e6:8.2f} Mwords/s   peak {peak / 1e6:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    chapters = build_chapters(args.words)
+    manuscript = '\n\n\n'.join(chapters)
+    size_bytes = len(manuscript.encode('utf-8'))
+    print(f"📚 Corpus: {args.words:,} words, {len(chapters)} chapters, {size_bytes / 1e6:.1f} MB")
+    print("-" * 90)
+
+    measure("legacy (multi-pass)", lambda: legacy_optimize_text_for_speech(manuscript), size_bytes, args.words)
+    measure("normalize_text", lambda: normalize_text(manuscript), size_bytes, args.words)
+    measure("iter_normalized (chapters)", lambda: sum(len(c) for c in iter_normalized(chapters)), size_bytes, args.words)
+    frontend = get_frontend('en-US')
+    measure("text front-end (en-US)", lambda: frontend.expand(manuscript), size_bytes, args.words)
+    print(f"   rule hits: {frontend.stats()}")
+
+
+if __name__ == "__main__":
+    main()
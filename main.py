@@ -60,8 +60,14 @@ try:
 except Exception as e:
     logging.error(f"Error registering editor blueprint: {e}")
 
-# Temporarily disable audio blueprint to fix hanging issue
-logging.info("Audio blueprint temporarily disabled to fix hanging issue")
+# Audio generation runs in the background worker (worker.py), so the audio
+# blueprint no longer blocks request threads on OpenAI or Wasabi
+try:
+    from routes.audio import audio_bp
+    app.register_blueprint(audio_bp)
+    logging.info("Registered audio blueprint")
+except Exception as e:
+    logging.error(f"Error registering audio blueprint: {e}")
 
 if __name__ == "__main__":
     print("🚀 Starting MysticEcho application...")
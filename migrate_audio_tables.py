@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Database Migration Script for Audio Generation
+Creates missing audio tables and adds new columns to existing tables
+without touching existing data. Safe to run repeatedly.
+"""
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+import models
+
+
+def migrate_audio_tables():
+    """Create new tables and add any model columns missing from existing tables"""
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        existing_tables = set(inspector.get_table_names())
+
+        print("🏗️  Creating missing tables...")
+        db.create_all()
+        created = set(db.inspect(db.engine).get_table_names()) - existing_tables
+        for table_name in sorted(created):
+            print(f"✅ Created table: {table_name}")
+
+        print("🔄 Checking for missing columns...")
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if isinstance(default, bool):
+                    statement += f" DEFAULT {'TRUE' if default else 'FALSE'}"
+                elif isinstance(default, (int, float)):
+                    statement += f" DEFAULT {default}"
+                elif isinstance(default, str):
+                    statement += f" DEFAULT '{default}'"
+
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(statement))
+                print(f"✅ Added column: {table.name}.{column.name}")
+
+        print("✅ Audio migration completed successfully!")
+        return True
+
+
+if __name__ == "__main__":
+    print("🚀 MysticEcho Audio Migration Script")
+    print("=" * 50)
+    migrate_audio_tables()
@@ -56,9 +56,12 @@ class Project(db.Model):
     
     # Audio-related fields
     audio_url = db.Column(db.String(500))  # URL to generated audio file
+    audio_storage_key = db.Column(db.String(500))  # S3/Wasabi key of the generated audio file
+    audio_job_id = db.Column(db.Integer)  # Render job holding the project's generation claim
     audio_voice = db.Column(db.String(20), default='alloy')  # TTS voice used
     audio_duration = db.Column(db.Float)  # Duration in minutes
     audio_generated_at = db.Column(db.DateTime)  # When audio was generated
+    lexicon_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped on every pronunciation lexicon edit
     
     def __repr__(self):
         return f'<Project {self.title}>'
@@ -92,10 +95,124 @@ class Chapter(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, default='')
     order_index = db.Column(db.Integer, nullable=False, default=0)
+    is_final = db.Column(db.Boolean, nullable=False, default=False)  # Finished chapters are rendered at the final (HD) tier
+    finalized_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
     project = db.relationship('Project', backref='chapters')
     
     def __repr__(self):
-        return f'<Chapter {self.title}>'
\ No newline at end of file
+        return f'<Chapter {self.title}>'
+
+class AudioJob(db.Model):
+    __tablename__ = 'audio_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=True)
+    kind = db.Column(db.String(30), nullable=False, default='project')  # project, chapter
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, succeeded, failed, cancelled
+    payload = db.Column(db.Text)  # JSON job arguments
+    result = db.Column(db.Text)  # JSON handler result
+    error = db.Column(db.Text)
+    progress = db.Column(db.Float, default=0.0)  # 0.0 - 1.0
+    manifest = db.Column(db.Text)  # JSON checkpoint of synthesized chunks, for resuming after a crash
+    idempotency_key = db.Column(db.String(128), index=True)  # Client-supplied key; repeat submissions return this job
+    
+    # Retry and lease bookkeeping
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.now, index=True)  # Not claimable before this time (retry backoff)
+    worker_id = db.Column(db.String(64))
+    lease_expires_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = db.Column(db.DateTime)
+    
+    project = db.relationship('Project', backref='audio_jobs')
+    
+    def __repr__(self):
+        return f'<AudioJob {self.id}:{self.kind}:{self.status}>'
+
+
+class ChapterAudio(db.Model):
+    __tablename__ = 'chapter_audio'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False, index=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    content_hash = db.Column(db.String(64))  # Hash of the spoken text at last render
+    voice = db.Column(db.String(20))
+    model = db.Column(db.String(30))  # Engine model of the render; tells draft from final tier audio
+    duration_seconds = db.Column(db.Float)
+    frame_count = db.Column(db.Integer)  # MP3 audio frames, set when duration came from the frame headers
+    storage_key = db.Column(db.String(500))  # S3/Wasabi key of the rendered audio
+    audio_url = db.Column(db.String(500))
+    status = db.Column(db.String(20), default='pending')  # pending, queued, ready, failed
+    error = db.Column(db.Text)
+    job_id = db.Column(db.Integer, db.ForeignKey('audio_jobs.id'), nullable=True)
+    rendered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    chapter = db.relationship('Chapter', backref=db.backref('audio', uselist=False, cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<ChapterAudio {self.chapter_id}:{self.status}>'
+
+
+class AudioVariant(db.Model):
+    __tablename__ = 'audio_variants'
+    __table_args__ = (db.UniqueConstraint('project_id', 'format', name='uq_audio_variant_project_format'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    format = db.Column(db.String(10), nullable=False)  # opus, aac, flac (MP3 lives on the project)
+    voice = db.Column(db.String(20))
+    storage_key = db.Column(db.String(500))  # S3/Wasabi key of the rendered file
+    audio_url = db.Column(db.String(500))
+    duration_seconds = db.Column(db.Float)
+    rendered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    project = db.relationship('Project', backref=db.backref('audio_variants', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<AudioVariant {self.project_id}:{self.format}>'
+
+
+class LexiconEntry(db.Model):
+    __tablename__ = 'lexicon_entries'
+    __table_args__ = (db.UniqueConstraint('project_id', 'term', name='uq_lexicon_project_term'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False, index=True)
+    term = db.Column(db.String(200), nullable=False)
+    respelling = db.Column(db.String(500), nullable=False)  # How the term should be spoken
+    case_sensitive = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    project = db.relationship('Project', backref=db.backref('lexicon_entries', cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<LexiconEntry {self.term}>'
+
+
+class SpeculativeUsage(db.Model):
+    __tablename__ = 'speculative_usage'
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_speculative_usage_user_day'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    characters = db.Column(db.Integer, nullable=False, default=0)  # Characters pre-rendered speculatively that day
+    
+    def __repr__(self):
+        return f'<SpeculativeUsage {self.user_id}:{self.day}>'
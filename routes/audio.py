@@ -1,14 +1,36 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file
-from models import Project, User
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file, Response, stream_with_context
+from models import Project, User, AudioJob, Chapter
 from app import db
 from flask_security import current_user, auth_required
-from services.tts_service import tts_service
+from services.tts_service import tts_service, PREVIEW_MAX_CHARS
+from services import job_queue
+from services.audio_jobs import settle_job, queue_project_render, attach_project_audio
+from services.chapter_audio import regenerate_stale, chapter_status
+from services import export_service
+from services.storage_service import generate_download_url, storage_key_from_url
+from services.audio_cache import audio_file_cache
+from services import voice_samples
+from services.lexicon import project_lexicon
+from services.scheduler import scheduler
+from services.generation_plan import plan_generation
+from services import speculative
+from services.audio_formats import OUTPUT_FORMATS, content_type_for
 import os
+import re
 import tempfile
 import logging
+from io import BytesIO
 
 audio_bp = Blueprint('audio', __name__, url_prefix='/audio')
 
+@audio_bp.app_template_filter('duration')
+def format_duration(seconds):
+    """Format a runtime in seconds as H:MM:SS or M:SS"""
+    total = int(round(seconds or 0))
+    hours, remainder = divmod(total, 3600)
+    minutes, secs = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
 @audio_bp.route('/generate/<int:project_id>')
 @auth_required()
 def generate_audio(project_id):
@@ -31,7 +53,7 @@ def generate_audio(project_id):
 @audio_bp.route('/generate_tts/<int:project_id>', methods=['POST'])
 @auth_required()
 def generate_tts(project_id):
-    """Generate text-to-speech audio from project content"""
+    """Queue text-to-speech generation for the project content and return the job id"""
     try:
         user = current_user
         project = Project.query.filter_by(id=project_id, user_id=user.id).first()
@@ -46,47 +68,281 @@ def generate_tts(project_id):
         
         # Get voice preference from request
         voice = request.json.get('voice', 'alloy') if request.is_json else 'alloy'
+        if voice not in tts_service.get_available_voices():
+            voice = 'alloy'
         
-        # Update project status to generating_audio
-        project.status = 'generating_audio'
-        db.session.commit()
+        response_format = (request.json.get('format') if request.is_json else None) or 'mp3'
+        if response_format not in OUTPUT_FORMATS:
+            return jsonify({'success': False, 'error': f"Unsupported format: {response_format}"}), 400
+        if OUTPUT_FORMATS[response_format]['segment_format'] not in tts_service.engine.formats:
+            return jsonify({'success': False, 'error': f"{response_format.upper()} is not available with the current voice engine"}), 400
         
-        # Generate audio using TTS service
-        result = tts_service.generate_audio(
-            text=content,
-            voice=voice,
-            project_id=project_id
-        )
+        # Synthesis runs in the audio worker (worker.py), never in the request thread.
+        # Only one render per project at a time; repeats of a request share its job.
+        idempotency_key = request.headers.get('Idempotency-Key') or (request.json.get('idempotency_key') if request.is_json else None)
+        job, created = queue_project_render(project, user.id, voice, idempotency_key, response_format)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Audio generation queued' if created else 'Audio generation already in progress',
+            'duplicate': not created,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('audio.job_status', job_id=job.id)
+        }), 202 if created else 200
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"TTS queue error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to queue audio generation'})
+
+@audio_bp.route('/regenerate_stale/<int:project_id>', methods=['POST'])
+@auth_required()
+def regenerate_stale_chapters(project_id):
+    """Queue renders only for chapters whose text, voice or tier changed since their last render"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        voice = request.json.get('voice', 'alloy') if request.is_json else 'alloy'
+        if voice not in tts_service.get_available_voices():
+            voice = 'alloy'
+        
+        jobs, fresh = regenerate_stale(project, user.id, voice)
+        
+        return jsonify({
+            'success': True,
+            'message': f'{len(jobs)} chapters queued, {fresh} already up to date',
+            'jobs': [job_queue.job_to_dict(job) for job in jobs],
+            'up_to_date': fresh
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Regenerate stale chapters error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to queue chapter audio'}), 500
+
+@audio_bp.route('/chapters/<int:project_id>/status')
+@auth_required()
+def chapters_audio_status(project_id):
+    """Report per-chapter audio state, including whether each render is stale"""
+    user = current_user
+    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    
+    if not project:
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    
+    voice = request.args.get('voice', project.audio_voice or 'alloy')
+    chapters = Chapter.query.filter_by(project_id=project_id).order_by(Chapter.order_index).all()
+    
+    return jsonify({
+        'success': True,
+        'chapters': [chapter_status(chapter, voice) for chapter in chapters]
+    })
+
+@audio_bp.route('/plan/<int:project_id>')
+@auth_required()
+def generation_plan(project_id):
+    """Forecast chunks, cost and render time without synthesizing; ?scope=chapters or ?chapter_id= plans chapters"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        voice = request.args.get('voice', 'alloy')
+        if voice not in tts_service.get_available_voices():
+            voice = 'alloy'
+        chapter_ids = request.args.getlist('chapter_id', type=int)
+        scope = 'chapters' if chapter_ids else request.args.get('scope', 'project')
+        if scope not in ('project', 'chapters'):
+            return jsonify({'success': False, 'error': 'Unknown plan scope'}), 400
+        
+        return jsonify({'success': True, 'plan': plan_generation(project, voice, scope, chapter_ids)})
+        
+    except Exception as e:
+        logging.error(f"Generation plan error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to plan audio generation'}), 500
+
+@audio_bp.route('/stream/<int:project_id>')
+@auth_required()
+def stream_tts(project_id):
+    """Stream MP3 audio to the browser while it is being generated"""
+    user = current_user
+    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    
+    if not project:
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    
+    content = project.content
+    if not content or not content.strip():
+        return jsonify({'success': False, 'error': 'No content to convert'}), 400
+    
+    voice = request.args.get('voice', 'alloy')
+    lexicon = project_lexicon(project)
+    user_id = user.id
+    
+    def save_render(result):
+        """Attach the finished stream to the project once every byte has been sent, unless a render job holds it"""
+        try:
+            if not attach_project_audio(project_id, result):
+                logging.info(f"Streamed audio for project {project_id} not attached; a render job holds the project")
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Failed to save streamed audio for project {project_id}: {e}")
+    
+    def generate():
+        try:
+            with scheduler.context(user_id=user_id, priority='interactive'):
+                yield from tts_service.stream_audio(content, voice=voice, project_id=project_id, on_complete=save_render, lexicon=lexicon)
+        except Exception as e:
+            # Headers are already sent, so the best we can do is end the stream
+            logging.error(f"TTS streaming error: {e}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/mpeg',
+        headers={
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+        }
+    )
+
+@audio_bp.route('/preview_selection/<int:project_id>')
+@auth_required()
+def preview_selection(project_id):
+    """Stream audio of just ?text= (the editor's selection or paragraph) so authors can check pronunciation"""
+    user = current_user
+    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    
+    if not project:
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    
+    text = request.args.get('text', '').strip()
+    if not text:
+        return jsonify({'success': False, 'error': 'No text to preview'}), 400
+    if len(text) > PREVIEW_MAX_CHARS:
+        return jsonify({'success': False, 'error': f'Previews are limited to {PREVIEW_MAX_CHARS} characters'}), 400
+    
+    voice = request.args.get('voice', project.audio_voice or 'alloy')
+    lexicon = project_lexicon(project)
+    user_id = user.id
+    
+    def generate():
+        try:
+            with scheduler.context(user_id=user_id, priority='interactive'):
+                yield from tts_service.stream_preview(text, voice=voice, lexicon=lexicon)
+        except Exception as e:
+            logging.error(f"Selection preview error: {e}")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/mpeg',
+        headers={
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@audio_bp.route('/job/<int:job_id>')
+@auth_required()
+def job_status(job_id):
+    """Report the status and progress of an audio generation job"""
+    job = AudioJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': job_queue.job_to_dict(job)})
+
+@audio_bp.route('/job/<int:job_id>/cancel', methods=['POST'])
+@auth_required()
+def cancel_job(job_id):
+    """Cancel a queued or running audio generation job"""
+    job = AudioJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    try:
+        job = job_queue.cancel(job.id)
+        if job.status == 'cancelled':
+            settle_job(job)
+        
+        return jsonify({'success': True, 'job': job_queue.job_to_dict(job)})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Cancel job error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to cancel job'}), 500
+
+@audio_bp.route('/scheduler/stats')
+@auth_required()
+def scheduler_stats():
+    """TTS queue depth and wait times per priority class, with the current user's own queue and speculative budget"""
+    return jsonify({
+        'success': True,
+        'scheduler': scheduler.stats(current_user.id),
+        'speculative': speculative.usage(current_user.id)
+    })
+
+@audio_bp.route('/voice_samples/<int:project_id>')
+@auth_required()
+def voice_sample_gallery(project_id):
+    """Render a short passage in every voice; ?chapter_id= samples that chapter's opening paragraph"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
         
-        if result['success']:
-            # Update project with audio information
-            project.status = 'audio_generated'
-            project.audio_url = result.get('audio_url')
-            project.audio_voice = result.get('voice')
-            project.audio_duration = result.get('duration_estimate')
-            project.audio_generated_at = db.func.now()
-            db.session.commit()
-            
-            return jsonify({
-                'success': True,
-                'message': 'Audio generated successfully',
-                'audio_url': result.get('audio_url'),
-                'duration_estimate': result.get('duration_estimate'),
-                'voice': result.get('voice')
-            })
-        else:
-            # Reset project status on failure
-            project.status = 'draft'
-            db.session.commit()
-            return jsonify(result)
+        passage = None
+        chapter_id = request.args.get('chapter_id', type=int)
+        if chapter_id:
+            chapter = Chapter.query.filter_by(id=chapter_id, project_id=project.id).first()
+            if not chapter:
+                return jsonify({'success': False, 'error': 'Chapter not found'}), 404
+            passage = voice_samples.sample_passage(chapter.content)
+        elif request.args.get('source') == 'project':
+            passage = voice_samples.sample_passage(project.content)
+        
+        with scheduler.context(user_id=user.id, priority='interactive'):
+            text, samples = voice_samples.render_voice_samples(passage, project_lexicon(project) if passage else None)
+        for sample in samples:
+            if sample['key']:
+                sample['url'] = url_for('audio.voice_sample_audio', key=sample['key'])
+        
+        return jsonify({
+            'success': True,
+            'text': text,
+            'standard': passage is None,
+            'samples': samples
+        })
         
     except Exception as e:
-        logging.error(f"TTS generation error: {e}")
-        # Reset project status on error
-        if 'project' in locals():
-            project.status = 'draft'
-            db.session.commit()
-        return jsonify({'success': False, 'error': 'Failed to generate audio'})
+        logging.error(f"Voice sample gallery error: {e}")
+        return jsonify({'success': False, 'error': 'Failed to render voice samples'}), 500
+
+@audio_bp.route('/voice_sample/<key>.mp3')
+@auth_required()
+def voice_sample_audio(key):
+    """Serve one rendered voice sample; samples are content-addressed so they never change"""
+    if not re.fullmatch(r'[0-9a-f]{64}', key):
+        return jsonify({'success': False, 'error': 'Sample not found'}), 404
+    
+    data = voice_samples.load_sample(key)
+    if data is None:
+        return jsonify({'success': False, 'error': 'Sample not found'}), 404
+    
+    response = send_file(BytesIO(data), mimetype='audio/mpeg', conditional=True, etag=key, max_age=86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
 @audio_bp.route('/preview/<int:project_id>')
 @auth_required()
@@ -107,6 +363,98 @@ def preview_audio(project_id):
         flash('Error loading audio preview page', 'error')
         return redirect(url_for('dashboard.index'))
 
+def send_cached_audio(storage_key, download_name, as_attachment=False):
+    """
+    Serve a stored audio file from the local disk cache with Range/206,
+    ETag and If-None-Match handled by send_file. Returns None if the file
+    is not in storage.
+    """
+    for attempt in range(2):
+        cached = audio_file_cache.get(storage_key)
+        if not cached:
+            return None
+        path, etag = cached
+        try:
+            response = send_file(
+                path,
+                mimetype=content_type_for(storage_key),
+                as_attachment=as_attachment,
+                download_name=download_name,
+                conditional=True,
+                etag=etag
+            )
+        except FileNotFoundError:
+            # Evicted between lookup and open; fetch it again
+            continue
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.cache_control.private = True
+        response.cache_control.no_cache = True  # Revalidate with the ETag, which is cheap
+        return response
+    return None
+
+def project_audio_key(project):
+    """Storage key of the project's full audio, recovered from its URL for older renders"""
+    return project.audio_storage_key or storage_key_from_url(project.audio_url)
+
+def project_audio_file(project, response_format=None):
+    """
+    (storage key, download name) of the project's audio in the requested
+    format. Without a format the MP3 is preferred, falling back to any
+    other rendered format.
+    """
+    if response_format in (None, '', 'mp3'):
+        storage_key = project_audio_key(project)
+        if storage_key or response_format == 'mp3':
+            return storage_key, f"{project.title}.mp3"
+    variants = {variant.format: variant for variant in project.audio_variants if variant.storage_key}
+    variant = variants.get(response_format) if response_format else next(iter(variants.values()), None)
+    if not variant:
+        return None, None
+    return variant.storage_key, f"{project.title}.{OUTPUT_FORMATS[variant.format]['extension']}"
+
+@audio_bp.route('/file/<int:project_id>')
+@auth_required()
+def play_audio(project_id):
+    """Serve the project's audio for in-page playback and seeking"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        storage_key, download_name = project_audio_file(project, request.args.get('format'))
+        response = send_cached_audio(storage_key, download_name) if storage_key else None
+        if not response:
+            return jsonify({'success': False, 'error': 'No audio generated for this project'}), 404
+        return response
+        
+    except Exception as e:
+        logging.error(f"Error serving audio: {e}")
+        return jsonify({'success': False, 'error': 'Failed to load audio'}), 500
+
+@audio_bp.route('/file/<int:project_id>/chapter/<int:chapter_id>')
+@auth_required()
+def play_chapter_audio(project_id, chapter_id):
+    """Serve one chapter's rendered audio"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        chapter = Chapter.query.filter_by(id=chapter_id, project_id=project.id).first()
+        audio = chapter.audio if chapter else None
+        response = send_cached_audio(audio.storage_key, f"{chapter.title}.mp3") if audio and audio.storage_key else None
+        if not response:
+            return jsonify({'success': False, 'error': 'No audio generated for this chapter'}), 404
+        return response
+        
+    except Exception as e:
+        logging.error(f"Error serving chapter audio: {e}")
+        return jsonify({'success': False, 'error': 'Failed to load audio'}), 500
+
 @audio_bp.route('/download/<int:project_id>')
 @auth_required()
 def download_audio(project_id):
@@ -119,13 +467,12 @@ def download_audio(project_id):
             flash('Project not found', 'error')
             return redirect(url_for('dashboard.index'))
         
-        if not project.audio_url:
+        storage_key, download_name = project_audio_file(project, request.args.get('format'))
+        response = send_cached_audio(storage_key, download_name, as_attachment=True) if storage_key else None
+        if not response:
             flash('No audio generated for this project', 'error')
             return redirect(url_for('audio.preview_audio', project_id=project_id))
-        
-        # For now, redirect to the audio URL
-        # In a full implementation, you'd download from S3 and serve the file
-        return redirect(project.audio_url)
+        return response
         
     except Exception as e:
         logging.error(f"Error downloading audio: {e}")
@@ -144,9 +491,72 @@ def export_audiobook(project_id):
             flash('Project not found', 'error')
             return redirect(url_for('dashboard.index'))
         
-        return render_template('audio/export.html', project=project)
+        # Chapter runtimes come from the rendered MP3 frame headers
+        chapters = Chapter.query.filter_by(project_id=project.id).order_by(Chapter.order_index).all()
+        rendered = [chapter for chapter in chapters if chapter.audio and chapter.audio.status == 'ready']
+        total_seconds = sum(chapter.audio.duration_seconds or 0 for chapter in rendered)
+        
+        export_error = None
+        try:
+            export_service.export_chapters(project)
+        except export_service.ExportError as e:
+            export_error = str(e)
+        
+        return render_template('audio/export.html', project=project, chapters=rendered,
+                               total_seconds=total_seconds, export_error=export_error)
         
     except Exception as e:
         logging.error(f"Error loading export page: {e}")
         flash('Error loading export page', 'error')
-        return redirect(url_for('dashboard.index'))
\ No newline at end of file
+        return redirect(url_for('dashboard.index'))
+
+@audio_bp.route('/export/<int:project_id>/audiobook.mp3')
+@auth_required()
+def download_audiobook(project_id):
+    """Stream the chapterized single-file audiobook to the browser"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        tag, chapters, pauses = export_service.prepare_export(project)
+        return Response(
+            stream_with_context(export_service.iter_audiobook(tag, chapters, pauses)),
+            mimetype='audio/mpeg',
+            headers={
+                'Content-Disposition': f'attachment; filename="{export_service.export_filename(project)}"',
+                'Cache-Control': 'no-store'
+            }
+        )
+        
+    except export_service.ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        logging.error(f"Error exporting audiobook: {e}")
+        return jsonify({'success': False, 'error': 'Failed to export audiobook'}), 500
+
+@audio_bp.route('/export/<int:project_id>/store', methods=['POST'])
+@auth_required()
+def store_audiobook(project_id):
+    """Stream the chapterized audiobook into cloud storage and return a download link"""
+    try:
+        user = current_user
+        project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+        
+        if not project:
+            return jsonify({'success': False, 'error': 'Project not found'}), 404
+        
+        storage_key = export_service.export_to_storage(project)
+        return jsonify({
+            'success': True,
+            'storage_key': storage_key,
+            'download_url': generate_download_url(storage_key)
+        })
+        
+    except export_service.ExportError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        logging.error(f"Error storing audiobook export: {e}")
+        return jsonify({'success': False, 'error': 'Failed to export audiobook'}), 500
@@ -1,10 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from app import db
-from models import User, Project, ProjectVersion, Chapter
+from models import User, Project, ProjectVersion, Chapter, LexiconEntry
 from flask_security import auth_required
 from services.ai_service import get_content_suggestions, improve_text
 from services.storage_service import save_project_backup
 from services.pdf_service import extract_text_from_pdf
+from services.lexicon import parse_lexicon_lines, project_lexicon
+from services.text_frontend import annotate_text
+from services.chapter_audio import set_chapter_final
+from services.tts_service import PREVIEW_MAX_CHARS
 from flask_security import current_user
 import logging
 import os
@@ -28,7 +32,8 @@ def edit_project(project_id):
     # Get chapters for project
     chapters = Chapter.query.filter_by(project_id=project_id).order_by(Chapter.order_index).all()
     
-    return render_template('editor.html', project=project, versions=recent_versions, chapters=chapters)
+    return render_template('editor.html', project=project, versions=recent_versions, chapters=chapters,
+                           preview_max_chars=PREVIEW_MAX_CHARS)
 
 
 @editor_bp.route('/save_project/<int:project_id>', methods=['POST'])
@@ -142,7 +147,8 @@ def get_chapter(project_id, chapter_id):
         'id': chapter.id,
         'title': chapter.title,
         'content': chapter.content,
-        'order_index': chapter.order_index
+        'order_index': chapter.order_index,
+        'is_final': chapter.is_final
     })
 
 @editor_bp.route('/project/<int:project_id>/chapter/<int:chapter_id>', methods=['PUT'])
@@ -175,6 +181,38 @@ def update_chapter(project_id, chapter_id):
         logging.error(f"Update chapter error: {e}")
         return jsonify({'error': 'Failed to update chapter'}), 500
 
+@editor_bp.route('/project/<int:project_id>/chapter/<int:chapter_id>/final', methods=['POST'])
+@auth_required()
+def mark_chapter_final(project_id, chapter_id):
+    """Mark a chapter final, which queues its HD render, or return it to draft"""
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    chapter = Chapter.query.filter_by(id=chapter_id, project_id=project_id).first()
+    if not chapter:
+        return jsonify({'error': 'Chapter not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    final = bool(data.get('final', True))
+    
+    try:
+        job = set_chapter_final(chapter, user_id, final, data.get('voice'))
+        
+        return jsonify({
+            'success': True,
+            'is_final': chapter.is_final,
+            'job_id': job.id if job else None,
+            'message': 'Chapter marked final; HD audio queued' if job else
+                       'Chapter marked final' if final else 'Chapter returned to draft'
+        })
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Mark chapter final error: {e}")
+        return jsonify({'error': 'Failed to update chapter'}), 500
+
 @editor_bp.route('/project/<int:project_id>/chapter/<int:chapter_id>', methods=['DELETE'])
 @auth_required()
 def delete_chapter(project_id, chapter_id):
@@ -665,3 +703,162 @@ def update_status(project_id):
         db.session.rollback()
         logging.error(f"Status update error: {e}")
         return jsonify({'error': 'Failed to update status'}), 500
+
+@editor_bp.route('/project/<int:project_id>/spoken_text', methods=['POST'])
+@auth_required()
+def spoken_text(project_id):
+    """
+    Spans of the posted text that narration will read differently than
+    written: lexicon respellings and text front-end expansions. Offsets index
+    the posted text, so the editor can highlight them in place.
+    """
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    text = (request.get_json(silent=True) or {}).get('text') or ''
+    
+    lexicon = project_lexicon(project)
+    # The same pass synthesis makes: respelled terms as written, the rules around them
+    spans = annotate_text(text, respellings=lexicon.spans(text) if lexicon else ())
+    
+    hits = {}
+    for span in spans:
+        hits[span['rule']] = hits.get(span['rule'], 0) + 1
+    
+    return jsonify({'success': True, 'spans': spans, 'hits': hits})
+
+def _lexicon_entry_dict(entry):
+    return {
+        'id': entry.id,
+        'term': entry.term,
+        'respelling': entry.respelling,
+        'case_sensitive': entry.case_sensitive
+    }
+
+def _bump_lexicon_version(project):
+    """Invalidate cached lexicon automata; concurrent edits each get their own version"""
+    project.lexicon_version = Project.lexicon_version + 1
+
+@editor_bp.route('/project/<int:project_id>/lexicon', methods=['GET'])
+@auth_required()
+def get_lexicon(project_id):
+    """List the project's pronunciation lexicon"""
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    entries = LexiconEntry.query.filter_by(project_id=project_id).order_by(LexiconEntry.term).all()
+    return jsonify({
+        'success': True,
+        'version': project.lexicon_version,
+        'entries': [_lexicon_entry_dict(entry) for entry in entries]
+    })
+
+@editor_bp.route('/project/<int:project_id>/lexicon', methods=['POST'])
+@auth_required()
+def save_lexicon_entry(project_id):
+    """Add a lexicon entry, or update the respelling of an existing term"""
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    data = request.get_json() or {}
+    term = (data.get('term') or '').strip()
+    respelling = (data.get('respelling') or '').strip()
+    
+    if not term or not respelling:
+        return jsonify({'error': 'Term and respelling are required'}), 400
+    
+    try:
+        entry = LexiconEntry.query.filter_by(project_id=project_id, term=term).first()
+        if not entry:
+            entry = LexiconEntry(project_id=project_id, term=term)
+            db.session.add(entry)
+        entry.respelling = respelling
+        entry.case_sensitive = bool(data.get('case_sensitive', False))
+        _bump_lexicon_version(project)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'entry': _lexicon_entry_dict(entry)})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Save lexicon entry error: {e}")
+        return jsonify({'error': 'Failed to save lexicon entry'}), 500
+
+@editor_bp.route('/project/<int:project_id>/lexicon', methods=['PUT'])
+@auth_required()
+def replace_lexicon(project_id):
+    """
+    Replace the whole lexicon, e.g. from a glossary. Accepts {"entries": [...]}
+    or {"text": "term = respelling" lines}.
+    """
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    data = request.get_json() or {}
+    if 'text' in data:
+        pairs = [{'term': term, 'respelling': respelling} for term, respelling in parse_lexicon_lines(data['text'])]
+    else:
+        pairs = data.get('entries', [])
+    
+    try:
+        # Later duplicates win, matching how the lines read top to bottom
+        entries = {}
+        for pair in pairs:
+            term = (pair.get('term') or '').strip()
+            respelling = (pair.get('respelling') or '').strip()
+            if term and respelling:
+                entries[term] = LexiconEntry(
+                    project_id=project_id,
+                    term=term,
+                    respelling=respelling,
+                    case_sensitive=bool(pair.get('case_sensitive', False))
+                )
+        
+        LexiconEntry.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+        db.session.add_all(entries.values())
+        _bump_lexicon_version(project)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'count': len(entries)})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Replace lexicon error: {e}")
+        return jsonify({'error': 'Failed to save lexicon'}), 500
+
+@editor_bp.route('/project/<int:project_id>/lexicon/<int:entry_id>', methods=['DELETE'])
+@auth_required()
+def delete_lexicon_entry(project_id, entry_id):
+    """Remove one lexicon entry"""
+    user_id = current_user.id
+    project = Project.query.filter_by(id=project_id, user_id=user_id).first()
+    
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    entry = LexiconEntry.query.filter_by(id=entry_id, project_id=project_id).first()
+    if not entry:
+        return jsonify({'error': 'Lexicon entry not found'}), 404
+    
+    try:
+        db.session.delete(entry)
+        _bump_lexicon_version(project)
+        db.session.commit()
+        return jsonify({'success': True})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Delete lexicon entry error: {e}")
+        return jsonify({'error': 'Failed to delete lexicon entry'}), 500
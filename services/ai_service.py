@@ -2,14 +2,33 @@ import os
 import json
 import logging
 from openai import OpenAI
+from services.rate_limiter import rate_limiter
+from services.single_flight import single_flight
 
 # Initialize OpenAI client
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     logging.warning("OPENAI_API_KEY not found in environment variables")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Retries go through the shared rate limiter instead of the SDK's own backoff
+openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0) if OPENAI_API_KEY else None
 
+CHAT_MODEL = "gpt-4o"
+
+def create_chat_completion(messages, max_tokens):
+    """
+    Call the chat completions API under the shared rate limiter.
+    Token usage is estimated at ~4 characters per prompt token plus the completion budget.
+    """
+    estimated_tokens = sum(len(message['content']) for message in messages) // 4 + max_tokens
+    return rate_limiter.call(CHAT_MODEL, estimated_tokens, lambda: openai_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens
+    ))
+
+@single_flight.coalesce('get_content_suggestions')
 def get_content_suggestions(text, suggestion_type='improve'):
     """
     Get AI-powered content suggestions for audiobook manuscripts
@@ -55,8 +74,7 @@ def get_content_suggestions(text, suggestion_type='improve'):
         
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
+        response = create_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -67,7 +85,6 @@ def get_content_suggestions(text, suggestion_type='improve'):
                     "content": prompt
                 }
             ],
-            response_format={"type": "json_object"},
             max_tokens=1500
         )
         
@@ -78,6 +95,7 @@ def get_content_suggestions(text, suggestion_type='improve'):
         logging.error(f"AI suggestions error: {e}")
         raise Exception("Failed to generate AI suggestions. Please check your API configuration and try again.")
 
+@single_flight.coalesce('improve_text')
 def improve_text(text):
     """
     Specifically improve text for audiobook narration
@@ -102,8 +120,7 @@ def improve_text(text):
         
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
+        response = create_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -114,7 +131,6 @@ def improve_text(text):
                     "content": prompt
                 }
             ],
-            response_format={"type": "json_object"},
             max_tokens=1200
         )
         
@@ -149,8 +165,7 @@ def analyze_audiobook_readiness(content):
         
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
+        response = create_chat_completion(
             messages=[
                 {
                     "role": "system",
@@ -161,7 +176,6 @@ def analyze_audiobook_readiness(content):
                     "content": prompt
                 }
             ],
-            response_format={"type": "json_object"},
             max_tokens=1000
         )
         
@@ -0,0 +1,158 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from services import storage_service
+
+
+class AudioFileCache:
+    """
+    Read-through disk cache of rendered audio files keyed on their storage key.
+    Files are downloaded from cloud storage once, streamed straight to disk,
+    and served from there so the web server can use sendfile and answer range
+    requests locally. An SQLite index tracks size, ETag and last access; the
+    least recently used files are evicted once the cache passes max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('AUDIO_CACHE_DIR', os.path.join('instance', 'audio_cache'))
+        self.max_bytes = max_bytes or int(os.environ.get('AUDIO_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+        self.index_path = os.path.join(self.cache_dir, 'index.db')
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS files (
+                            storage_key TEXT PRIMARY KEY,
+                            size INTEGER NOT NULL,
+                            etag TEXT NOT NULL,
+                            last_access REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_last_access ON files (last_access)")
+                    conn.commit()
+                    self._ready = True
+        return conn
+
+    def _local_path(self, storage_key):
+        digest = hashlib.sha256(storage_key.encode('utf-8')).hexdigest()
+        extension = os.path.splitext(storage_key)[1]
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}{extension}")
+
+    def get(self, storage_key):
+        """
+        Return (local path, ETag) for a stored file, downloading it on a miss.
+        Returns None if the file is not in storage either.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT etag FROM files WHERE storage_key = ?", (storage_key,)).fetchone()
+            if row:
+                path = self._local_path(storage_key)
+                if os.path.exists(path):
+                    conn.execute("UPDATE files SET last_access = ? WHERE storage_key = ?", (time.time(), storage_key))
+                    conn.commit()
+                    return path, row[0]
+                conn.execute("DELETE FROM files WHERE storage_key = ?", (storage_key,))
+                conn.commit()
+        finally:
+            conn.close()
+
+        return self._download(storage_key)
+
+    def _download(self, storage_key):
+        chunks = storage_service.iter_object(storage_key)
+        if chunks is None:
+            return None
+
+        path = self._local_path(storage_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        digest = hashlib.md5()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        etag = digest.hexdigest()
+        self._index(storage_key, size, etag)
+        logging.info(f"Audio cache filled {storage_key} ({size} bytes)")
+        return path, etag
+
+    def put(self, storage_key, data):
+        """Seed the cache with a file that was just uploaded"""
+        try:
+            path = self._local_path(storage_key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self._index(storage_key, len(data), hashlib.md5(data).hexdigest())
+        except Exception as e:
+            logging.warning(f"Audio cache write error: {e}")
+
+    def _index(self, storage_key, size, etag):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (storage_key, size, etag, last_access) VALUES (?, ?, ?, ?)",
+                (storage_key, size, etag, time.time())
+            )
+            conn.commit()
+            self._evict(conn, keep=storage_key)
+        finally:
+            conn.close()
+
+    def _evict(self, conn, keep=None):
+        """Drop least recently used files until the cache fits in max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for storage_key, size in conn.execute(
+            "SELECT storage_key, size FROM files ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            if storage_key == keep:
+                continue
+            # Responses already sending the file keep their open handle
+            try:
+                os.unlink(self._local_path(storage_key))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM files WHERE storage_key = ?", (storage_key,))
+            total -= size
+            evicted += 1
+        conn.commit()
+        logging.info(f"Audio cache evicted {evicted} files ({total} bytes remain)")
+
+    def stats(self):
+        """Return file count and total bytes held locally"""
+        conn = self._connect()
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+            return {'files': count, 'bytes': total, 'max_bytes': self.max_bytes}
+        finally:
+            conn.close()
+
+
+# Global audio file cache instance
+audio_file_cache = AudioFileCache()
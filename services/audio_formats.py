@@ -0,0 +1,393 @@
+import sys
+import array
+import struct
+import hashlib
+from services.mp3_utils import join_mp3_segments, mp3_info, strip_id3
+
+# Render formats. Chunks are synthesized in segment_format and joined into
+# one file without re-encoding, except FLAC: its frames carry sequence
+# numbers and CRCs over the whole frame, so chunks are synthesized as raw PCM,
+# joined, and written out as FLAC here.
+OUTPUT_FORMATS = {
+    'mp3': {'content_type': 'audio/mpeg', 'extension': 'mp3', 'segment_format': 'mp3'},
+    'opus': {'content_type': 'audio/ogg', 'extension': 'opus', 'segment_format': 'opus'},
+    'aac': {'content_type': 'audio/aac', 'extension': 'aac', 'segment_format': 'aac'},
+    'flac': {'content_type': 'audio/flac', 'extension': 'flac', 'segment_format': 'pcm'},
+}
+
+# Raw PCM from the speech API: 24 kHz, 16-bit signed little-endian, mono
+PCM_SAMPLE_RATE = 24000
+PCM_CHANNELS = 1
+
+
+def content_type_for(storage_key):
+    """MIME type of a stored render from its file extension"""
+    extension = storage_key.rsplit('.', 1)[-1].lower() if storage_key else ''
+    for spec in OUTPUT_FORMATS.values():
+        if spec['extension'] == extension:
+            return spec['content_type']
+    return 'audio/mpeg'
+
+
+def _crc_table(poly, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+OGG_CRC_TABLE = _crc_table(0x04C11DB7, 32)
+FLAC_CRC8_TABLE = _crc_table(0x07, 8)
+FLAC_CRC16_TABLE = _crc_table(0x8005, 16)
+# CRC-16 advanced two bytes at a time; FLAC frames are almost all sample data
+FLAC_CRC16_WORD_TABLE = [
+    FLAC_CRC16_TABLE[(FLAC_CRC16_TABLE[high] >> 8) ^ low] ^ ((FLAC_CRC16_TABLE[high] << 8) & 0xFFFF)
+    for high in range(256) for low in range(256)
+]
+
+
+def ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def flac_crc8(data):
+    crc = 0
+    for byte in data:
+        crc = FLAC_CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def flac_crc16(data):
+    even = len(data) & ~1
+    words = array.array('H', data[:even])
+    if sys.byteorder == 'little':
+        words.byteswap()
+    crc = 0
+    table = FLAC_CRC16_WORD_TABLE
+    for word in words:
+        crc = table[crc ^ word]
+    for byte in data[even:]:
+        crc = ((crc << 8) & 0xFFFF) ^ FLAC_CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+# --- Ogg Opus ---
+
+OPUS_GRANULE_RATE = 48000
+# A 20 ms CELT frame with the silence flag set, per channel count
+OPUS_SILENCE = {1: b'\xf8\xff\xfe', 2: b'\xfc\xff\xfe'}
+OPUS_SILENCE_SAMPLES = 960
+OGG_PAGE_TARGET = 4096
+
+
+def iter_ogg_pages(data):
+    """Yield (header_type, granule, serial, lacing values, body) for each Ogg page"""
+    offset = 0
+    while offset + 27 <= len(data):
+        if data[offset:offset + 4] != b'OggS':
+            raise ValueError(f"No Ogg page at offset {offset}")
+        header_type, granule, serial, _, _, segment_count = struct.unpack_from('<BqIIIB', data, offset + 5)
+        lacing = data[offset + 27:offset + 27 + segment_count]
+        body_start = offset + 27 + segment_count
+        body_end = body_start + sum(lacing)
+        yield header_type, granule, serial, lacing, data[body_start:body_end]
+        offset = body_end
+
+
+def ogg_packets(data):
+    """Reassemble the packets of a single logical Ogg stream; returns (serial, [packets])"""
+    packets = []
+    serial = None
+    partial = bytearray()
+    for _, _, page_serial, lacing, body in iter_ogg_pages(data):
+        serial = page_serial if serial is None else serial
+        position = 0
+        for size in lacing:
+            partial += body[position:position + size]
+            position += size
+            if size < 255:
+                packets.append(bytes(partial))
+                partial = bytearray()
+    return serial, packets
+
+
+def opus_packet_samples(packet):
+    """Duration of an Opus packet in 48 kHz samples, from its TOC byte"""
+    if not packet:
+        return 0
+    config = packet[0] >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        frame = (480, 960)[config % 2]
+    else:
+        frame = (120, 240, 480, 960)[config % 4]
+    code = packet[0] & 3
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * frames
+
+
+def ogg_page(header_type, granule, serial, sequence, packets):
+    """Build one Ogg page holding whole packets (each under 255 * 255 bytes)"""
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    if len(lacing) > 255:
+        raise ValueError("Too many packets for one Ogg page")
+    header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, granule, serial, sequence, 0, len(lacing)) + bytes(lacing)
+    page = bytearray(header + b''.join(packets))
+    struct.pack_into('<I', page, 22, ogg_crc(page))
+    return bytes(page)
+
+
+def join_ogg_opus(segments, pauses=None):
+    """
+    Join Ogg Opus segments into a single logical stream: the first segment's
+    OpusHead and OpusTags, then every segment's audio packets re-paged with
+    continuous sequence numbers and granule positions. Pauses are 20 ms
+    silent CELT packets. Later segments keep their decoder pre-skip, a few
+    milliseconds of priming at each join.
+    """
+    serial, first = ogg_packets(segments[0])
+    if len(first) < 2 or not first[0].startswith(b'OpusHead'):
+        raise ValueError("Segment is not an Ogg Opus stream")
+    head, tags = first[0], first[1]
+    silence = OPUS_SILENCE.get(head[9])
+
+    pages = [ogg_page(0x02, 0, serial, 0, [head]), ogg_page(0, 0, serial, 1, [tags])]
+    sequence = 2
+    granule = 0
+    pending = []
+    pending_size = 0
+
+    def audio_packets():
+        for position, segment in enumerate(segments):
+            packets = first if position == 0 else ogg_packets(segment)[1]
+            yield from packets[2:]
+            pause = pauses[position] if pauses else 0
+            if pause and silence:
+                yield from [silence] * round(pause * OPUS_GRANULE_RATE / OPUS_SILENCE_SAMPLES)
+
+    for packet in audio_packets():
+        lacing = len(packet) // 255 + 1
+        if pending and (pending_size + lacing > 255 or sum(map(len, pending)) + len(packet) > OGG_PAGE_TARGET):
+            pages.append(ogg_page(0, granule, serial, sequence, pending))
+            sequence += 1
+            pending, pending_size = [], 0
+        pending.append(packet)
+        pending_size += lacing
+        granule += opus_packet_samples(packet)
+    pages.append(ogg_page(0x04, granule, serial, sequence, pending))
+    return b''.join(pages)
+
+
+def opus_info(data):
+    """Duration of an Ogg Opus stream from its last granule position and pre-skip"""
+    try:
+        pages = list(iter_ogg_pages(data))
+    except (ValueError, struct.error):
+        return None
+    if not pages or not pages[0][4].startswith(b'OpusHead'):
+        return None
+    pre_skip = struct.unpack_from('<H', pages[0][4], 10)[0]
+    granule = max(page[1] for page in pages)
+    return {'duration_seconds': max(0, granule - pre_skip) / OPUS_GRANULE_RATE, 'sample_rate': OPUS_GRANULE_RATE}
+
+
+# --- ADTS AAC ---
+
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+AAC_FRAME_SAMPLES = 1024
+# AAC-LC raw data blocks whose spectrum is all zero, by channel configuration
+AAC_SILENCE = {
+    1: b'\x00\xc8\x00\x80\x23\x80',
+    2: b'\x21\x00\x49\x90\x02\x19\x00\x23\x80',
+}
+
+
+def iter_adts_frames(data):
+    """Yield each ADTS frame in data, skipping ID3 tags and anything that isn't a frame"""
+    data = strip_id3(data)
+    offset = 0
+    while offset + 7 <= len(data):
+        if data[offset] == 0xFF and data[offset + 1] & 0xF6 == 0xF0:
+            length = ((data[offset + 3] & 0x03) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+            if length >= 7 and offset + length <= len(data):
+                yield data[offset:offset + length]
+                offset += length
+                continue
+        offset += 1
+
+
+def adts_silence(frame, count):
+    """count silent frames in the stream format of an ADTS frame, or b'' if it isn't mono or stereo AAC-LC"""
+    profile = frame[2] >> 6  # Object type - 1
+    channels = ((frame[2] & 0x01) << 2) | (frame[3] >> 6)
+    block = AAC_SILENCE.get(channels)
+    if not block or profile != 1 or not count:
+        return b''
+    length = 7 + len(block)
+    header = bytes([
+        0xFF,
+        frame[1] | 0x01,  # No CRC
+        frame[2],
+        (frame[3] & 0xFC) | (length >> 11),
+        (length >> 3) & 0xFF,
+        ((length & 0x07) << 5) | 0x1F,  # Buffer fullness 0x7FF: variable bitrate
+        0xFC,  # One raw data block
+    ])
+    return (header + block) * count
+
+
+def join_adts(segments, pauses=None):
+    """Join ADTS AAC segments frame by frame, with silent frames for pauses"""
+    joined = bytearray()
+    for position, segment in enumerate(segments):
+        last = None
+        for frame in iter_adts_frames(segment):
+            joined += frame
+            last = frame
+        pause = pauses[position] if pauses else 0
+        if pause and last:
+            sample_rate = ADTS_SAMPLE_RATES[(last[2] >> 2) & 0x0F]
+            joined += adts_silence(last, round(pause * sample_rate / AAC_FRAME_SAMPLES))
+    return bytes(joined)
+
+
+def adts_info(data):
+    """Frame count and duration of an ADTS AAC stream"""
+    frames = 0
+    sample_rate = None
+    for frame in iter_adts_frames(data):
+        if sample_rate is None:
+            index = (frame[2] >> 2) & 0x0F
+            if index >= len(ADTS_SAMPLE_RATES):
+                return None
+            sample_rate = ADTS_SAMPLE_RATES[index]
+        frames += (frame[6] & 0x03) + 1
+    if not frames:
+        return None
+    return {'duration_seconds': frames * AAC_FRAME_SAMPLES / sample_rate, 'sample_rate': sample_rate, 'frames': frames}
+
+
+# --- PCM and FLAC ---
+
+FLAC_BLOCK_SIZE = 4096
+
+
+def join_pcm(segments, pauses=None, sample_rate=PCM_SAMPLE_RATE, channels=PCM_CHANNELS):
+    """Join raw 16-bit PCM segments, with zero samples for pauses"""
+    joined = bytearray()
+    for position, segment in enumerate(segments):
+        joined += segment[:len(segment) - len(segment) % (2 * channels)]
+        pause = pauses[position] if pauses else 0
+        if pause:
+            joined += bytes(round(pause * sample_rate) * 2 * channels)
+    return bytes(joined)
+
+
+def _utf8_number(value):
+    """FLAC's UTF-8-style coding of a frame number"""
+    if value < 0x80:
+        return bytes([value])
+    length = 2
+    while value >= 1 << (5 * length + 1):
+        length += 1
+    encoded = [0x80 | ((value >> (6 * i)) & 0x3F) for i in range(length - 1)]
+    first = ((0xFF00 >> length) & 0xFF) | (value >> (6 * (length - 1)))
+    return bytes([first] + encoded[::-1])
+
+
+def encode_flac(pcm, sample_rate=PCM_SAMPLE_RATE, channels=PCM_CHANNELS, block_size=FLAC_BLOCK_SIZE):
+    """
+    Write 16-bit little-endian PCM as a FLAC stream. Blocks of digital
+    silence become constant subframes and everything else is stored
+    verbatim: the result is lossless and decodes bit-exactly (the STREAMINFO
+    MD5 lets decoders check), without the CPU cost of prediction in Python.
+    """
+    frame_bytes = 2 * channels
+    pcm = pcm[:len(pcm) - len(pcm) % frame_bytes]
+    total = len(pcm) // frame_bytes
+
+    samples = array.array('h', pcm)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    streaminfo = struct.pack('>HH', block_size, block_size) + b'\x00' * 6  # Frame sizes unknown
+    streaminfo += ((sample_rate << 44) | ((channels - 1) << 41) | (15 << 36) | total).to_bytes(8, 'big')
+    streaminfo += hashlib.md5(pcm).digest()
+    output = [b'fLaC', bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo]
+
+    for number, start in enumerate(range(0, total, block_size)):
+        count = min(block_size, total - start)
+        if count == block_size:
+            header = bytearray([0xFF, 0xF8, 0xC0, ((channels - 1) << 4) | 0x08])
+            header += _utf8_number(number)
+        else:
+            header = bytearray([0xFF, 0xF8, 0x70, ((channels - 1) << 4) | 0x08])
+            header += _utf8_number(number) + struct.pack('>H', count - 1)
+        header.append(flac_crc8(header))
+
+        frame = bytearray(header)
+        for channel in range(channels):
+            block = samples[start * channels + channel:(start + count) * channels:channels]
+            if block.count(block[0]) == count:
+                frame += b'\x00' + struct.pack('>h', block[0])
+            else:
+                if sys.byteorder == 'little':
+                    block.byteswap()
+                frame += b'\x02' + block.tobytes()
+        frame += struct.pack('>H', flac_crc16(frame))
+        output.append(bytes(frame))
+    return b''.join(output)
+
+
+def flac_info(data):
+    """Sample rate and duration from a FLAC stream's STREAMINFO block"""
+    if data[:4] != b'fLaC' or len(data) < 42 or data[4] & 0x7F != 0:
+        return None
+    packed = int.from_bytes(data[18:26], 'big')
+    sample_rate = packed >> 44
+    total = packed & ((1 << 36) - 1)
+    if not sample_rate:
+        return None
+    return {'duration_seconds': total / sample_rate, 'sample_rate': sample_rate}
+
+
+def join_segments(output_format, segments, pauses=None):
+    """Join synthesized chunks into one file of output_format"""
+    if output_format == 'mp3':
+        return join_mp3_segments(segments, pauses)
+    if output_format == 'opus':
+        return join_ogg_opus(segments, pauses)
+    if output_format == 'aac':
+        return join_adts(segments, pauses)
+    if output_format == 'flac':
+        return encode_flac(join_pcm(segments, pauses))
+    raise ValueError(f"Unsupported output format: {output_format}")
+
+
+def audio_info(output_format, data):
+    """Duration and stream details of a render, or None if it can't be read"""
+    if output_format == 'mp3':
+        return mp3_info(data)
+    if output_format == 'opus':
+        return opus_info(data)
+    if output_format == 'aac':
+        return adts_info(data)
+    if output_format == 'flac':
+        return flac_info(data)
+    return None
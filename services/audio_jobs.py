@@ -0,0 +1,328 @@
+import logging
+from datetime import datetime
+from app import db
+from models import Project, Chapter, ChapterAudio, AudioJob, AudioVariant
+from services import job_queue
+from services.tts_service import tts_service
+from services.chapter_audio import chapter_speech_text, chapter_content_hash
+from services.segment_cache import segment_cache, SegmentCache
+from services.lexicon import project_lexicon
+from services.scheduler import scheduler
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when its cancellation has been requested"""
+
+
+class JobCheckpoint:
+    """
+    Per-chunk checkpoint for a render job, kept in AudioJob.manifest. Each
+    finished chunk is recorded with the storage key and byte length of its
+    segment, so a retried job (or a new job for the same text after a crash)
+    only synthesizes the chunks that are missing.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.manifest = {}
+        self.response_format = 'mp3'
+
+    def restore(self, plan_id, chunks, response_format='mp3'):
+        """Return {chunk position: audio bytes} for chunks already finished under this plan"""
+        manifest = job_queue.load_manifest(self.job)
+        if manifest.get('plan_id') != plan_id:
+            manifest = job_queue.previous_manifest(self.job, plan_id) or {}
+        self.manifest = {'plan_id': plan_id, 'chunks': {}}
+        self.response_format = response_format
+
+        restored = {}
+        for position, entry in manifest.get('chunks', {}).items():
+            position = int(position)
+            if position >= len(chunks):
+                continue
+            audio = segment_cache.get(entry['segment_key'], response_format)
+            if audio is None or len(audio) != entry['bytes']:
+                logging.warning(f"Job {self.job.id}: checkpointed chunk {position} is missing, re-synthesizing")
+                continue
+            restored[position] = audio
+            self.manifest['chunks'][str(position)] = entry
+
+        job_queue.save_manifest(self.job.id, self.manifest)
+        return restored
+
+    def save(self, position, segment_key, size):
+        """Record a finished chunk"""
+        self.manifest['chunks'][str(position)] = {
+            'segment_key': segment_key,
+            'storage_key': SegmentCache.storage_key(segment_key, self.response_format),
+            'bytes': size
+        }
+        job_queue.save_manifest(self.job.id, self.manifest)
+
+
+def render_project(job, payload, progress_callback):
+    """
+    Synthesize the full project manuscript. MP3 renders become the project's
+    audio; other formats are stored as variants beside it.
+    """
+    project = db.session.get(Project, job.project_id)
+    if not project:
+        raise ValueError(f"Project {job.project_id} no longer exists")
+
+    content = project.content
+    if not content or not content.strip():
+        raise ValueError("No content to convert")
+
+    response_format = payload.get('format', 'mp3')
+    result = tts_service.generate_audio(
+        text=content,
+        voice=payload.get('voice', 'alloy'),
+        project_id=project.id,
+        progress_callback=progress_callback,
+        checkpoint=JobCheckpoint(job),
+        lexicon=project_lexicon(project),
+        response_format=response_format
+    )
+    if not result['success']:
+        raise RuntimeError(result.get('error', 'Audio generation failed'))
+
+    if response_format == 'mp3':
+        if not attach_project_audio(project.id, result, job.id):
+            logging.info(f"Job {job.id}: project {project.id} was claimed by a newer render, leaving its audio alone")
+    else:
+        # Variants never hold the claim; an MP3 render in flight settles the status
+        Project.query.filter(Project.id == project.id, _unclaimed()).update(
+            {'status': 'audio_generated'}, synchronize_session=False
+        )
+        variant = AudioVariant.query.filter_by(project_id=project.id, format=response_format).first()
+        if not variant:
+            variant = AudioVariant()
+            variant.project_id = project.id
+            variant.format = response_format
+            db.session.add(variant)
+        variant.voice = result.get('voice')
+        variant.storage_key = result.get('storage_key')
+        variant.audio_url = result.get('audio_url')
+        variant.duration_seconds = result.get('duration_seconds')
+        variant.rendered_at = datetime.now()
+    db.session.commit()
+
+    return {
+        'audio_url': result.get('audio_url'),
+        'format': response_format,
+        'duration_estimate': result.get('duration_estimate'),
+        'duration_seconds': result.get('duration_seconds'),
+        'voice': result.get('voice'),
+        'chunk_count': result.get('chunk_count'),
+        'cached_chunks': result.get('cached_chunks')
+    }
+
+
+def render_chapter(job, payload, progress_callback):
+    """Synthesize one chapter at the tier it was queued for and record the render on its ChapterAudio row"""
+    chapter = Chapter.query.filter_by(id=job.chapter_id, project_id=job.project_id).first()
+    if not chapter:
+        raise ValueError(f"Chapter {job.chapter_id} no longer exists")
+
+    # Hash the text actually rendered; the chapter may be edited again mid-render
+    text = chapter_speech_text(chapter)
+    content_hash = chapter_content_hash(chapter)
+    if not text.strip():
+        raise ValueError("No content to convert")
+
+    model = tts_service.model_for(payload.get('tier', 'draft'))
+    result = tts_service.generate_audio(
+        text=text,
+        voice=payload.get('voice', 'alloy'),
+        project_id=job.project_id,
+        chapter_id=chapter.id,
+        progress_callback=progress_callback,
+        checkpoint=JobCheckpoint(job),
+        lexicon=project_lexicon(chapter.project),
+        model=model
+    )
+    if not result['success']:
+        raise RuntimeError(result.get('error', 'Audio generation failed'))
+
+    audio = chapter.audio
+    if not audio:
+        audio = ChapterAudio()
+        audio.chapter_id = chapter.id
+        audio.project_id = job.project_id
+        db.session.add(audio)
+    audio.content_hash = content_hash
+    audio.voice = result.get('voice')
+    audio.model = tts_service.engine_model_for(model)
+    audio.duration_seconds = result.get('duration_seconds')
+    audio.frame_count = result.get('frame_count')
+    audio.storage_key = result.get('storage_key')
+    audio.audio_url = result.get('audio_url')
+    # A newer render queued while this one ran keeps the chapter marked as queued
+    if audio.job_id in (None, job.id):
+        audio.status = 'ready'
+    audio.error = None
+    audio.rendered_at = datetime.now()
+    db.session.commit()
+
+    return {
+        'chapter_id': chapter.id,
+        'audio_url': result.get('audio_url'),
+        'duration_seconds': audio.duration_seconds,
+        'voice': result.get('voice'),
+        'tier': payload.get('tier', 'draft'),
+        'chunk_count': result.get('chunk_count'),
+        'cached_chunks': result.get('cached_chunks')
+    }
+
+
+def _unclaimed(job_id=None):
+    """
+    Condition that no render other than job_id holds the project's claim;
+    with job_id None, that no queued or running job holds it
+    """
+    if job_id is not None:
+        return db.or_(Project.audio_job_id.is_(None), Project.audio_job_id == job_id)
+    holder_active = db.exists().where(
+        AudioJob.id == Project.audio_job_id,
+        AudioJob.status.in_(job_queue.ACTIVE_STATUSES)
+    )
+    return db.or_(Project.audio_job_id.is_(None), ~holder_active)
+
+
+def attach_project_audio(project_id, result, job_id=None):
+    """
+    Make a finished MP3 render the project's audio, as one conditional UPDATE
+    on the render claim: a job writes only while it still holds the claim,
+    and a stream (job_id None) only while no queued or running job holds it.
+    Returns False, leaving the project untouched, when another render owns it.
+    """
+    updated = Project.query.filter(Project.id == project_id, _unclaimed(job_id)).update({
+        'status': 'audio_generated',
+        'audio_url': result.get('audio_url'),
+        'audio_storage_key': result.get('storage_key'),
+        'audio_voice': result.get('voice'),
+        'audio_duration': result.get('duration_estimate'),
+        'audio_generated_at': datetime.now()
+    }, synchronize_session=False)
+    db.session.commit()
+    return updated == 1
+
+
+def _claim_project(project_id, observed_job_id):
+    """
+    Compare-and-set of the project's render claim: succeeds only if the claim
+    still holds the job the caller saw, so concurrent requests can't both win
+    """
+    def claim(job):
+        held = Project.audio_job_id.is_(None) if observed_job_id is None else Project.audio_job_id == observed_job_id
+        return Project.query.filter(Project.id == project_id, held).update(
+            {'status': 'generating_audio', 'audio_job_id': job.id}, synchronize_session=False
+        ) == 1
+    return claim
+
+
+def _renders_same(job, voice, response_format):
+    """True if a queued or running project job renders this voice and format"""
+    payload = job_queue.load_payload(job)
+    return (
+        job.kind == 'project' and job.status in job_queue.ACTIVE_STATUSES
+        and payload.get('format', 'mp3') == response_format and payload.get('voice') == voice
+    )
+
+
+def _queue_variant_render(project, user_id, voice, idempotency_key, response_format):
+    """Queue a render in another format beside the MP3; it leaves the project's claim alone"""
+    active = AudioJob.query.filter(
+        AudioJob.project_id == project.id,
+        AudioJob.kind == 'project',
+        AudioJob.status.in_(job_queue.ACTIVE_STATUSES)
+    ).order_by(AudioJob.id).all()
+    for current in active:
+        if _renders_same(current, voice, response_format):
+            return current, False
+
+    job = job_queue.enqueue(
+        user_id=user_id,
+        project_id=project.id,
+        kind='project',
+        payload={'voice': voice, 'format': response_format},
+        idempotency_key=idempotency_key
+    )
+    return job, True
+
+
+def queue_project_render(project, user_id, voice, idempotency_key=None, response_format='mp3'):
+    """
+    Queue a full render of the project unless the same voice and format is
+    already queued or running. An MP3 render in another voice takes the
+    project's claim from the one in flight; other formats are variants and
+    never hold it. A repeated idempotency key returns the job it first
+    created. Returns (job, created).
+    """
+    existing = job_queue.find_idempotent(user_id, idempotency_key)
+    if existing:
+        return existing, False
+
+    if response_format != 'mp3':
+        return _queue_variant_render(project, user_id, voice, idempotency_key, response_format)
+
+    for _ in range(3):
+        observed = project.audio_job_id
+        current = db.session.get(AudioJob, observed) if observed else None
+        if current and _renders_same(current, voice, response_format):
+            return current, False
+
+        job = job_queue.enqueue(
+            user_id=user_id,
+            project_id=project.id,
+            kind='project',
+            payload={'voice': voice, 'format': response_format},
+            idempotency_key=idempotency_key,
+            claim=_claim_project(project.id, observed)
+        )
+        if job:
+            return job, True
+        # Another request claimed the project first; look at its job
+        db.session.refresh(project)
+
+    raise RuntimeError(f"Could not claim project {project.id} for rendering")
+
+
+# Job kind -> handler(job, payload, progress_callback) returning a JSON-serializable result
+JOB_HANDLERS = {
+    'project': render_project,
+    'chapter': render_chapter,
+}
+
+# Job kind -> scheduler priority class for the TTS calls it makes
+JOB_PRIORITIES = {
+    'project': 'book',
+    'chapter': 'chapter',
+}
+
+
+def run_job(job, progress_callback):
+    """Dispatch a claimed job to its handler"""
+    handler = JOB_HANDLERS.get(job.kind)
+    if not handler:
+        raise ValueError(f"Unknown job kind: {job.kind}")
+
+    payload = job_queue.load_payload(job)
+    with scheduler.context(user_id=job.user_id, priority=JOB_PRIORITIES.get(job.kind, 'book')):
+        return handler(job, payload, progress_callback)
+
+
+def settle_job(job):
+    """Release project or chapter state once a job will not run again"""
+    if job.kind == 'chapter':
+        audio = ChapterAudio.query.filter_by(chapter_id=job.chapter_id, job_id=job.id).first()
+        if audio and audio.status == 'queued':
+            audio.status = 'failed' if job.status == 'failed' else ('ready' if audio.rendered_at else 'pending')
+            audio.error = job.error
+            db.session.commit()
+        return
+
+    project = db.session.get(Project, job.project_id)
+    if project and project.status == 'generating_audio' and project.audio_job_id in (None, job.id):
+        project.status = 'audio_generated' if project.audio_url or project.audio_variants else 'draft'
+        db.session.commit()
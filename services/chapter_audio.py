@@ -0,0 +1,222 @@
+import hashlib
+import logging
+from datetime import datetime
+from html.parser import HTMLParser
+from app import db
+from models import Chapter, ChapterAudio, AudioJob
+from services import job_queue
+from services.segment_cache import normalize_segment_text
+from services.lexicon import project_lexicon
+from services.tts_service import tts_service
+
+# Block-level tags that end a paragraph in editor (Quill) HTML
+BLOCK_TAGS = {'p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'blockquote', 'pre', 'ol', 'ul'}
+SKIP_TAGS = {'script', 'style'}
+
+
+class _SpeechTextParser(HTMLParser):
+    """Collects the readable text of editor HTML, keeping paragraph breaks"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'br':
+            self.parts.append('\n')
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(content):
+    """Convert editor HTML to plain text; plain text passes through unchanged"""
+    if not content:
+        return ''
+    if '<' not in content:
+        return content
+
+    parser = _SpeechTextParser()
+    parser.feed(content)
+    parser.close()
+    text = ''.join(parser.parts)
+    paragraphs = [p.strip() for p in text.split('\n\n')]
+    return '\n\n'.join(p for p in paragraphs if p)
+
+
+def chapter_speech_text(chapter):
+    """The text read aloud for a chapter: its title followed by its content"""
+    body = html_to_text(chapter.content)
+    title = (chapter.title or '').strip()
+    if title and body:
+        return f"{title}\n\n{body}"
+    return title or body
+
+
+def chapter_content_hash(chapter):
+    """
+    Hash of a chapter's spoken text after pronunciation respellings,
+    insensitive to whitespace-only edits. Lexicon edits only make the
+    chapters that use the changed terms stale.
+    """
+    text = chapter_speech_text(chapter)
+    lexicon = project_lexicon(chapter.project)
+    if lexicon:
+        text = lexicon.apply(text)
+    text = normalize_segment_text(text)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chapter_tier(chapter):
+    """Quality tier a chapter is rendered at: 'final' once marked final, else 'draft'"""
+    return 'final' if chapter.is_final else 'draft'
+
+
+def tier_engine_models(tier):
+    """Engine models whose audio satisfies a tier; final audio is good enough for a draft"""
+    models = {tts_service.engine_model_for(tts_service.model_for('final'))}
+    if tier == 'draft':
+        models.add(tts_service.engine_model_for(tts_service.model_for('draft')))
+    return models
+
+
+def is_stale(chapter, voice):
+    """True if the chapter's audio is missing, was rendered from other text or voice, or is below the chapter's tier"""
+    audio = chapter.audio
+    if not audio or audio.status != 'ready':
+        return True
+    return (
+        audio.content_hash != chapter_content_hash(chapter)
+        or audio.voice != voice
+        or audio.model not in tier_engine_models(chapter_tier(chapter))
+    )
+
+
+def chapter_status(chapter, voice):
+    """Describe a chapter's audio state for the chapter status endpoint"""
+    audio = chapter.audio
+    return {
+        'chapter_id': chapter.id,
+        'title': chapter.title,
+        'order_index': chapter.order_index,
+        'tier': chapter_tier(chapter),
+        'status': audio.status if audio else 'pending',
+        'stale': is_stale(chapter, voice),
+        'voice': audio.voice if audio else None,
+        'model': audio.model if audio else None,
+        'duration_seconds': audio.duration_seconds if audio else None,
+        'audio_url': audio.audio_url if audio else None,
+        'rendered_at': audio.rendered_at.isoformat() if audio and audio.rendered_at else None
+    }
+
+
+def _claim_chapter(audio_id, observed_job_id):
+    """Compare-and-set of a chapter's render claim, like a project's (see audio_jobs.queue_project_render)"""
+    def claim(job):
+        held = ChapterAudio.job_id.is_(None) if observed_job_id is None else ChapterAudio.job_id == observed_job_id
+        return ChapterAudio.query.filter(ChapterAudio.id == audio_id, held).update(
+            {'status': 'queued', 'job_id': job.id, 'error': None}, synchronize_session=False
+        ) == 1
+    return claim
+
+
+def queue_chapter_render(chapter, user_id, voice):
+    """
+    Queue a render of one chapter at its tier, unless a render of the same
+    text, voice and tier is already queued. Returns the job, or None if a
+    concurrent request claimed the chapter and its job has already finished.
+    """
+    content_hash = chapter_content_hash(chapter)
+    tier = chapter_tier(chapter)
+    audio = chapter.audio
+    if audio and audio.status == 'queued' and audio.job_id:
+        pending = db.session.get(AudioJob, audio.job_id)
+        if pending and pending.status in job_queue.ACTIVE_STATUSES:
+            payload = job_queue.load_payload(pending)
+            if (payload.get('content_hash') == content_hash and payload.get('voice') == voice
+                    and payload.get('tier', 'draft') == tier):
+                return pending
+
+    if not audio:
+        audio = ChapterAudio()
+        audio.chapter_id = chapter.id
+        audio.project_id = chapter.project_id
+        db.session.add(audio)
+        db.session.commit()
+
+    job = job_queue.enqueue(
+        user_id=user_id,
+        project_id=chapter.project_id,
+        chapter_id=chapter.id,
+        kind='chapter',
+        payload={'voice': voice, 'content_hash': content_hash, 'tier': tier},
+        claim=_claim_chapter(audio.id, audio.job_id)
+    )
+    if job:
+        return job
+
+    # A concurrent request queued this chapter first; report its job
+    db.session.refresh(audio)
+    pending = db.session.get(AudioJob, audio.job_id) if audio.job_id else None
+    if pending and pending.status in job_queue.ACTIVE_STATUSES:
+        return pending
+    return None
+
+
+def regenerate_stale(project, user_id, voice):
+    """
+    Queue a render for every chapter whose audio is stale, each at its own
+    tier. Chapters that are already queued for the same text and voice are
+    not queued twice.
+    Returns (queued jobs, number of up-to-date chapters).
+    """
+    chapters = Chapter.query.filter_by(project_id=project.id).order_by(Chapter.order_index).all()
+    jobs = []
+    fresh = 0
+
+    for chapter in chapters:
+        if not chapter_speech_text(chapter).strip():
+            continue
+        if not is_stale(chapter, voice):
+            fresh += 1
+            continue
+
+        job = queue_chapter_render(chapter, user_id, voice)
+        if job:
+            jobs.append(job)
+
+    logging.info(f"Project {project.id}: queued {len(jobs)} stale chapters, {fresh} up to date")
+    return jobs, fresh
+
+
+def set_chapter_final(chapter, user_id, final, voice=None):
+    """
+    Mark a chapter final (or back to draft). Marking it final promotes it:
+    an HD render is queued straight away, which reuses the draft's chunk plan
+    so only chunks without HD audio yet are synthesized. Returns the queued
+    job, if any.
+    """
+    chapter.is_final = bool(final)
+    chapter.finalized_at = datetime.now() if final else None
+    db.session.commit()
+
+    if not final or not chapter_speech_text(chapter).strip():
+        return None
+    voice = voice or (chapter.audio.voice if chapter.audio and chapter.audio.voice else None) or chapter.project.audio_voice or 'alloy'
+    if not is_stale(chapter, voice):
+        return None
+    job = queue_chapter_render(chapter, user_id, voice)
+    logging.info(f"Chapter {chapter.id} marked final; promotion job {job.id if job else None}")
+    return job
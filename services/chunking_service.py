@@ -0,0 +1,123 @@
+import re
+import logging
+from services.text_frontend import TITLES, ABBREVIATIONS
+
+# OpenAI TTS rejects inputs longer than 4096 characters per request
+TTS_INPUT_LIMIT = 4096
+DEFAULT_MAX_CHARS = 4000
+
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?…])["\'”’)\]]*\s+')
+# A period after these is part of the word, not the end of a sentence
+NO_BREAK_AFTER = frozenset([f"{title}." for title in TITLES] + ['Lt.', 'No.'] + list(ABBREVIATIONS))
+INITIALS = re.compile(r'(?:^|\W)(?:[A-Za-z]\.){2,}$|(?:^|\W)[A-Z]\.$')  # p.m., U.S., J.
+
+
+def split_paragraphs(text):
+    """Split text into non-empty paragraphs on blank lines"""
+    return [p.strip() for p in PARAGRAPH_BREAK.split(text) if p.strip()]
+
+
+def _abbreviated(paragraph, position):
+    """True if the word ending at position is a title, abbreviation or initial rather than a sentence end"""
+    before = paragraph[max(0, position - 32):position].split()
+    if not before:
+        return False
+    word = before[-1].lstrip('("\'“‘[')
+    return word in NO_BREAK_AFTER or bool(INITIALS.search(word))
+
+
+def split_sentences(paragraph):
+    """Split a paragraph into sentences, keeping trailing punctuation"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_BREAK.finditer(paragraph):
+        if _abbreviated(paragraph, match.start()):
+            continue
+        sentence = paragraph[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = paragraph[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def _hard_split(sentence, max_chars):
+    """Split an oversized sentence on whitespace, falling back to raw slices"""
+    pieces = []
+    current = ''
+    for word in sentence.split():
+        while len(word) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(word[:max_chars])
+            word = word[max_chars:]
+        candidate = f"{current} {word}" if current else word
+        if len(candidate) > max_chars:
+            # Carry a trailing title over so it stays with the name it precedes
+            head, _, last = current.rpartition(' ')
+            if head and last in NO_BREAK_AFTER and len(last) + 1 + len(word) <= max_chars:
+                pieces.append(head)
+                current = f"{last} {word}"
+            else:
+                pieces.append(current)
+                current = word
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def plan_chunks(text, max_chars=DEFAULT_MAX_CHARS):
+    """
+    Split text into synthesis chunks no longer than max_chars.
+    Chunks end on paragraph boundaries where possible and on sentence
+    boundaries otherwise. Each chunk is a dict with its index, text and the
+    kind of boundary that follows it ('sentence', 'paragraph' or 'end').
+    """
+    if not text or not text.strip():
+        return []
+
+    max_chars = max(1, min(int(max_chars), TTS_INPUT_LIMIT))
+    chunks = []
+    current = []
+    current_len = 0
+
+    def flush(boundary):
+        nonlocal current, current_len
+        if current:
+            chunks.append({'text': ' '.join(current), 'boundary': boundary})
+        current = []
+        current_len = 0
+
+    for paragraph in split_paragraphs(text):
+        # Start a fresh chunk when the whole paragraph doesn't fit the remainder
+        if current and current_len + 1 + len(paragraph) > max_chars:
+            flush('paragraph')
+
+        for sentence in split_sentences(paragraph):
+            pieces = [sentence] if len(sentence) <= max_chars else _hard_split(sentence, max_chars)
+            for piece in pieces:
+                added = len(piece) + (1 if current else 0)
+                if current and current_len + added > max_chars:
+                    flush('sentence')
+                    added = len(piece)
+                current.append(piece)
+                current_len += added
+
+        # Keep the paragraph break; the chunk may still absorb the next paragraph
+        current[-1] = current[-1] + '\n\n'
+        current_len += 2
+
+    flush('end')
+
+    for index, chunk in enumerate(chunks):
+        chunk['index'] = index
+        chunk['text'] = chunk['text'].strip()
+
+    logging.debug(f"Planned {len(chunks)} chunks from {len(text)} characters (budget {max_chars})")
+    return chunks
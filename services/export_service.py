@@ -0,0 +1,146 @@
+import io
+import re
+import logging
+from datetime import datetime
+from app import db
+from models import Chapter
+from services import storage_service
+from services.chapter_audio import chapter_speech_text, chapter_content_hash
+from services.mp3_utils import chapter_tag, iter_audio_payload, mp3_info, parse_frame_header, silence_like
+from services.tts_service import PAUSE_SECONDS
+
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+
+class ExportError(Exception):
+    """Raised when a project cannot be exported as it stands"""
+
+
+class GeneratorReader(io.RawIOBase):
+    """Read-only file object over a bytes generator, for streaming uploads"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self.buffer:
+            try:
+                self.buffer = memoryview(next(self.generator))
+            except StopIteration:
+                return 0
+        size = min(len(target), len(self.buffer))
+        target[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def export_chapters(project):
+    """
+    Chapters to include in the audiobook, in reading order. Every chapter with
+    text must have ready audio rendered from its current text.
+    """
+    chapters = Chapter.query.filter_by(project_id=project.id).order_by(Chapter.order_index).all()
+    included = []
+    missing = []
+    for chapter in chapters:
+        if not chapter_speech_text(chapter).strip():
+            continue
+        audio = chapter.audio
+        if (not audio or audio.status != 'ready' or not audio.storage_key
+                or audio.content_hash != chapter_content_hash(chapter)):
+            missing.append(chapter.title)
+            continue
+        included.append(chapter)
+
+    if missing:
+        raise ExportError(f"Chapters need audio before export: {', '.join(missing)}")
+    if not included:
+        raise ExportError("No chapter audio to export")
+    return included
+
+
+def measure_chapter(audio):
+    """
+    Fill in the frame count and exact duration of a render made before they
+    were recorded. Only legacy rows take this path.
+    """
+    data = storage_service.download_bytes(audio.storage_key)
+    info = mp3_info(data) if data else None
+    if not info:
+        raise ExportError(f"Audio for chapter {audio.chapter_id} is missing or unreadable")
+    audio.frame_count = info['frames']
+    audio.duration_seconds = info['duration_seconds']
+    db.session.commit()
+
+
+def chapter_timeline(chapters):
+    """
+    Chapter markers and the silence between chapters, from the recorded frame
+    counts. Returns ([(title, start_ms, end_ms)], [pause frames after each
+    chapter]); a chapter's marker includes the pause that follows it.
+    """
+    timeline = []
+    pauses = []
+    elapsed = 0.0
+    for position, chapter in enumerate(chapters):
+        audio = chapter.audio
+        if not audio.frame_count:
+            measure_chapter(audio)
+        frame_seconds = audio.duration_seconds / audio.frame_count
+        pause = round(PAUSE_SECONDS['chapter'] / frame_seconds) if position < len(chapters) - 1 else 0
+        start = elapsed
+        elapsed += audio.duration_seconds + pause * frame_seconds
+        timeline.append((chapter.title, round(start * 1000), round(elapsed * 1000)))
+        pauses.append(pause)
+    return timeline, pauses
+
+
+def prepare_export(project):
+    """
+    Validate the project and build its chapter tag up front, so problems are
+    reported before any audio is sent. Returns (tag, chapters, pauses).
+    """
+    chapters = export_chapters(project)
+    timeline, pauses = chapter_timeline(chapters)
+    return chapter_tag(project.title, timeline), chapters, pauses
+
+
+def iter_audiobook(tag, chapters, pauses):
+    """
+    Yield the whole audiobook as one MP3: the ID3v2.4 tag with CHAP/CTOC
+    markers followed by every chapter's frames, copied from storage without
+    decoding, with pre-encoded silence between chapters. Memory use is one
+    download chunk regardless of book length.
+    """
+    yield tag
+    for chapter, pause in zip(chapters, pauses):
+        chunks = storage_service.iter_object(chapter.audio.storage_key, EXPORT_CHUNK_SIZE)
+        if chunks is None:
+            raise ExportError(f"Audio for chapter '{chapter.title}' is missing from storage")
+        frame = None
+        for data in iter_audio_payload(chunks):
+            if frame is None:
+                frame = parse_frame_header(data, 0)
+            yield data
+        if frame and pause:
+            yield silence_like(frame, pause)
+
+
+def export_filename(project):
+    """Download filename for the project's audiobook"""
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', project.title or '').strip('_') or f'project_{project.id}'
+    return f"{slug}.mp3"
+
+
+def export_to_storage(project):
+    """Stream the audiobook into storage as a multipart upload and return its key"""
+    tag, chapters, pauses = prepare_export(project)
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    key = f"audio/exports/{project.user_id}/{project.id}/audiobook_{timestamp}.mp3"
+    storage_service.upload_stream(GeneratorReader(iter_audiobook(tag, chapters, pauses)), key, 'audio/mpeg')
+    logging.info(f"Exported project {project.id} audiobook with {len(chapters)} chapters to {key}")
+    return key
@@ -0,0 +1,67 @@
+from models import Chapter
+from services.tts_service import tts_service
+from services.chapter_audio import chapter_speech_text, chapter_tier, is_stale
+from services.lexicon import project_lexicon
+
+
+def _plan_item(text, voice, lexicon, model):
+    chunks = tts_service.plan_synthesis(text, lexicon)
+    billable = tts_service.billable_chunks(chunks, voice, model)
+    return tts_service.forecast(chunks, voice, billable, model), billable
+
+
+def plan_generation(project, voice, scope='project', chapter_ids=None):
+    """
+    Dry run of a render: the real normalizer and chunker run over the
+    manuscript (scope='project') or its chapters (scope='chapters',
+    optionally limited to chapter_ids) and each item is forecast against the
+    segment cache. Chapters marked final are priced at the final tier, the
+    manuscript at the draft tier. Nothing is synthesized. Totals include the
+    render time for all billable chunks together at the current concurrency.
+    """
+    lexicon = project_lexicon(project)
+    items = []
+    billable = {}  # model -> billable chunk sizes
+
+    if scope == 'chapters':
+        query = Chapter.query.filter_by(project_id=project.id)
+        if chapter_ids:
+            query = query.filter(Chapter.id.in_(chapter_ids))
+        for chapter in query.order_by(Chapter.order_index).all():
+            text = chapter_speech_text(chapter)
+            if not text.strip():
+                continue
+            tier = chapter_tier(chapter)
+            model = tts_service.model_for(tier)
+            forecast, chunk_billable = _plan_item(text, voice, lexicon, model)
+            forecast.update(
+                chapter_id=chapter.id,
+                title=chapter.title,
+                tier=tier,
+                stale=is_stale(chapter, voice)
+            )
+            items.append(forecast)
+            billable.setdefault(model, []).extend(chunk_billable)
+    elif project.content and project.content.strip():
+        model = tts_service.model_for('draft')
+        forecast, billable[model] = _plan_item(project.content, voice, lexicon, model)
+        forecast.update(chapter_id=None, title=project.title, tier='draft')
+        items.append(forecast)
+
+    characters = sum(item['character_count'] for item in items)
+    billable_characters = sum(sum(sizes) for sizes in billable.values())
+    return {
+        'scope': scope,
+        'voice': voice,
+        'models': sorted(billable),  # Models the items are priced at; each item names its own
+        'items': items,
+        'totals': {
+            'chunk_count': sum(item['chunk_count'] for item in items),
+            'cached_chunks': sum(item['cached_chunks'] for item in items),
+            'character_count': characters,
+            'billable_characters': billable_characters,
+            'estimated_cost_usd': round(sum(item['estimated_cost_usd'] for item in items), 4),
+            'estimated_audio_seconds': round(sum(item['estimated_audio_seconds'] for item in items), 1),
+            'estimated_render_seconds': round(sum(tts_service.estimate_wall_clock(sizes, model) for model, sizes in billable.items()), 1)
+        }
+    }
@@ -0,0 +1,305 @@
+import os
+import json
+import random
+import logging
+from datetime import datetime, timedelta
+from app import db
+from models import AudioJob
+
+# Queue configuration
+LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 120))
+RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', 30))
+RETRY_MAX_SECONDS = int(os.environ.get('JOB_RETRY_MAX_SECONDS', 900))
+
+CLAIM_CANDIDATES = 50
+# Smaller kinds of work are claimed first, so a chapter isn't stuck behind whole books
+KIND_ORDER = {'chapter': 0, 'project': 1}
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+
+def enqueue(user_id, project_id, kind='project', payload=None, chapter_id=None, max_attempts=3,
+            idempotency_key=None, claim=None):
+    """
+    Add a job to the queue. The caller's session is committed so the job is
+    visible to workers immediately. If claim is given it is called with the
+    flushed job before the commit; when it returns False the whole
+    transaction is rolled back and None is returned, so the job only exists
+    if the claim succeeded.
+    """
+    job = AudioJob()
+    job.user_id = user_id
+    job.project_id = project_id
+    job.chapter_id = chapter_id
+    job.kind = kind
+    job.payload = json.dumps(payload or {})
+    job.max_attempts = max_attempts
+    job.idempotency_key = idempotency_key
+    job.status = 'queued'
+    job.run_after = datetime.now()
+
+    db.session.add(job)
+    if claim:
+        db.session.flush()
+        if not claim(job):
+            db.session.rollback()
+            return None
+    db.session.commit()
+
+    logging.info(f"Enqueued {kind} job {job.id} for project {project_id}")
+    return job
+
+
+def find_idempotent(user_id, idempotency_key):
+    """The job a user already submitted under an idempotency key, if any"""
+    if not idempotency_key:
+        return None
+    return AudioJob.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).order_by(AudioJob.id).first()
+
+
+def load_payload(job):
+    """Decode a job's JSON payload"""
+    return json.loads(job.payload) if job.payload else {}
+
+
+def load_manifest(job):
+    """Decode a job's chunk checkpoint manifest"""
+    return json.loads(job.manifest) if job.manifest else {}
+
+
+def save_manifest(job_id, manifest):
+    """Persist a job's checkpoint manifest immediately, independent of the handler's own commits"""
+    AudioJob.query.filter(AudioJob.id == job_id).update(
+        {'manifest': json.dumps(manifest)}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def previous_manifest(job, plan_id):
+    """
+    Checkpoint manifest of an earlier job for the same work and the same
+    chunk plan, so a fresh request after a crash or cancel can resume it
+    """
+    earlier = AudioJob.query.filter(
+        AudioJob.id != job.id,
+        AudioJob.project_id == job.project_id,
+        AudioJob.chapter_id == job.chapter_id,
+        AudioJob.kind == job.kind,
+        AudioJob.manifest.isnot(None)
+    ).order_by(AudioJob.id.desc()).limit(5).all()
+    for candidate in earlier:
+        manifest = load_manifest(candidate)
+        if manifest.get('plan_id') == plan_id:
+            return manifest
+    return None
+
+
+def _claimable(now):
+    """Jobs that are due, plus running jobs whose worker stopped heartbeating"""
+    return db.or_(
+        db.and_(AudioJob.status == 'queued', AudioJob.run_after <= now),
+        db.and_(AudioJob.status == 'running', AudioJob.lease_expires_at < now)
+    )
+
+
+def has_due_jobs():
+    """True if any job is waiting to be claimed"""
+    now = datetime.now()
+    return db.session.query(AudioJob.id).filter(
+        _claimable(now),
+        AudioJob.cancel_requested.is_(False)
+    ).first() is not None
+
+
+def claim_next(worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    Claim the next due job with a lease. The claim is a conditional UPDATE so
+    two workers racing for the same row can't both win, on SQLite or Postgres.
+    Due jobs are taken smallest kind first, then from the user with the
+    fewest jobs already running, so one user's backlog can't occupy every
+    worker while others wait.
+    """
+    now = datetime.now()
+    _reap_expired(now)
+
+    due = db.session.query(AudioJob.id, AudioJob.user_id, AudioJob.kind, AudioJob.run_after).filter(
+        _claimable(now),
+        AudioJob.cancel_requested.is_(False)
+    ).order_by(AudioJob.run_after, AudioJob.id).limit(CLAIM_CANDIDATES).all()
+    running = dict(db.session.query(AudioJob.user_id, db.func.count(AudioJob.id)).filter(
+        AudioJob.status == 'running',
+        AudioJob.lease_expires_at >= now
+    ).group_by(AudioJob.user_id).all())
+    candidates = sorted(due, key=lambda row: (
+        KIND_ORDER.get(row.kind, len(KIND_ORDER)), running.get(row.user_id, 0), row.run_after, row.id
+    ))
+
+    for job_id, _, _, _ in candidates[:10]:
+        claimed = AudioJob.query.filter(
+            AudioJob.id == job_id,
+            _claimable(now),
+            AudioJob.cancel_requested.is_(False)
+        ).update({
+            'status': 'running',
+            'worker_id': worker_id,
+            'attempts': AudioJob.attempts + 1,
+            'lease_expires_at': now + timedelta(seconds=lease_seconds),
+            'heartbeat_at': now,
+            'error': None
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if claimed:
+            job = db.session.get(AudioJob, job_id)
+            db.session.refresh(job)
+            logging.info(f"Worker {worker_id} claimed job {job_id} (attempt {job.attempts})")
+            return job
+
+    return None
+
+
+def _reap_expired(now):
+    """
+    Settle jobs whose worker stopped heartbeating but that must not run again:
+    cancelled jobs and jobs that were on their final attempt
+    """
+    expired = AudioJob.query.filter(
+        AudioJob.status == 'running',
+        AudioJob.lease_expires_at < now,
+        db.or_(AudioJob.cancel_requested.is_(True), AudioJob.attempts >= AudioJob.max_attempts)
+    ).all()
+    for job in expired:
+        if job.cancel_requested:
+            job.status = 'cancelled'
+        else:
+            job.status = 'failed'
+            job.error = job.error or 'Worker lease expired'
+            logging.warning(f"Job {job.id} failed after {job.attempts} attempts: lease expired")
+        job.finished_at = now
+    if expired:
+        db.session.commit()
+
+
+def heartbeat(job_id, worker_id, progress=None, lease_seconds=LEASE_SECONDS):
+    """
+    Extend a job's lease. Returns False if the worker no longer owns the job
+    or a cancellation was requested, in which case it should stop working.
+    """
+    now = datetime.now()
+    values = {
+        'heartbeat_at': now,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds)
+    }
+    if progress is not None:
+        values['progress'] = progress
+
+    updated = AudioJob.query.filter(
+        AudioJob.id == job_id,
+        AudioJob.worker_id == worker_id,
+        AudioJob.status == 'running',
+        AudioJob.cancel_requested.is_(False)
+    ).update(values, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def complete(job_id, worker_id, result=None):
+    """Mark a claimed job as succeeded"""
+    updated = AudioJob.query.filter(
+        AudioJob.id == job_id,
+        AudioJob.worker_id == worker_id,
+        AudioJob.status == 'running'
+    ).update({
+        'status': 'succeeded',
+        'result': json.dumps(result or {}),
+        'progress': 1.0,
+        'finished_at': datetime.now(),
+        'lease_expires_at': None
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter for the given attempt number"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def fail(job_id, worker_id, error):
+    """
+    Record a failed attempt. The job is re-queued with backoff until it runs
+    out of attempts. Returns the job's new status.
+    """
+    job = db.session.get(AudioJob, job_id)
+    if not job or job.worker_id != worker_id or job.status != 'running':
+        return None
+
+    now = datetime.now()
+    job.error = str(error)
+    job.lease_expires_at = None
+    if job.cancel_requested:
+        job.status = 'cancelled'
+        job.finished_at = now
+    elif job.attempts < job.max_attempts:
+        job.status = 'queued'
+        job.run_after = now + timedelta(seconds=retry_delay(job.attempts))
+        logging.info(f"Job {job_id} will retry after {job.run_after}")
+    else:
+        job.status = 'failed'
+        job.finished_at = now
+    db.session.commit()
+    return job.status
+
+
+def cancel(job_id):
+    """
+    Cancel a job. Queued jobs are cancelled immediately; running jobs are
+    flagged and stop at their next heartbeat.
+    """
+    job = db.session.get(AudioJob, job_id)
+    if not job or job.status in FINISHED_STATUSES:
+        return job
+
+    job.cancel_requested = True
+    if job.status == 'queued':
+        job.status = 'cancelled'
+        job.finished_at = datetime.now()
+    db.session.commit()
+    return job
+
+
+def mark_cancelled(job_id, worker_id):
+    """Acknowledge a cancellation observed by the worker running the job"""
+    updated = AudioJob.query.filter(
+        AudioJob.id == job_id,
+        AudioJob.worker_id == worker_id,
+        AudioJob.status == 'running'
+    ).update({
+        'status': 'cancelled',
+        'finished_at': datetime.now(),
+        'lease_expires_at': None
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def job_to_dict(job):
+    """Serialize a job for the status endpoint"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'project_id': job.project_id,
+        'chapter_id': job.chapter_id,
+        'progress': job.progress or 0.0,
+        'checkpointed_chunks': len(load_manifest(job).get('chunks', {})),
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'cancel_requested': job.cancel_requested,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
@@ -0,0 +1,154 @@
+import logging
+from collections import deque
+from functools import lru_cache
+from models import LexiconEntry
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def _fold(text):
+    """Lowercase without changing length, so match offsets map back onto the original text"""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class PronunciationLexicon:
+    """
+    Aho-Corasick automaton over a project's lexicon terms. apply() rewrites
+    every term to its respelling in one pass over the text, however many
+    entries there are. Matching is case-insensitive unless an entry asks
+    otherwise, only whole words match, and overlapping matches resolve to the
+    leftmost, then longest, term.
+    """
+
+    def __init__(self, entries):
+        # entries: iterable of (term, respelling, case_sensitive)
+        self.goto = [{}]
+        self.fail = [0]
+        self.terminal = [None]  # (length, respelling, term or None when case-insensitive)
+        self.output_link = [0]  # Nearest proper suffix state that ends a term
+        self.size = 0
+
+        for term, respelling, case_sensitive in entries:
+            term = term.strip()
+            if not term:
+                continue
+            state = 0
+            for char in _fold(term):
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.terminal.append(None)
+                    self.output_link.append(0)
+                state = next_state
+            self.terminal[state] = (len(term), respelling, term if case_sensitive else None)
+            self.size += 1
+
+        self._build_links()
+
+    def _build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                link = self.fail[next_state]
+                self.output_link[next_state] = link if self.terminal[link] else self.output_link[link]
+
+    def _matches(self, text):
+        """Yield (start, end, respelling) for the longest valid term ending at each position"""
+        goto, fail, terminal, output_link = self.goto, self.fail, self.terminal, self.output_link
+        folded = _fold(text)
+        length = len(text)
+        state = 0
+        for position, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            end = position + 1
+            if end < length and _is_word_char(text[end]):
+                continue
+            candidate = state if terminal[state] else output_link[state]
+            while candidate:
+                term_length, respelling, exact = terminal[candidate]
+                start = end - term_length
+                if (start == 0 or not _is_word_char(text[start - 1])) and (exact is None or text[start:end] == exact):
+                    yield start, end, respelling
+                    break
+                candidate = output_link[candidate]
+
+    def spans(self, text):
+        """(start, end, respelling) of every term apply() would replace, in order"""
+        if not text or not self.size:
+            return []
+
+        matches = sorted(self._matches(text), key=lambda match: (match[0], match[0] - match[1]))
+        taken = []
+        position = 0
+        for start, end, respelling in matches:
+            if start < position:
+                continue  # Overlaps a match already taken
+            taken.append((start, end, respelling))
+            position = end
+        return taken
+
+    def apply(self, text):
+        """Replace every lexicon term in text with its respelling"""
+        spans = self.spans(text)
+        if not spans:
+            return text
+
+        parts = []
+        position = 0
+        for start, end, respelling in spans:
+            parts.append(text[position:start])
+            parts.append(respelling)
+            position = end
+        parts.append(text[position:])
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=64)
+def _load_lexicon(project_id, version):
+    entries = LexiconEntry.query.filter_by(project_id=project_id).all()
+    lexicon = PronunciationLexicon((entry.term, entry.respelling, entry.case_sensitive) for entry in entries)
+    logging.info(f"Built pronunciation lexicon for project {project_id} v{version}: {lexicon.size} terms")
+    return lexicon
+
+
+def project_lexicon(project):
+    """
+    The project's compiled lexicon, or None if it has no entries. Automata are
+    cached per (project, lexicon version); editing the lexicon bumps the
+    version, so stale automata are never used.
+    """
+    if not project or not project.lexicon_version:
+        return None
+    lexicon = _load_lexicon(project.id, project.lexicon_version)
+    return lexicon if lexicon.size else None
+
+
+def parse_lexicon_lines(text):
+    """Parse 'term = respelling' lines into (term, respelling) pairs, skipping blanks and # comments"""
+    pairs = []
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        term, respelling = line.split('=', 1)
+        if term.strip() and respelling.strip():
+            pairs.append((term.strip(), respelling.strip()))
+    return pairs
@@ -0,0 +1,378 @@
+import struct
+import itertools
+from functools import lru_cache
+
+# Bitrates in kbps indexed by [MPEG version 1 / 2+2.5][layer][bitrate index]
+BITRATES = {
+    1: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    2: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+
+# Sample rates in Hz indexed by MPEG version (2.5 is stored as 2.5)
+SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+VERSION_BITS = {0: 2.5, 2: 2, 3: 1}
+LAYER_BITS = {1: 3, 2: 2, 3: 1}
+
+
+def id3v2_size(data, offset=0):
+    """Total size of an ID3v2 tag starting at offset, or 0 if there is none"""
+    if data[offset:offset + 3] != b'ID3' or len(data) < offset + 10:
+        return 0
+    size = (data[offset + 6] << 21) | (data[offset + 7] << 14) | (data[offset + 8] << 7) | data[offset + 9]
+    footer = 10 if data[offset + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def strip_id3(segment):
+    """Drop a leading ID3v2 tag so the segment starts on an MP3 frame"""
+    return segment[id3v2_size(segment):]
+
+
+def syncsafe(value):
+    """Encode an integer as a 4-byte ID3v2 syncsafe integer"""
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+
+def id3_frame(frame_id, payload):
+    """An ID3v2.4 frame: 4-char id, syncsafe size, no flags"""
+    return frame_id.encode('ascii') + syncsafe(len(payload)) + b'\x00\x00' + payload
+
+
+def id3_text_frame(frame_id, text):
+    """A UTF-8 text information frame such as TIT2 or TALB"""
+    return id3_frame(frame_id, b'\x03' + text.encode('utf-8'))
+
+
+def build_id3_tag(frames):
+    """Wrap frames in an ID3v2.4 header"""
+    body = b''.join(frames)
+    return b'ID3\x04\x00\x00' + syncsafe(len(body)) + body
+
+
+def chapter_tag(title, chapters, album=None):
+    """
+    ID3v2.4 tag with a top-level CTOC and one CHAP per chapter. chapters is a
+    list of (title, start_ms, end_ms); byte offsets are left as 0xFFFFFFFF so
+    players seek by time.
+    """
+    element_ids = [f'chp{index}'.encode('ascii') for index in range(len(chapters))]
+    frames = [id3_text_frame('TIT2', title), id3_text_frame('TALB', album or title)]
+
+    toc = b'toc\x00' + bytes([0x03, len(element_ids)])  # Top-level, ordered
+    toc += b''.join(element_id + b'\x00' for element_id in element_ids)
+    frames.append(id3_frame('CTOC', toc + id3_text_frame('TIT2', title)))
+
+    for element_id, (chapter_title, start_ms, end_ms) in zip(element_ids, chapters):
+        payload = element_id + b'\x00' + struct.pack('>IIII', start_ms, end_ms, 0xFFFFFFFF, 0xFFFFFFFF)
+        frames.append(id3_frame('CHAP', payload + id3_text_frame('TIT2', chapter_title)))
+
+    return build_id3_tag(frames)
+
+
+def audio_payload(segment):
+    """A segment's audio frames without ID3 tags or its VBR header frame"""
+    audio = segment[audio_start_offset(segment, complete=True):]
+    if len(audio) >= 128 and audio[-128:-125] == b'TAG':
+        audio = audio[:-128]
+    return audio
+
+
+def join_mp3_segments(segments, pauses=None):
+    """
+    Join MP3 segments at frame boundaries. Each segment loses its ID3 tags and
+    VBR header frame, so the result is plain frames that players and
+    mp3_info() read as one stream. pauses[i], if given, is the seconds of
+    silence inserted after segment i.
+    """
+    joined = bytearray()
+    for position, segment in enumerate(segments):
+        audio = audio_payload(segment)
+        joined += audio
+
+        pause = pauses[position] if pauses else 0
+        frame = parse_frame_header(audio, 0) if pause else None
+        if frame:
+            joined += pause_frames(frame, pause)
+    return bytes(joined)
+
+
+def parse_frame_header(data, offset):
+    """
+    Decode the 4-byte MPEG audio frame header at offset.
+    Returns a dict describing the frame, or None if there is no valid header.
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = VERSION_BITS.get((b1 >> 3) & 0x03)
+    layer = LAYER_BITS.get((b1 >> 1) & 0x03)
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[1 if version == 1 else 2][layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channel_mode = (b3 >> 6) & 0x03  # 3 = mono
+
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        frame_length = 72 * bitrate // sample_rate + padding
+
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'padding': padding,
+        'channel_mode': channel_mode,
+        'protected': not (b1 & 0x01),
+        'samples': samples,
+        'frame_length': frame_length,
+        'header': bytes(data[offset:offset + 4]),
+    }
+
+
+def build_frame_header(bitrate_kbps=64, sample_rate=24000, mono=True):
+    """Build a 4-byte MPEG Layer III frame header without CRC or padding"""
+    version = next(v for v, rates in SAMPLE_RATES.items() if sample_rate in rates)
+    version_bits = {v: bits for bits, v in VERSION_BITS.items()}[version]
+    bitrate_index = BITRATES[1 if version == 1 else 2][3].index(bitrate_kbps)
+    sample_rate_index = SAMPLE_RATES[version].index(sample_rate)
+    return bytes([
+        0xFF,
+        0xE0 | (version_bits << 3) | (1 << 1) | 0x01,  # Layer III, no CRC
+        (bitrate_index << 4) | (sample_rate_index << 2),
+        0xC0 if mono else 0x00,
+    ])
+
+
+def silent_frames(header, count):
+    """
+    Count frames of digital silence sharing the given header. All-zero side
+    information means no main data, which every decoder plays as silence.
+    """
+    frame = parse_frame_header(header, 0)
+    if not frame or frame['layer'] != 3:
+        raise ValueError("Silent frames need a Layer III frame header")
+    return (bytes(header[:4]) + bytes(frame['frame_length'] - 4)) * max(0, count)
+
+
+def audio_start_offset(head, complete=False):
+    """
+    Offset of the first audio frame in the head of an MP3 stream, past any
+    ID3v2 tag and Xing/Info/VBRI frame. Returns None if more bytes are needed
+    to decide, unless complete is set.
+    """
+    if len(head) < 10 and not complete:
+        return None
+    offset = id3v2_size(head)
+    while offset + 4 <= len(head):
+        frame = parse_frame_header(head, offset)
+        if frame:
+            if offset + frame['frame_length'] > len(head) and not complete:
+                return None
+            if frame['layer'] == 3 and read_vbr_header(head, offset, frame):
+                return offset + frame['frame_length']
+            return offset
+        offset += 1
+    return None if not complete else len(head)
+
+
+def iter_audio_payload(chunks):
+    """
+    Re-yield an MP3 byte stream without its ID3v2 tag, VBR header frame or
+    ID3v1 trailer, so streams can be concatenated frame-exactly. Only the head
+    and the last 128 bytes are ever buffered.
+    """
+    head = bytearray()
+    tail = b''
+    started = False
+    for chunk in chunks:
+        if not started:
+            head += chunk
+            start = audio_start_offset(head)
+            if start is None:
+                continue
+            started = True
+            data = bytes(head[start:])
+            head = None
+        else:
+            data = tail + chunk
+        if len(data) > 128:
+            yield data[:-128]
+            tail = data[-128:]
+        else:
+            tail = data
+
+    if not started:
+        tail = bytes(head[audio_start_offset(head, complete=True):])
+    if not (len(tail) == 128 and tail[:3] == b'TAG'):
+        yield tail
+
+
+@lru_cache(maxsize=256)
+def _cached_silence(header, count):
+    return silent_frames(header, count)
+
+
+def silence_frame_count(frame, seconds):
+    """Whole frames of the given format closest to a pause length"""
+    return max(0, round(seconds * frame['sample_rate'] / frame['samples']))
+
+
+def silence_like(frame, count):
+    """
+    Count silent frames matching a segment's format (version, bitrate, sample
+    rate, channels). Built once per format and length and cached.
+    """
+    header = frame['header']
+    # No CRC and no padding, so every silent frame has the same length
+    header = bytes([header[0], header[1] | 0x01, header[2] & ~0x02 & 0xFF, header[3]])
+    return _cached_silence(header, count)
+
+
+def pause_frames(frame, seconds):
+    """Silent frames in a segment's format lasting as close to seconds as whole frames allow"""
+    return silence_like(frame, silence_frame_count(frame, seconds))
+
+
+def side_info_size(frame):
+    """Size of the Layer III side information that precedes the Xing tag"""
+    mono = frame['channel_mode'] == 3
+    if frame['version'] == 1:
+        return 17 if mono else 32
+    return 9 if mono else 17
+
+
+def read_vbr_header(data, offset, frame):
+    """
+    Read a Xing/Info or VBRI header from the first frame. Returns a dict
+    with the frame and byte counts (either may be None) and whether the tag
+    marks a VBR stream, or None if the frame carries no such header.
+    """
+    xing_offset = offset + 4 + side_info_size(frame)
+    tag = data[xing_offset:xing_offset + 4]
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing_offset + 4:xing_offset + 8])[0]
+        position = xing_offset + 8
+        frames = byte_count = None
+        if flags & 0x1:
+            frames = struct.unpack('>I', data[position:position + 4])[0]
+            position += 4
+        if flags & 0x2:
+            byte_count = struct.unpack('>I', data[position:position + 4])[0]
+        return {'frames': frames, 'bytes': byte_count, 'vbr': tag == b'Xing'}
+
+    vbri_offset = offset + 4 + 32
+    if data[vbri_offset:vbri_offset + 4] == b'VBRI':
+        byte_count, frames = struct.unpack('>II', data[vbri_offset + 10:vbri_offset + 18])
+        return {'frames': frames, 'bytes': byte_count, 'vbr': True}
+
+    return None
+
+
+def iter_frames(data, offset=0):
+    """
+    Yield (offset, frame) for each MPEG audio frame, skipping ID3 tags (also
+    between concatenated segments) and resynchronising past any garbage
+    between frames
+    """
+    length = len(data)
+    while offset + 4 <= length:
+        frame = parse_frame_header(data, offset)
+        if frame and frame['frame_length'] > 0 and offset + frame['frame_length'] <= length:
+            yield offset, frame
+            offset += frame['frame_length']
+            continue
+        tag_size = id3v2_size(data, offset)
+        if tag_size:
+            offset += tag_size
+            continue
+        if data[offset:offset + 3] == b'TAG':  # ID3v1 trailer, possibly of an earlier segment
+            offset += 128
+            continue
+        next_sync = data.find(b'\xff', offset + 1)
+        if next_sync < 0:
+            return
+        offset = next_sync
+
+
+def _spans_stream(vbr_header, data, offset, frame):
+    """
+    True if a VBR header's byte count accounts for all the audio after it, to
+    within its own frame and an ID3v1 trailer; a shorter count means more
+    segments were appended after the one it describes
+    """
+    if not vbr_header['bytes']:
+        return False
+    return abs((len(data) - offset) - vbr_header['bytes']) <= frame['frame_length'] + 128
+
+
+def mp3_info(data):
+    """
+    Exact duration and bitrate of an MP3 stream from its frame headers,
+    without decoding. Uses a Xing/Info or VBRI frame count when its byte
+    count spans the whole stream and otherwise counts every frame, so MP3s
+    concatenated with their headers intact are measured in full. Returns
+    None if no frames are found.
+    """
+    frames = iter_frames(data)
+    first = next(frames, None)
+    if not first:
+        return None
+
+    offset, frame = first
+    sample_rate = frame['sample_rate']
+    vbr_header = read_vbr_header(data, offset, frame) if frame['layer'] == 3 else None
+
+    if vbr_header and vbr_header['frames'] and _spans_stream(vbr_header, data, offset, frame):
+        frame_count = vbr_header['frames']
+        audio_bytes = vbr_header['bytes']
+        total_samples = frame_count * frame['samples']
+        vbr = vbr_header['vbr']
+    else:
+        # No usable VBR header: count frames, leaving out the header frames
+        # of the first and any later concatenated segments
+        frame_count = total_samples = audio_bytes = 0
+        bitrates = set()
+        for frame_offset, next_frame in itertools.chain([first], frames):
+            if next_frame['layer'] == 3 and read_vbr_header(data, frame_offset, next_frame):
+                continue
+            frame_count += 1
+            total_samples += next_frame['samples']
+            audio_bytes += next_frame['frame_length']
+            bitrates.add(next_frame['bitrate'])
+        vbr = len(bitrates) > 1
+
+    if not frame_count:
+        return None
+    duration = total_samples / sample_rate
+    return {
+        'duration_seconds': duration,
+        'bitrate_kbps': round(audio_bytes * 8 / duration / 1000, 1) if duration else 0,
+        'sample_rate': sample_rate,
+        'frames': frame_count,
+        'vbr': vbr,
+    }
@@ -0,0 +1,259 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+# Per-model quotas: requests per minute, billable units per minute (characters
+# for TTS, tokens for chat) and the starting concurrency. Override with env
+# vars such as RATE_LIMIT_TTS_1_RPM or RATE_LIMIT_GPT_4O_UNITS.
+DEFAULT_LIMITS = {
+    'tts-1': {'rpm': 50, 'units': 500_000, 'concurrency': 8},
+    'tts-1-hd': {'rpm': 50, 'units': 500_000, 'concurrency': 8},
+    'gpt-4o': {'rpm': 500, 'units': 30_000, 'concurrency': 8},
+}
+FALLBACK_LIMITS = {'rpm': 50, 'units': 100_000, 'concurrency': 4}
+
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENCY', 32))
+SLOT_LEASE_SECONDS = 300  # In-flight slots of crashed processes expire after this
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a call could not get capacity within its timeout"""
+
+
+def _limit(model, name):
+    env_name = f"RATE_LIMIT_{model.upper().replace('-', '_').replace('.', '_')}_{name.upper()}"
+    default = DEFAULT_LIMITS.get(model, FALLBACK_LIMITS)[name]
+    return float(os.environ.get(env_name, default))
+
+
+def error_status(error):
+    """HTTP status of an OpenAI SDK error, if it has one"""
+    return getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def error_retry_after(error):
+    """Seconds from a Retry-After (or retry-after-ms) header on an SDK error"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter shared by every process on the host through SQLite.
+    Each model has a request bucket and a units bucket refilled continuously
+    at the per-minute quota, plus an AIMD concurrency limit: it grows by one
+    slot per window of successes and halves on 429/5xx responses. Retry-After
+    blocks the model for everyone, so workers back off together instead of
+    retrying independently.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get('RATE_LIMIT_DB', os.path.join('instance', 'rate_limits.db'))
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS model_limits (
+                            model TEXT PRIMARY KEY,
+                            request_tokens REAL NOT NULL,
+                            unit_tokens REAL NOT NULL,
+                            concurrency REAL NOT NULL,
+                            blocked_until REAL NOT NULL DEFAULT 0,
+                            updated_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS inflight (
+                            slot TEXT PRIMARY KEY,
+                            model TEXT NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                    """)
+                    self._ready = True
+        return conn
+
+    def _load(self, conn, model, now):
+        row = conn.execute(
+            "SELECT request_tokens, unit_tokens, concurrency, blocked_until, updated_at FROM model_limits WHERE model = ?",
+            (model,)
+        ).fetchone()
+        rpm, units = _limit(model, 'rpm'), _limit(model, 'units')
+        if not row:
+            state = [rpm, units, _limit(model, 'concurrency'), 0.0, now]
+            conn.execute(
+                "INSERT INTO model_limits (model, request_tokens, unit_tokens, concurrency, blocked_until, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (model, *state)
+            )
+            return state
+
+        request_tokens, unit_tokens, concurrency, blocked_until, updated_at = row
+        elapsed = max(0.0, now - updated_at)
+        request_tokens = min(rpm, request_tokens + elapsed * rpm / 60)
+        unit_tokens = min(units, unit_tokens + elapsed * units / 60)
+        return [request_tokens, unit_tokens, concurrency, blocked_until, now]
+
+    def _save(self, conn, model, state):
+        conn.execute(
+            "UPDATE model_limits SET request_tokens = ?, unit_tokens = ?, concurrency = ?, blocked_until = ?, updated_at = ? WHERE model = ?",
+            (*state, model)
+        )
+
+    def acquire(self, model, units=1, timeout=600):
+        """
+        Block until the model has request, unit and concurrency capacity.
+        Returns a slot id to pass to release().
+        """
+        units = min(float(units), _limit(model, 'units'))  # Oversized calls wait for a full bucket
+        deadline = time.time() + timeout
+        while True:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                conn.execute("DELETE FROM inflight WHERE expires_at < ?", (now,))
+                state = self._load(conn, model, now)
+                request_tokens, unit_tokens, concurrency, blocked_until, _ = state
+                in_flight = conn.execute("SELECT COUNT(*) FROM inflight WHERE model = ?", (model,)).fetchone()[0]
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif in_flight >= int(concurrency):
+                    wait = 0.25
+                elif request_tokens < 1:
+                    wait = (1 - request_tokens) * 60 / _limit(model, 'rpm')
+                elif unit_tokens < units:
+                    wait = (units - unit_tokens) * 60 / _limit(model, 'units')
+                else:
+                    slot = uuid.uuid4().hex
+                    state[0] -= 1
+                    state[1] -= units
+                    self._save(conn, model, state)
+                    conn.execute(
+                        "INSERT INTO inflight (slot, model, expires_at) VALUES (?, ?, ?)",
+                        (slot, model, now + SLOT_LEASE_SECONDS)
+                    )
+                    conn.execute("COMMIT")
+                    return slot
+
+                self._save(conn, model, state)
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+            if time.time() + wait > deadline:
+                raise RateLimitTimeout(f"No {model} capacity within {timeout}s")
+            # Jitter so waiting processes don't wake in lockstep
+            time.sleep(min(wait, 5) * random.uniform(1.0, 1.2))
+
+    def release(self, model, slot, status=None, retry_after=None):
+        """
+        Free a slot and adapt the concurrency limit: additive increase on
+        success, multiplicative decrease on 429/5xx, plus a shared block for
+        Retry-After.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM inflight WHERE slot = ?", (slot,))
+            state = self._load(conn, model, now)
+            if status == 429 or (status and status >= 500):
+                state[2] = max(MIN_CONCURRENCY, state[2] / 2)
+                backoff = retry_after if retry_after is not None else (1.0 if status == 429 else 0)
+                state[3] = max(state[3], now + backoff)
+                logging.warning(f"{model} returned {status}; concurrency now {state[2]:.1f}, blocked {backoff:.1f}s")
+            elif status is None:
+                state[2] = min(MAX_CONCURRENCY, state[2] + 1 / max(state[2], 1))
+            self._save(conn, model, state)
+            conn.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"Rate limiter release error: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        finally:
+            conn.close()
+
+    @contextmanager
+    def limited(self, model, units=1):
+        """Hold a rate-limited slot for the duration of one API call"""
+        slot = self.acquire(model, units)
+        status = None
+        retry_after = None
+        try:
+            yield
+        except Exception as e:
+            status = error_status(e) or 0
+            retry_after = error_retry_after(e)
+            raise
+        finally:
+            self.release(model, slot, status, retry_after)
+
+    def call(self, model, units, fn, max_attempts=4):
+        """
+        Run fn() under the limiter, retrying 429/5xx responses. Waiting
+        happens in acquire(), so retries honour the shared Retry-After block.
+        """
+        for attempt in range(1, max_attempts + 1):
+            try:
+                with self.limited(model, units):
+                    return fn()
+            except Exception as e:
+                if attempt >= max_attempts or error_status(e) not in RETRYABLE_STATUS:
+                    raise
+                logging.info(f"Retrying {model} call after {error_status(e)} (attempt {attempt})")
+
+    def stats(self, model):
+        """Current bucket levels and concurrency for a model"""
+        conn = self._connect()
+        try:
+            now = time.time()
+            state = self._load(conn, model, now)
+            in_flight = conn.execute(
+                "SELECT COUNT(*) FROM inflight WHERE model = ? AND expires_at >= ?", (model, now)
+            ).fetchone()[0]
+            return {
+                'model': model,
+                'request_tokens': round(state[0], 2),
+                'unit_tokens': round(state[1], 2),
+                'concurrency_limit': round(state[2], 2),
+                'in_flight': in_flight,
+                'blocked_for': max(0.0, round(state[3] - now, 2))
+            }
+        finally:
+            conn.close()
+
+    def admission_seconds(self, model, requests, units):
+        """Minimum seconds the buckets need to admit this many requests and units from their current levels"""
+        state = self.stats(model)
+        request_wait = max(0.0, requests - state['request_tokens']) * 60 / _limit(model, 'rpm')
+        unit_wait = max(0.0, units - state['unit_tokens']) * 60 / _limit(model, 'units')
+        return max(request_wait, unit_wait) + state['blocked_for']
+
+
+# Global rate limiter instance shared by the TTS and AI services
+rate_limiter = RateLimiter()
@@ -0,0 +1,360 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+import contextvars
+from functools import wraps
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Priority classes, most urgent first. A waiting call gains one class per
+# SCHEDULER_AGING_SECONDS so batch work is delayed, never starved; speculative
+# calls never age and only start when nothing else is waiting.
+PRIORITIES = {
+    'interactive': 0,  # Previews and samples someone is waiting to hear
+    'chapter': 1,      # Single chapter renders
+    'book': 2,         # Full manuscript renders
+    'speculative': 3,  # Work nobody has asked for yet
+}
+PRIORITY_NAMES = {level: name for name, level in PRIORITIES.items()}
+
+MAX_CONCURRENCY = int(os.environ.get('SCHEDULER_MAX_CONCURRENCY', 8))
+INTERACTIVE_RESERVED = int(os.environ.get('SCHEDULER_INTERACTIVE_RESERVED', 2))
+USER_CONCURRENCY = int(os.environ.get('SCHEDULER_USER_CONCURRENCY', 4))
+AGING_SECONDS = float(os.environ.get('SCHEDULER_AGING_SECONDS', 30))
+SPECULATIVE_CONCURRENCY = int(os.environ.get('SCHEDULER_SPECULATIVE_CONCURRENCY', 2))
+TICKET_LEASE_SECONDS = 300  # Tickets of crashed processes expire after this
+WAITER_LEASE_SECONDS = 30  # Waiters refresh their row on every poll
+STATS_WINDOW_SECONDS = 900
+POLL_SECONDS = 0.1
+
+SchedulingContext = namedtuple('SchedulingContext', ['user_key', 'priority'])
+DEFAULT_CONTEXT = SchedulingContext('anonymous', 'chapter')
+_context = contextvars.ContextVar('tts_scheduling_context', default=DEFAULT_CONTEXT)
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call was not scheduled within its timeout"""
+
+
+def current_context():
+    """The user and priority class TTS calls in this context are scheduled under"""
+    return _context.get()
+
+
+def in_context(fn, priority=None):
+    """
+    Bind fn to the caller's scheduling context, for work handed to a thread
+    pool (executor threads don't inherit context variables). Optionally
+    demote the work to another priority class.
+    """
+    context = current_context()
+    if priority:
+        context = context._replace(priority=priority)
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        token = _context.set(context)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _context.reset(token)
+    return run
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+
+class TTSScheduler:
+    """
+    Admission control in front of every billable TTS call, shared by the web
+    server and workers through SQLite. Waiting calls are ordered by priority
+    class, then by start-time fair queuing between users: each call gets a
+    virtual start tag of max(system virtual time, the user's last finish tag)
+    and advances the user's finish tag by its character count, so a user with
+    ten queued books interleaves with, rather than blocks, a user with one
+    paragraph. Each user may hold at most user_concurrency batch calls, and
+    the last interactive_reserved slots are kept for interactive work, which
+    is only bound by max_concurrency.
+    """
+
+    def __init__(self, db_path=None, max_concurrency=MAX_CONCURRENCY,
+                 interactive_reserved=INTERACTIVE_RESERVED, user_concurrency=USER_CONCURRENCY):
+        self.db_path = db_path or os.environ.get('SCHEDULER_DB', os.path.join('instance', 'scheduler.db'))
+        self.max_concurrency = max(1, max_concurrency)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_concurrency - 1)
+        self.user_concurrency = max(1, user_concurrency)
+        self._lock = threading.Lock()
+        self._released = threading.Condition()
+        self._ready = False
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS waiting (
+                            ticket TEXT PRIMARY KEY,
+                            user_key TEXT NOT NULL,
+                            priority INTEGER NOT NULL,
+                            start_tag REAL NOT NULL,
+                            enqueued_at REAL NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS running (
+                            ticket TEXT PRIMARY KEY,
+                            user_key TEXT NOT NULL,
+                            priority INTEGER NOT NULL,
+                            started_at REAL NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS user_tags (
+                            user_key TEXT PRIMARY KEY,
+                            finish_tag REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS clock (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            virtual_time REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("INSERT OR IGNORE INTO clock (id, virtual_time) VALUES (1, 0)")
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS waits (
+                            priority INTEGER NOT NULL,
+                            waited REAL NOT NULL,
+                            started_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_waits_started_at ON waits (started_at)")
+                    self._ready = True
+        return conn
+
+    def _enqueue(self, user_key, priority, units):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            virtual_time = conn.execute("SELECT virtual_time FROM clock WHERE id = 1").fetchone()[0]
+            row = conn.execute("SELECT finish_tag FROM user_tags WHERE user_key = ?", (user_key,)).fetchone()
+            start_tag = max(virtual_time, row[0] if row else 0.0)
+            conn.execute(
+                "INSERT OR REPLACE INTO user_tags (user_key, finish_tag) VALUES (?, ?)",
+                (user_key, start_tag + max(1.0, float(units)))
+            )
+            ticket = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO waiting (ticket, user_key, priority, start_tag, enqueued_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (ticket, user_key, priority, start_tag, now, now + WAITER_LEASE_SECONDS)
+            )
+            conn.execute("COMMIT")
+            return ticket
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _can_start(self, priority, user_key, running_total, running_by_user):
+        # Interactive calls are short fan-outs someone is listening for (a
+        # voice gallery, a preview); only the global limit applies to them
+        if priority == PRIORITIES['interactive']:
+            return running_total < self.max_concurrency
+        return (
+            running_total < self.max_concurrency - self.interactive_reserved
+            and running_by_user.get(user_key, 0) < self.user_concurrency
+        )
+
+    def _can_speculate(self, waiting, running_by_priority):
+        """Speculative calls only use capacity no one else is waiting for"""
+        speculative = PRIORITIES['speculative']
+        return (
+            running_by_priority.get(speculative, 0) < SPECULATIVE_CONCURRENCY
+            and all(priority == speculative for _, _, priority, _, _ in waiting)
+        )
+
+    def _try_start(self, ticket):
+        """Move ticket to running if it is the best waiter that can start now"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            conn.execute("DELETE FROM running WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM waiting WHERE expires_at < ? AND ticket != ?", (now, ticket))
+            conn.execute("UPDATE waiting SET expires_at = ? WHERE ticket = ?", (now + WAITER_LEASE_SECONDS, ticket))
+
+            running_by_user = dict(conn.execute("SELECT user_key, COUNT(*) FROM running GROUP BY user_key").fetchall())
+            running_total = sum(running_by_user.values())
+            running_by_priority = dict(conn.execute("SELECT priority, COUNT(*) FROM running GROUP BY priority").fetchall())
+            waiting = conn.execute("SELECT ticket, user_key, priority, start_tag, enqueued_at FROM waiting").fetchall()
+            best = None
+            for row in waiting:
+                waiter, user_key, priority, start_tag, enqueued_at = row
+                if not self._can_start(priority, user_key, running_total, running_by_user):
+                    continue
+                if priority == PRIORITIES['speculative']:
+                    if not self._can_speculate(waiting, running_by_priority):
+                        continue
+                    aged = priority
+                else:
+                    aged = priority - int((now - enqueued_at) / AGING_SECONDS)
+                rank = (aged, start_tag, enqueued_at)
+                if best is None or rank < best[0]:
+                    best = (rank, row)
+
+            if not best or best[1][0] != ticket:
+                conn.execute("COMMIT")
+                return False
+
+            _, user_key, priority, start_tag, enqueued_at = best[1]
+            conn.execute("DELETE FROM waiting WHERE ticket = ?", (ticket,))
+            conn.execute(
+                "INSERT INTO running (ticket, user_key, priority, started_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (ticket, user_key, priority, now, now + TICKET_LEASE_SECONDS)
+            )
+            conn.execute("UPDATE clock SET virtual_time = MAX(virtual_time, ?) WHERE id = 1", (start_tag,))
+            conn.execute("INSERT INTO waits (priority, waited, started_at) VALUES (?, ?, ?)", (priority, now - enqueued_at, now))
+            conn.execute("DELETE FROM waits WHERE started_at < ?", (now - STATS_WINDOW_SECONDS,))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _discard(self, table, ticket):
+        conn = self._connect()
+        try:
+            conn.execute(f"DELETE FROM {table} WHERE ticket = ?", (ticket,))
+        except Exception as e:
+            logging.error(f"Scheduler {table} cleanup error: {e}")
+        finally:
+            conn.close()
+
+    def acquire(self, units=1, timeout=900):
+        """
+        Wait until the calling context may make a TTS call costing units
+        characters. Returns a ticket to pass to release().
+        """
+        context = current_context()
+        priority = PRIORITIES.get(context.priority, PRIORITIES['chapter'])
+        ticket = self._enqueue(context.user_key, priority, units)
+        deadline = time.time() + timeout
+        try:
+            while not self._try_start(ticket):
+                if time.time() > deadline:
+                    raise SchedulerTimeout(f"Not scheduled within {timeout}s")
+                # Releases in this process wake waiters at once; the poll covers other processes
+                with self._released:
+                    self._released.wait(POLL_SECONDS * random.uniform(1.0, 1.5))
+        except BaseException:
+            self._discard('waiting', ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        """Free a ticket's slot and wake waiters in this process"""
+        self._discard('running', ticket)
+        with self._released:
+            self._released.notify_all()
+
+    @contextmanager
+    def slot(self, units=1):
+        """Hold a scheduled slot for the duration of one TTS call"""
+        ticket = self.acquire(units)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def context(self, user_id=None, priority='chapter'):
+        """Schedule TTS calls made inside the block as this user and priority class"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        user_key = f"user-{user_id}" if user_id is not None else current_context().user_key
+        token = _context.set(SchedulingContext(user_key, priority))
+        try:
+            yield
+        finally:
+            _context.reset(token)
+
+    def contended(self):
+        """True if any call other than speculative work is waiting for a slot"""
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT 1 FROM waiting WHERE priority < ? AND expires_at >= ? LIMIT 1",
+                (PRIORITIES['speculative'], time.time())
+            ).fetchone() is not None
+        finally:
+            conn.close()
+
+    def stats(self, user_id=None):
+        """
+        Queue depth and running calls per priority class, running calls per
+        user, and wait time percentiles over the last STATS_WINDOW_SECONDS.
+        With user_id, per-user figures are limited to that user.
+        """
+        conn = self._connect()
+        try:
+            now = time.time()
+            classes = {name: {'waiting': 0, 'running': 0, 'wait_p50': None, 'wait_p95': None, 'started': 0} for name in PRIORITIES}
+            for priority, count in conn.execute(
+                "SELECT priority, COUNT(*) FROM waiting WHERE expires_at >= ? GROUP BY priority", (now,)
+            ).fetchall():
+                classes[PRIORITY_NAMES[priority]]['waiting'] = count
+            for priority, count in conn.execute(
+                "SELECT priority, COUNT(*) FROM running WHERE expires_at >= ? GROUP BY priority", (now,)
+            ).fetchall():
+                classes[PRIORITY_NAMES[priority]]['running'] = count
+
+            waits = {}
+            for priority, waited in conn.execute(
+                "SELECT priority, waited FROM waits WHERE started_at >= ?", (now - STATS_WINDOW_SECONDS,)
+            ).fetchall():
+                waits.setdefault(PRIORITY_NAMES[priority], []).append(waited)
+            for name, values in waits.items():
+                classes[name].update(wait_p50=_percentile(values, 0.5), wait_p95=_percentile(values, 0.95), started=len(values))
+
+            users = {}
+            for table in ('waiting', 'running'):
+                for user_key, count in conn.execute(
+                    f"SELECT user_key, COUNT(*) FROM {table} WHERE expires_at >= ? GROUP BY user_key", (now,)
+                ).fetchall():
+                    users.setdefault(user_key, {'waiting': 0, 'running': 0})[table] = count
+            if user_id is not None:
+                users = {key: value for key, value in users.items() if key == f"user-{user_id}"}
+
+            return {
+                'classes': classes,
+                'users': users,
+                'max_concurrency': self.max_concurrency,
+                'interactive_reserved': self.interactive_reserved,
+                'user_concurrency': self.user_concurrency,
+                'window_seconds': STATS_WINDOW_SECONDS
+            }
+        finally:
+            conn.close()
+
+
+# Global scheduler instance gating TTS calls from the web server and workers
+scheduler = TTSScheduler()
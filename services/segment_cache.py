@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from services import storage_service
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_segment_text(text):
+    """Collapse whitespace so formatting-only edits map to the same segment"""
+    return WHITESPACE.sub(' ', text or '').strip()
+
+
+def segment_key(text, voice, model, response_format='mp3'):
+    """Content-addressed key for a synthesized segment"""
+    digest = hashlib.sha256(normalize_segment_text(text).encode('utf-8')).hexdigest()
+    fingerprint = f"{digest}:{voice}:{model}:{response_format}"
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+
+class SegmentCache:
+    """
+    Cache of synthesized audio segments keyed on (text hash, voice, model, format).
+    Segments are kept on local disk with an SQLite index and evicted LRU once the
+    cache grows past max_bytes. Every segment is also written through to cloud
+    storage so other workers (and later runs after eviction) can read it back.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('SEGMENT_CACHE_DIR', os.path.join('instance', 'segment_cache'))
+        self.max_bytes = max_bytes or int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        self.index_path = os.path.join(self.cache_dir, 'index.db')
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS segments (
+                            key TEXT PRIMARY KEY,
+                            format TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            created_at REAL NOT NULL,
+                            last_access REAL NOT NULL
+                        )
+                    """)
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_segments_last_access ON segments (last_access)")
+                    conn.commit()
+                    self._ready = True
+        return conn
+
+    def _local_path(self, key, response_format):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{response_format}")
+
+    @staticmethod
+    def storage_key(key, response_format='mp3'):
+        return f"audio/segments/{key}.{response_format}"
+
+    def get(self, key, response_format='mp3'):
+        """Return cached segment bytes, reading through from cloud storage on a local miss"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT format FROM segments WHERE key = ?", (key,)).fetchone()
+                if row:
+                    path = self._local_path(key, row[0])
+                    try:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                        conn.execute("UPDATE segments SET last_access = ? WHERE key = ?", (time.time(), key))
+                        conn.commit()
+                        return data
+                    except FileNotFoundError:
+                        conn.execute("DELETE FROM segments WHERE key = ?", (key,))
+                        conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.warning(f"Segment cache read error: {e}")
+
+        if storage_service.s3_client:
+            try:
+                data = storage_service.download_bytes(self.storage_key(key, response_format))
+                if data:
+                    self._store_local(key, response_format, data)
+                    return data
+            except Exception as e:
+                logging.warning(f"Segment cache storage read error: {e}")
+        return None
+
+    def contains(self, key):
+        """Check the local index without touching the segment or its LRU position"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = self._connect()
+            try:
+                return conn.execute("SELECT 1 FROM segments WHERE key = ?", (key,)).fetchone() is not None
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.warning(f"Segment cache lookup error: {e}")
+            return False
+
+    def put(self, key, data, response_format='mp3'):
+        """Store a segment locally and write it through to cloud storage"""
+        self._store_local(key, response_format, data)
+        if storage_service.s3_client:
+            try:
+                storage_service.upload_bytes(data, self.storage_key(key, response_format), f"audio/{response_format}")
+            except Exception as e:
+                logging.warning(f"Segment cache storage write error: {e}")
+
+    def _store_local(self, key, response_format, data):
+        try:
+            path = self._local_path(key, response_format)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+            conn = self._connect()
+            try:
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO segments (key, format, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, response_format, len(data), now, now)
+                )
+                conn.commit()
+                self._evict(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.warning(f"Segment cache write error: {e}")
+
+    def _evict(self, conn):
+        """Drop least recently used segments until the cache fits in max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM segments").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, response_format, size in conn.execute(
+            "SELECT key, format, size FROM segments ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(self._local_path(key, response_format))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM segments WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        conn.commit()
+        logging.info(f"Segment cache evicted {evicted} segments ({total} bytes remain)")
+
+    def stats(self):
+        """Return segment count and total bytes held locally"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments").fetchone()
+            return {'segments': count, 'bytes': total, 'max_bytes': self.max_bytes}
+        finally:
+            conn.close()
+
+
+# Global segment cache instance
+segment_cache = SegmentCache()
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: coalesce within the process only
+    fcntl = None
+
+RESULT_TTL_SECONDS = 120  # Leaders' results stay readable this long for duplicates in other processes
+LOCK_IDLE_SECONDS = 3600  # Lock files untouched this long are swept
+SWEEP_INTERVAL_SECONDS = 60
+
+
+def fingerprint(*parts):
+    """Stable key for a request from its JSON-serializable parts"""
+    encoded = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that are in flight at the same time: the first
+    caller runs the work and concurrent duplicates wait for it and share its
+    result instead of paying for it again. Threads in one process wait on an
+    Event. Across gunicorn workers and job workers, callers serialize on a
+    per-key file lock; the leader writes its result (if JSON-serializable)
+    beside the lock, and a duplicate that arrived while it ran reads that
+    instead of calling. Failures are not shared across processes, so the
+    next waiter simply tries the call itself.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir or os.environ.get('SINGLE_FLIGHT_DIR', os.path.join('instance', 'single_flight'))
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._last_sweep = 0.0
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key and return its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_exclusive(key, fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _run_exclusive(self, key, fn):
+        if fcntl is None:
+            return fn()
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        arrived = time.time()
+        lock_path = os.path.join(self.lock_dir, f"{key}.lock")
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                shared = self._read_result(key, arrived)
+                if shared is not None:
+                    logging.info(f"Single-flight {key[:12]} shared a result from another process")
+                    return shared['result']
+
+                os.utime(lock_path)
+                started = time.time()
+                result = fn()
+                self._write_result(key, started, result)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _result_path(self, key):
+        return os.path.join(self.lock_dir, f"{key}.json")
+
+    def _read_result(self, key, arrived):
+        """A leader's result, if that leader was already running when this caller arrived"""
+        try:
+            with open(self._result_path(key)) as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if shared['started'] <= arrived <= shared['finished'] and time.time() - shared['finished'] < RESULT_TTL_SECONDS:
+            return shared
+        return None
+
+    def _write_result(self, key, started, result):
+        path = self._result_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump({'started': started, 'finished': time.time(), 'result': result}, f)
+            os.replace(temp_path, path)
+        except (TypeError, ValueError, OSError) as e:
+            logging.debug(f"Single-flight result for {key[:12]} not shared: {e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        self._sweep()
+
+    def _sweep(self):
+        """Remove expired results and idle lock files, at most once a minute per process"""
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        try:
+            for entry in os.scandir(self.lock_dir):
+                idle = now - entry.stat().st_mtime
+                if (entry.name.endswith('.json') and idle > RESULT_TTL_SECONDS) or (
+                        entry.name.endswith('.lock') and idle > LOCK_IDLE_SECONDS):
+                    os.unlink(entry.path)
+        except OSError as e:
+            logging.warning(f"Single-flight sweep error: {e}")
+
+    def coalesce(self, name):
+        """Decorator coalescing concurrent calls with identical arguments"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                return self.do(fingerprint(name, args, kwargs), lambda: fn(*args, **kwargs))
+            return wrapper
+        return decorator
+
+
+# Global single-flight group shared by the TTS and AI services
+single_flight = SingleFlight()
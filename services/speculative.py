@@ -0,0 +1,155 @@
+import os
+import logging
+from datetime import date, datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import Chapter, Project, SpeculativeUsage
+from services import job_queue
+from services.tts_service import tts_service
+from services.segment_cache import segment_cache, segment_key
+from services.scheduler import scheduler
+from services.single_flight import single_flight, fingerprint
+from services.chapter_audio import chapter_speech_text, chapter_tier, is_stale
+from services.lexicon import project_lexicon
+
+ENABLED = os.environ.get('SPECULATIVE_ENABLED', 'true').lower() == 'true'
+STABLE_HOURS = float(os.environ.get('SPECULATIVE_STABLE_HOURS', 6))  # Unedited this long counts as settled
+DAILY_CHAR_BUDGET = int(os.environ.get('SPECULATIVE_DAILY_CHARS', 200_000))  # Per user
+PASS_CHUNKS = int(os.environ.get('SPECULATIVE_PASS_CHUNKS', 20))  # The worker checks its queue between passes
+IDLE_INTERVAL_SECONDS = float(os.environ.get('SPECULATIVE_INTERVAL', 60))
+MAX_TARGETS = 200  # Chapters and manuscripts considered per pass
+
+
+def _voice(project, audio=None):
+    """The voice the author will most likely render with: the last one they used"""
+    return (audio.voice if audio and audio.voice else None) or project.audio_voice or 'alloy'
+
+
+def _targets(now):
+    """
+    (user id, text, voice, model, lexicon) of work worth rendering before it
+    is asked for: chapters marked final, then chapters and manuscripts left
+    unedited for STABLE_HOURS, most recently edited first
+    """
+    cutoff = now - timedelta(hours=STABLE_HOURS)
+    chapters = Chapter.query.filter(
+        db.or_(Chapter.is_final.is_(True), Chapter.updated_at <= cutoff)
+    ).order_by(Chapter.is_final.desc(), Chapter.updated_at.desc()).limit(MAX_TARGETS).all()
+    for chapter in chapters:
+        text = chapter_speech_text(chapter)
+        voice = _voice(chapter.project, chapter.audio)
+        if text.strip() and is_stale(chapter, voice):
+            yield chapter.project.user_id, text, voice, tts_service.model_for(chapter_tier(chapter)), project_lexicon(chapter.project)
+
+    projects = Project.query.filter(
+        Project.updated_at <= cutoff,
+        Project.content.isnot(None),
+        Project.content != ''
+    ).order_by(Project.updated_at.desc()).limit(MAX_TARGETS).all()
+    for project in projects:
+        yield project.user_id, project.content, _voice(project), tts_service.model_for('draft'), project_lexicon(project)
+
+
+def _spend(user_id, characters, today):
+    """Take characters from the user's budget for today; False if that would exceed it"""
+    if characters > DAILY_CHAR_BUDGET:
+        return False
+    for _ in range(2):
+        updated = SpeculativeUsage.query.filter(
+            SpeculativeUsage.user_id == user_id,
+            SpeculativeUsage.day == today,
+            SpeculativeUsage.characters + characters <= DAILY_CHAR_BUDGET
+        ).update({'characters': SpeculativeUsage.characters + characters}, synchronize_session=False)
+        if updated:
+            db.session.commit()
+            return True
+        if SpeculativeUsage.query.filter_by(user_id=user_id, day=today).first():
+            db.session.rollback()
+            return False
+
+        usage = SpeculativeUsage()
+        usage.user_id = user_id
+        usage.day = today
+        usage.characters = characters
+        db.session.add(usage)
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            # Another worker started today's row first; charge against it
+            db.session.rollback()
+    return False
+
+
+def _refund(user_id, characters, today):
+    """Return characters charged for a chunk that turned out to cost nothing"""
+    SpeculativeUsage.query.filter_by(user_id=user_id, day=today).update(
+        {'characters': SpeculativeUsage.characters - characters}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+def _busy(should_stop):
+    """True once real work is waiting, for the worker or for a TTS slot"""
+    return scheduler.contended() or job_queue.has_due_jobs() or bool(should_stop and should_stop())
+
+
+def run_idle_pass(should_stop=None, max_chunks=PASS_CHUNKS):
+    """
+    Pre-render chunks of settled chapters and manuscripts into the segment
+    cache while the worker has nothing to do, so a later render is mostly
+    cache hits. Calls run at the speculative priority, which only takes
+    scheduler capacity nobody else is waiting for, and the pass stops as
+    soon as a job is due or another call waits. Each chunk is charged to
+    its author's daily budget before it is synthesized, and refunded if
+    cloud storage already had it, since read-through serves that for free.
+    Returns the number of chunks synthesized.
+    """
+    if not ENABLED or DAILY_CHAR_BUDGET <= 0:
+        return 0
+
+    today = date.today()
+    rendered = 0
+    exhausted = set()
+    for user_id, text, voice, model, lexicon in _targets(datetime.now()):
+        if user_id in exhausted:
+            continue
+        engine_model = tts_service.engine_model_for(model)
+        for chunk in tts_service.plan_synthesis(text, lexicon):
+            key = segment_key(chunk['text'], voice, engine_model, 'mp3')
+            if segment_cache.contains(key):
+                continue
+            if rendered >= max_chunks or _busy(should_stop):
+                return rendered
+            if not _spend(user_id, len(chunk['text']), today):
+                exhausted.add(user_id)
+                break
+            try:
+                with scheduler.context(user_id=user_id, priority='speculative'):
+                    hit = single_flight.do(
+                        fingerprint('speculative', key),
+                        lambda: tts_service.synthesize_cached(chunk['text'], voice, 'mp3', model)[1]
+                    )
+            except Exception as e:
+                # Leave it for the next idle pass rather than retrying into errors
+                _refund(user_id, len(chunk['text']), today)
+                logging.warning(f"Speculative render stopped: {e}")
+                return rendered
+            if hit:
+                _refund(user_id, len(chunk['text']), today)
+                continue
+            rendered += 1
+
+    if rendered:
+        logging.info(f"Speculatively rendered {rendered} chunks")
+    return rendered
+
+
+def usage(user_id):
+    """Today's speculative spend for a user against the daily budget"""
+    row = SpeculativeUsage.query.filter_by(user_id=user_id, day=date.today()).first()
+    return {
+        'enabled': ENABLED,
+        'characters_today': row.characters if row else 0,
+        'daily_budget': DAILY_CHAR_BUDGET
+    }
@@ -1,8 +1,10 @@
 import os
 import boto3
 import logging
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError, NoCredentialsError
 from datetime import datetime
+from io import BytesIO
 
 # Wasabi/S3 configuration
 WASABI_ACCESS_KEY = os.environ.get("WASABI_ACCESS_KEY")
@@ -11,6 +13,15 @@ WASABI_BUCKET = os.environ.get("WASABI_BUCKET", "mystic-echo-audiobooks")
 WASABI_REGION = os.environ.get("WASABI_REGION", "us-east-1")
 WASABI_ENDPOINT = os.environ.get("WASABI_ENDPOINT", "https://s3.wasabisys.com")
 
+# Uploads above the threshold go multipart, with parts sent concurrently
+MB = 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.environ.get('WASABI_MULTIPART_THRESHOLD_MB', 8)) * MB,
+    multipart_chunksize=int(os.environ.get('WASABI_MULTIPART_CHUNK_MB', 8)) * MB,
+    max_concurrency=int(os.environ.get('WASABI_UPLOAD_CONCURRENCY', 4)),
+    use_threads=True
+)
+
 # Initialize S3 client for Wasabi
 s3_client = None
 if WASABI_ACCESS_KEY and WASABI_SECRET_KEY:
@@ -183,7 +194,8 @@ def upload_file(file_path, s3_key, content_type='application/octet-stream'):
                 file,
                 WASABI_BUCKET,
                 s3_key,
-                ExtraArgs={'ContentType': content_type}
+                ExtraArgs={'ContentType': content_type},
+                Config=TRANSFER_CONFIG
             )
         
         logging.info(f"File uploaded to Wasabi: {s3_key}")
@@ -212,3 +224,78 @@ def generate_download_url(s3_key, expiration=3600):
     except Exception as e:
         logging.error(f"Generate download URL error: {e}")
         raise Exception(f"Failed to generate download URL: {e}")
+
+def storage_key_from_url(url):
+    """
+    Recover the object key from a public bucket URL of the form
+    <endpoint>/<bucket>/<key>. Returns None for URLs outside the bucket.
+    """
+    marker = f"/{WASABI_BUCKET}/"
+    if not url or marker not in url:
+        return None
+    return url.split(marker, 1)[1]
+
+def upload_bytes(data, s3_key, content_type='application/octet-stream'):
+    """
+    Upload in-memory bytes to Wasabi storage without a temporary file
+    """
+    return upload_stream(BytesIO(data), s3_key, content_type)
+
+def upload_stream(fileobj, s3_key, content_type='application/octet-stream'):
+    """
+    Upload a readable file-like object (in-memory buffer or streaming body) to
+    Wasabi storage. Large bodies are sent as concurrent multipart uploads.
+    """
+    if not s3_client:
+        raise Exception("Cloud storage not configured")
+    
+    try:
+        s3_client.upload_fileobj(
+            fileobj,
+            WASABI_BUCKET,
+            s3_key,
+            ExtraArgs={'ContentType': content_type},
+            Config=TRANSFER_CONFIG
+        )
+        
+        logging.info(f"Stream uploaded to Wasabi: {s3_key}")
+        return s3_key
+        
+    except Exception as e:
+        logging.error(f"Stream upload error: {e}")
+        raise Exception(f"Failed to upload data: {e}")
+
+def download_bytes(s3_key):
+    """
+    Download an object from Wasabi storage. Returns None if the key doesn't exist.
+    """
+    if not s3_client:
+        raise Exception("Cloud storage not configured")
+    
+    try:
+        response = s3_client.get_object(Bucket=WASABI_BUCKET, Key=s3_key)
+        return response['Body'].read()
+        
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        logging.error(f"Wasabi download error: {e}")
+        raise Exception(f"Failed to download from cloud storage: {e}")
+
+def iter_object(s3_key, chunk_size=1024 * 1024):
+    """
+    Stream an object from Wasabi storage in chunks without holding it in memory.
+    Returns None if the key doesn't exist.
+    """
+    if not s3_client:
+        raise Exception("Cloud storage not configured")
+    
+    try:
+        response = s3_client.get_object(Bucket=WASABI_BUCKET, Key=s3_key)
+        return response['Body'].iter_chunks(chunk_size=chunk_size)
+        
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        logging.error(f"Wasabi download error: {e}")
+        raise Exception(f"Failed to download from cloud storage: {e}")
@@ -0,0 +1,401 @@
+import os
+import re
+import logging
+import threading
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# Rule-based text front-end: expands numerals, currency, ordinals, times,
+# dates, common abbreviations and symbols into the words a narrator would
+# say, so "Dr. Chen paid $3.5M at 3:45pm" is read the same way every time.
+# Each locale's rules compile into one alternation that is scanned once,
+# left to right, per chunk; only matched spans run any Python.
+
+ENABLED = os.environ.get('TTS_TEXT_FRONTEND', 'true').lower() == 'true'
+DEFAULT_LOCALE = os.environ.get('TTS_LOCALE', 'en-US')
+
+ONES = [
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen'
+]
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+SCALES = [(10 ** 12, 'trillion'), (10 ** 9, 'billion'), (10 ** 6, 'million'), (10 ** 3, 'thousand')]
+IRREGULAR_ORDINALS = {
+    'one': 'first', 'two': 'second', 'three': 'third', 'five': 'fifth',
+    'eight': 'eighth', 'nine': 'ninth', 'twelve': 'twelfth'
+}
+MONTHS = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+MONTH_NUMBERS = {name[:3].lower(): number for number, name in enumerate(MONTHS, 1)}
+MONTH_PATTERN = r'(?:Jan(?:uary|\.)?|Feb(?:ruary|\.)?|Mar(?:ch|\.)?|Apr(?:il|\.)?|May|June?|July?|Aug(?:ust|\.)?|Sept?(?:ember|\.)?|Oct(?:ober|\.)?|Nov(?:ember|\.)?|Dec(?:ember|\.)?)'
+
+# Currency symbol -> (unit, units, subunit, subunits)
+CURRENCIES = {
+    '$': ('dollar', 'dollars', 'cent', 'cents'),
+    '£': ('pound', 'pounds', 'penny', 'pence'),
+    '€': ('euro', 'euros', 'cent', 'cents'),
+}
+MAGNITUDES = {'k': 'thousand', 'm': 'million', 'b': 'billion', 'bn': 'billion', 't': 'trillion'}
+FRACTIONS = {'½': 'a half', '¼': 'a quarter', '¾': 'three quarters', '⅓': 'a third', '⅔': 'two thirds'}
+FRACTION_WORDS = {'½': 'one half', '¼': 'one quarter', '¾': 'three quarters', '⅓': 'one third', '⅔': 'two thirds'}
+
+# Abbreviations read the same in every English locale. Titles only expand
+# before a capitalized word. St. and Dr. are street suffixes instead when
+# the next word opens a sentence ("Main St. Then") or they follow a name
+# mid-sentence ("221 Baker St."), and then their period can end the sentence.
+TITLES = {
+    'Mr': 'Mister', 'Mrs': 'Missus', 'Ms': 'Miz', 'Dr': 'Doctor', 'Prof': 'Professor',
+    'St': 'Saint', 'Mt': 'Mount', 'Gen': 'General', 'Capt': 'Captain', 'Sgt': 'Sergeant',
+    'Col': 'Colonel', 'Rev': 'Reverend', 'Gov': 'Governor', 'Sen': 'Senator', 'Rep': 'Representative'
+}
+STREET_SUFFIXES = {'St': 'Street', 'Dr': 'Drive'}
+# Capitalized words that open sentences but are never names
+SENTENCE_WORDS = frozenset('''
+    A After An And As At But By For From He Her Here His How However I If In It Its Later Meanwhile
+    My Next Now Of On Once Or Our She So Soon Still That The Their Then There These They This Those
+    To We What When Where While Why With Yet You Your
+'''.split())
+ABBREVIATIONS = {
+    'Jr.': 'Junior', 'Sr.': 'Senior', 'vs.': 'versus', 'etc.': 'et cetera', 'approx.': 'approximately',
+    'e.g.': 'for example', 'i.e.': 'that is', 'Ave.': 'Avenue', 'Blvd.': 'Boulevard', 'Dept.': 'Department'
+}
+
+# Every rule starts with one of these: digits and symbols, the capitals of
+# titles, months and No., or a lowercase abbreviation
+RULE_START = r"[\d$£€#'½¼¾⅓⅔&–\-ABCDFGJLMNOPRS]|e[.t]|i\.|vs|ap"
+
+# How far past a respelled term's start rule lookaheads may read
+LOOKAHEAD_CHARS = 64
+
+Rule = namedtuple('Rule', ['name', 'pattern', 'expand'])
+Locale = namedtuple('Locale', ['name', 'day_first', 'hundred_and', 'title_period_optional', 'lieutenant'])
+
+LOCALES = {
+    'en-US': Locale('en-US', day_first=False, hundred_and=False, title_period_optional=False, lieutenant='Lieutenant'),
+    'en-GB': Locale('en-GB', day_first=True, hundred_and=True, title_period_optional=True, lieutenant='Leftenant'),
+}
+
+
+def cardinal(number, hundred_and=False):
+    """Words for a non-negative integer; numbers past the trillions are read digit by digit"""
+    if number < 20:
+        return ONES[number]
+    if number < 100:
+        tens, ones = divmod(number, 10)
+        return TENS[tens] + (f"-{ONES[ones]}" if ones else '')
+    if number < 1000:
+        hundreds, rest = divmod(number, 100)
+        words = f"{ONES[hundreds]} hundred"
+        if rest:
+            words += (' and ' if hundred_and else ' ') + cardinal(rest)
+        return words
+    if number >= 10 ** 15:
+        return ' '.join(ONES[int(digit)] for digit in str(number))
+    parts = []
+    for value, name in SCALES:
+        if number >= value:
+            head, number = divmod(number, value)
+            parts.append(f"{cardinal(head, hundred_and)} {name}")
+    if number:
+        parts.append(('and ' if hundred_and and number < 100 else '') + cardinal(number, hundred_and))
+    return ' '.join(parts)
+
+
+def ordinal(number, hundred_and=False):
+    """Words for an ordinal: 21 -> twenty-first"""
+    words = cardinal(number, hundred_and)
+    head, separator, last = max(words.rpartition(' '), words.rpartition('-'), key=lambda parts: len(parts[0]))
+    if last in IRREGULAR_ORDINALS:
+        last = IRREGULAR_ORDINALS[last]
+    elif last.endswith('y'):
+        last = last[:-1] + 'ieth'
+    else:
+        last += 'th'
+    return f"{head}{separator}{last}"
+
+
+def year(number, hundred_and=False):
+    """Words for a year: 1984 -> nineteen eighty-four, 2005 -> two thousand five"""
+    century, rest = divmod(number, 100)
+    if 2000 <= number < 2010:
+        return 'two thousand' + ((' and ' if hundred_and else ' ') + ONES[rest] if rest else '')
+    if rest == 0:
+        return f"{cardinal(century)} hundred"
+    return f"{cardinal(century)} {'oh ' + ONES[rest] if rest < 10 else cardinal(rest)}"
+
+
+def _plural(words):
+    """nineteen eighty -> nineteen eighties"""
+    return words[:-1] + 'ies' if words.endswith('y') else words + 's'
+
+
+def _digits(text):
+    """Words for each digit: 007 -> zero zero seven"""
+    return ' '.join(ONES[int(digit)] for digit in text)
+
+
+def _decimal(text, hundred_and=False):
+    """
+    Words for '3.14' or '1,250': digits after the point, and zero-padded
+    numbers like 007, are read one at a time
+    """
+    whole, _, fraction = text.replace(',', '').partition('.')
+    if len(whole) > 1 and whole.startswith('0'):
+        words = _digits(whole)
+    else:
+        words = cardinal(int(whole or 0), hundred_and)
+    if fraction:
+        words += ' point ' + _digits(fraction)
+    return words
+
+
+def _sentence_end(match):
+    """True if the period closing this match also ends the sentence"""
+    rest = match.string[match.end():match.end() + 3]
+    return not rest.strip() or bool(re.match(r'\s+["“‘(]?[A-Z]', rest))
+
+
+def _street_suffix(match):
+    """
+    True if St. or Dr. ends a street name: the next word opens a sentence,
+    or a name that does not itself open one comes before it
+    """
+    following = re.match(r"\s+([A-Z][\w'-]*)(?![\w.])", match.string[match.end():match.end() + 32])
+    if following and following.group(1) in SENTENCE_WORDS:
+        return True
+    before = match.string[max(0, match.start() - 64):match.start()]
+    found = re.search(r"([A-Z][\w'-]*)\s+$", before)
+    if not found or found.group(1) in SENTENCE_WORDS:
+        return False
+    prefix = before[:found.start()].rstrip()
+    return bool(prefix) and prefix[-1] not in '.!?"“‘('
+
+
+def _build_rules(locale):
+    """Ordered rules for a locale; earlier rules win where patterns start at the same position"""
+    hundred_and = locale.hundred_and
+    number = lambda text: _decimal(text, hundred_and)
+
+    def currency(match):
+        text = match.group()
+        unit, units, subunit, subunits = CURRENCIES[text[0]]
+        found = re.match(r'.([\d,]+)(?:\.(\d+))?\s?([A-Za-z]*)', text)
+        whole, fraction, magnitude = found.group(1), found.group(2), found.group(3).lower()
+        amount = int(whole.replace(',', ''))
+        if magnitude in MAGNITUDES or magnitude in MAGNITUDES.values():
+            scale = MAGNITUDES.get(magnitude, magnitude)
+            spoken = number(whole + (f".{fraction}" if fraction else ''))
+            return f"{spoken} {scale} {units}"
+        parts = []
+        if amount or not fraction:
+            parts.append(f"{cardinal(amount, hundred_and)} {unit if amount == 1 else units}")
+        if fraction:
+            if len(fraction) != 2:
+                return f"{number(whole + '.' + fraction)} {units}"
+            cents = int(fraction)
+            if cents:
+                parts.append(f"{cardinal(cents)} {subunit if cents == 1 else subunits}")
+        return ' and '.join(parts) if parts else f"zero {units}"
+
+    def time_of_day(match):
+        found = re.match(r'(\d{1,2}):(\d{2})\s?([ap])?', match.group(), re.IGNORECASE)
+        hours, minutes, meridiem = int(found.group(1)), int(found.group(2)), found.group(3)
+        if hours > 23 or minutes > 59 or (meridiem and not 1 <= hours <= 12):
+            return None
+        words = cardinal(hours)
+        if minutes:
+            words += ' ' + ('oh ' + ONES[minutes] if minutes < 10 else cardinal(minutes))
+        elif not meridiem:
+            words += " o'clock" if hours <= 12 else ' hundred'
+        if meridiem:
+            words += ' AM' if meridiem.lower() == 'a' else ' PM'
+            if _sentence_end(match) and match.group().endswith('.'):
+                words += '.'
+        return words
+
+    def spoken_date(month, day, year_number=None):
+        if not 1 <= month <= 12 or not 1 <= day <= 31:
+            return None
+        if locale.day_first:
+            words = f"the {ordinal(day)} of {MONTHS[month - 1]}"
+        else:
+            words = f"{MONTHS[month - 1]} {ordinal(day)}"
+        return words + (f", {year(year_number, hundred_and)}" if year_number else '')
+
+    def iso_date(match):
+        year_number, month, day = (int(part) for part in match.group().split('-'))
+        return spoken_date(month, day, year_number)
+
+    def numeric_date(match):
+        first, second, year_number = (int(part) for part in match.group().split('/'))
+        day, month = (first, second) if locale.day_first else (second, first)
+        return spoken_date(month, day, year_number)
+
+    def month_day(match):
+        found = re.match(r'([A-Za-z]+)\.?\s+(\d{1,2})', match.group())
+        return spoken_date(MONTH_NUMBERS[found.group(1)[:3].lower()], int(found.group(2)))
+
+    def day_month(match):
+        found = re.match(r'(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)', match.group())
+        return spoken_date(MONTH_NUMBERS[found.group(2)[:3].lower()], int(found.group(1)))
+
+    def title(match):
+        name = match.group().rstrip('.')
+        if name in STREET_SUFFIXES and _street_suffix(match):
+            words = STREET_SUFFIXES[name]
+            return words + '.' if match.group().endswith('.') and _sentence_end(match) else words
+        return locale.lieutenant if name == 'Lt' else TITLES[name]
+
+    def abbreviation(match):
+        words = ABBREVIATIONS[match.group()]
+        return words + '.' if _sentence_end(match) and match.group() not in ('vs.', 'e.g.', 'i.e.') else words
+
+    title_names = '|'.join(sorted(list(TITLES) + ['Lt'], key=len, reverse=True))
+    title_period = r'\.?' if locale.title_period_optional else r'\.'
+    abbreviation_pattern = '|'.join(re.escape(abbr) for abbr in sorted(ABBREVIATIONS, key=len, reverse=True))
+    amount = r'\d{1,3}(?:,\d{3})+|\d+'
+
+    rules = [
+        Rule('currency', rf'[$£€](?:{amount})(?:\.\d+)?(?:[KMBTkmbt]n?\b|\s?(?:thousand|million|billion|trillion)\b)?', currency),
+        Rule('time', r'(?<![\w:])\d{1,2}:\d{2}(?:\s?[AaPp]\.?[Mm]\b\.?|(?![\d:]))', time_of_day),
+        Rule('date', r'(?<!\w)\d{4}-\d{2}-\d{2}(?!\w)', iso_date),
+        Rule('date_numeric', r'(?<![\w/])\d{1,2}/\d{1,2}/\d{4}(?![\w/])', numeric_date),
+        Rule('date_month_day', rf'\b{MONTH_PATTERN}\s+\d{{1,2}}(?:st|nd|rd|th)?(?![\w:])', month_day),
+        Rule('date_day_month', rf'(?<!\w)\d{{1,2}}(?:st|nd|rd|th)?\s+{MONTH_PATTERN}\b', day_month),
+        Rule('ordinal', r'(?<!\w)\d+(?:st|nd|rd|th)\b', lambda m: ordinal(int(m.group()[:-2]), hundred_and)),
+        Rule('decade', r"(?<!\w)'?(?:1[5-9]|20)?\d0s\b", lambda m: _plural(
+            year(int(m.group().strip("'s")), hundred_and) if len(m.group().strip("'s")) == 4 else cardinal(int(m.group().strip("'s"))))),
+        Rule('percent', rf'(?<![\w.])(?:{amount})(?:\.\d+)?\s?%', lambda m: number(m.group().rstrip('% ')) + ' percent'),
+        Rule('degrees', rf'(?<![\w.])-?(?:{amount})(?:\.\d+)?\s?°[CF]?', lambda m: (
+            ('minus ' if m.group().startswith('-') else '') + number(m.group().lstrip('-').split('°')[0].strip())
+            + ' degrees' + {'C': ' Celsius', 'F': ' Fahrenheit'}.get(m.group()[-1], ''))),
+        Rule('fraction', r'(?<![\w.])\d+[½¼¾⅓⅔]|[½¼¾⅓⅔]', lambda m: (
+            f"{cardinal(int(m.group()[:-1]), hundred_and)} and {FRACTIONS[m.group()[-1]]}" if len(m.group()) > 1 else FRACTION_WORDS[m.group()])),
+        # Digits joined by hyphens (phone numbers, codes) are left for the engine to read
+        Rule('year', r'(?<![\w.,$£€-])(?:1[5-9]|20)\d\d(?![\w.,-]\d|\w)', lambda m: year(int(m.group()), hundred_and)),
+        Rule('number', rf'(?<![\w.,-])(?:{amount})(?:\.\d+)?(?!\w|[.,-]\d)', lambda m: number(m.group())),
+        Rule('number_sign', r'(?<!\w)(?:No\.|#)\s?(?=\d)', lambda m: 'number '),
+        Rule('title', rf'\b(?:{title_names}){title_period}(?=\s+[A-Z])', title),
+        Rule('abbreviation', rf'(?<!\w)(?:{abbreviation_pattern})', abbreviation),
+        Rule('ampersand', r'(?<=\s)&(?=\s)', lambda m: 'and'),
+        Rule('range', r'(?<=\d)–(?=\d)', lambda m: ' to '),
+    ]
+    return rules
+
+
+def _splice(text, spans):
+    """text with each (start, end, replacement) span, in order and not overlapping, replaced"""
+    parts = []
+    position = 0
+    for start, end, replacement in spans:
+        parts.append(text[position:start])
+        parts.append(replacement)
+        position = end
+    if not parts:
+        return text
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+class TextFrontend:
+    """
+    One locale's compiled rule set. expand() rewrites a chunk in a single
+    left-to-right scan of one alternation regex, and annotate() reports the
+    same spans with what will be spoken instead, for the editor. Both take
+    the lexicon's respellings as (start, end, respelling) spans, which are
+    spoken verbatim and never expanded. Hits per rule are counted for
+    diagnostics.
+    """
+
+    def __init__(self, locale):
+        self.locale = locale
+        self.rules = _build_rules(locale)
+        self.handlers = {rule.name: rule.expand for rule in self.rules}
+        # The lookahead rejects most positions in prose before any alternative is tried
+        alternatives = '|'.join(f"(?P<{rule.name}>{rule.pattern})" for rule in self.rules)
+        self.pattern = re.compile(f"(?={RULE_START})(?:{alternatives})")
+        self.hits = Counter()
+        self._lock = threading.Lock()
+
+    def _spans(self, text, respellings=()):
+        """Yield (start, end, rule, spoken) for every span read differently than written"""
+        position = 0
+        for start, end, respelling in [*respellings, (len(text), len(text), None)]:
+            # Rules see past the respelled term's start, so lookaheads read the
+            # word that follows, but only matches between respelled terms are kept
+            for match in self.pattern.finditer(text, position, min(len(text), start + LOOKAHEAD_CHARS)):
+                if match.start() >= start:
+                    break
+                if match.end() > start:
+                    continue
+                try:
+                    spoken = self.handlers[match.lastgroup](match)
+                except (KeyError, ValueError, IndexError, AttributeError) as e:
+                    logging.debug(f"Text front-end rule {match.lastgroup} skipped {match.group()!r}: {e}")
+                    continue
+                if spoken is not None and spoken != match.group():
+                    yield match.start(), match.end(), match.lastgroup, spoken
+            if respelling is not None:
+                yield start, end, 'lexicon', respelling
+            position = end
+
+    def _count(self, counts):
+        with self._lock:
+            self.hits.update(counts)
+
+    def expand(self, text, respellings=()):
+        """Text with the respellings spliced in and every rule applied around them"""
+        if not text:
+            return text
+        spans = list(self._spans(text, respellings))
+        counts = Counter(rule for _, _, rule, _ in spans if rule != 'lexicon')
+        if counts:
+            self._count(counts)
+        return _splice(text, ((start, end, spoken) for start, end, _, spoken in spans))
+
+    def annotate(self, text, respellings=()):
+        """[{'start', 'end', 'rule', 'text', 'spoken'}] for each span read differently than written"""
+        return [
+            {'start': start, 'end': end, 'rule': rule, 'text': text[start:end], 'spoken': spoken}
+            for start, end, rule, spoken in self._spans(text or '', respellings)
+        ]
+
+    def stats(self):
+        """Hits per rule since the process started"""
+        with self._lock:
+            return dict(self.hits)
+
+
+@lru_cache(maxsize=None)
+def get_frontend(locale=None):
+    """Compiled front-end for a locale (TTS_LOCALE by default); unknown locales use en-US"""
+    name = locale or DEFAULT_LOCALE
+    if name not in LOCALES:
+        logging.warning(f"No text front-end rules for locale {name}; using en-US")
+        name = 'en-US'
+    return TextFrontend(LOCALES[name])
+
+
+def expand_text(text, locale=None, respellings=()):
+    """
+    Expand numerals, currency, dates, times, abbreviations and symbols for
+    speech. respellings are the lexicon's (start, end, respelling) spans of
+    text; they are spliced in as written and the rules never touch them.
+    """
+    if not text:
+        return text
+    if not ENABLED:
+        return _splice(text, respellings)
+    return get_frontend(locale).expand(text, respellings)
+
+
+def annotate_text(text, locale=None, respellings=()):
+    """What expand_text() would change, as spans of text for the editor"""
+    if not ENABLED:
+        return [
+            {'start': start, 'end': end, 'rule': 'lexicon', 'text': text[start:end], 'spoken': respelling}
+            for start, end, respelling in respellings
+        ]
+    return get_frontend(locale).annotate(text, respellings)
@@ -0,0 +1,43 @@
+import re
+
+# Characters after which a line break already reads as a pause
+PAUSE_PUNCTUATION = '.!?…,;:"\'”’)]'
+SENTENCE_END = ('.', '!', '?', '…', '"', '\'', '”', '’', ')', ']')
+
+# Whitespace other than a single space: any run starting with a tab or line
+# break, or a space followed by more whitespace. Single spaces between words
+# never match, so the callback only runs once per line break or run.
+_WHITESPACE = re.compile(r'[\t\n\r\f\v]\s*| \s+')
+
+
+def _replace(match):
+    """A line break after unpunctuated text becomes a sentence break; anything else a space"""
+    if '\n' in match.group() and match.string[match.start() - 1] not in PAUSE_PUNCTUATION:
+        return '. '
+    return ' '
+
+
+def normalize_text(text):
+    """
+    Prepare text for speech synthesis in a single regex pass. Line breaks
+    become sentence breaks so headings and unpunctuated lines get a pause,
+    whitespace runs collapse to one space, and the text ends on punctuation.
+    The words themselves are never rewritten.
+    """
+    if not text:
+        return ''
+
+    normalized = _WHITESPACE.sub(_replace, text.strip())
+    if normalized.endswith((',', ';', ':')):
+        normalized = normalized[:-1] + '.'
+    elif normalized and not normalized.endswith(SENTENCE_END):
+        normalized += '.'
+    return normalized
+
+
+def iter_normalized(texts):
+    """Normalize an iterable of texts (e.g. chapters) lazily, one at a time"""
+    for text in texts:
+        normalized = normalize_text(text)
+        if normalized:
+            yield normalized
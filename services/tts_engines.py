@@ -0,0 +1,186 @@
+import os
+import io
+import math
+import time
+import wave
+import random
+import struct
+import logging
+import threading
+from openai import OpenAI
+from services.mp3_utils import build_frame_header, silent_frames, parse_frame_header
+
+STREAM_CHUNK_SIZE = 8192
+
+
+class SimulatedTTSError(Exception):
+    """Error raised by the local engine; carries a status code like an SDK error"""
+
+    def __init__(self, message, status_code=503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TTSEngine:
+    """
+    Interface every speech engine implements. Engines only turn text into
+    audio bytes; chunking, caching, rate limiting and storage stay in
+    TTSService so they behave the same whichever engine is configured.
+    """
+
+    name = 'base'
+    formats = ('mp3',)
+
+    @property
+    def available(self):
+        return True
+
+    def limiter_key(self, model):
+        """Name under which calls are rate limited and segments cached"""
+        return model
+
+    def synthesize(self, text, voice, model, response_format='mp3'):
+        """Return the complete audio for text"""
+        raise NotImplementedError
+
+    def stream(self, text, voice, model, response_format='mp3'):
+        """Yield audio bytes as they become available"""
+        audio = self.synthesize(text, voice, model, response_format)
+        for position in range(0, len(audio), STREAM_CHUNK_SIZE):
+            yield audio[position:position + STREAM_CHUNK_SIZE]
+
+
+class OpenAIEngine(TTSEngine):
+    """OpenAI text-to-speech API"""
+
+    name = 'openai'
+    formats = ('mp3', 'opus', 'aac', 'flac', 'wav', 'pcm')
+
+    def __init__(self, api_key=None):
+        api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        # Retries go through the shared rate limiter instead of the SDK's own backoff
+        self.client = OpenAI(api_key=api_key, max_retries=0) if api_key else None
+        if not self.client:
+            logging.warning("OPENAI_API_KEY not found - text-to-speech is unavailable")
+
+    @property
+    def available(self):
+        return self.client is not None
+
+    def _require_client(self):
+        if not self.client:
+            raise Exception("OpenAI API key not configured")
+
+    def synthesize(self, text, voice, model, response_format='mp3'):
+        self._require_client()
+        return self.client.audio.speech.create(
+            model=model,
+            voice=voice,
+            input=text,
+            response_format=response_format
+        ).content
+
+    def stream(self, text, voice, model, response_format='mp3'):
+        self._require_client()
+        with self.client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            input=text,
+            response_format=response_format
+        ) as response:
+            yield from response.iter_bytes(chunk_size=STREAM_CHUNK_SIZE)
+
+
+class LocalTTSEngine(TTSEngine):
+    """
+    Deterministic offline engine for load tests and CI. Output length follows
+    the text at a fixed speaking rate, so the same text always produces the
+    same bytes. MP3 output is silent frames (there is no encoder to draw on);
+    WAV and raw PCM output are a per-voice sine tone, or silence when the
+    tone is off.
+    Latency and failures are simulated from a seeded generator, with failures
+    raising 503s so the rate limiter's retry path is exercised too.
+    """
+
+    name = 'local'
+    formats = ('mp3', 'wav', 'pcm')
+
+    # Each voice gets its own pitch so renders are easy to tell apart by ear
+    VOICE_TONES = {'alloy': 220, 'echo': 247, 'fable': 262, 'onyx': 196, 'nova': 294, 'shimmer': 330}
+
+    def __init__(self, chars_per_second=None, latency=None, latency_per_char=None,
+                 error_rate=None, seed=None, tone=None, sample_rate=24000, bitrate_kbps=64):
+        env = os.environ.get
+        self.chars_per_second = float(chars_per_second or env('LOCAL_TTS_CHARS_PER_SECOND', 15))
+        self.latency = float(latency if latency is not None else env('LOCAL_TTS_LATENCY_MS', 0)) / 1000
+        self.latency_per_char = float(latency_per_char if latency_per_char is not None else env('LOCAL_TTS_LATENCY_PER_CHAR_MS', 0)) / 1000
+        self.error_rate = float(error_rate if error_rate is not None else env('LOCAL_TTS_ERROR_RATE', 0))
+        self.tone = tone if tone is not None else env('LOCAL_TTS_TONE', 'false').lower() == 'true'
+        self.sample_rate = sample_rate
+        self.frame_header = build_frame_header(bitrate_kbps, sample_rate, mono=True)
+        self._random = random.Random(int(seed if seed is not None else env('LOCAL_TTS_SEED', 0)))
+        self._lock = threading.Lock()
+
+    def limiter_key(self, model):
+        # Keep simulated traffic out of the real model's quotas and cache entries
+        return f"{self.name}-{model}"
+
+    def duration_for(self, text):
+        """Seconds of audio produced for text"""
+        return max(len(text), 1) / self.chars_per_second
+
+    def _simulate_call(self, text):
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+        time.sleep(self.latency + self.latency_per_char * len(text))
+        if fail:
+            raise SimulatedTTSError("Simulated TTS failure")
+
+    def _mp3(self, duration):
+        frame = parse_frame_header(self.frame_header, 0)
+        count = math.ceil(duration * frame['sample_rate'] / frame['samples'])
+        return silent_frames(self.frame_header, count)
+
+    def _pcm(self, duration, voice):
+        samples = int(duration * self.sample_rate)
+        if self.tone:
+            step = 2 * math.pi * self.VOICE_TONES.get(voice, 220) / self.sample_rate
+            return struct.pack(f'<{samples}h', *(int(8000 * math.sin(step * i)) for i in range(samples)))
+        return bytes(samples * 2)
+
+    def _wav(self, duration, voice):
+        pcm = self._pcm(duration, voice)
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(pcm)
+        return buffer.getvalue()
+
+    def synthesize(self, text, voice, model, response_format='mp3'):
+        if response_format not in self.formats:
+            raise ValueError(f"Local engine cannot produce {response_format}")
+        self._simulate_call(text)
+        duration = self.duration_for(text)
+        if response_format == 'wav':
+            return self._wav(duration, voice)
+        if response_format == 'pcm':
+            return self._pcm(duration, voice)
+        return self._mp3(duration)
+
+
+ENGINES = {
+    'openai': OpenAIEngine,
+    'local': LocalTTSEngine,
+}
+
+
+def create_engine(name=None):
+    """Build the engine named by TTS_ENGINE (default: openai)"""
+    name = (name or os.environ.get('TTS_ENGINE', 'openai')).lower()
+    engine_class = ENGINES.get(name)
+    if not engine_class:
+        raise ValueError(f"Unknown TTS engine: {name}")
+    logging.info(f"Using '{name}' text-to-speech engine")
+    return engine_class()
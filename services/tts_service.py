@@ -1,17 +1,73 @@
 import os
+import time
 import logging
-import tempfile
-from openai import OpenAI
+from io import BytesIO
 from flask import current_app
 import boto3
 from botocore.exceptions import NoCredentialsError
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.chunking_service import plan_chunks, TTS_INPUT_LIMIT, DEFAULT_MAX_CHARS
+from services.text_normalizer import normalize_text
+from services.text_frontend import expand_text
+from services.segment_cache import segment_cache, segment_key
+from services.storage_service import TRANSFER_CONFIG
+from services.rate_limiter import rate_limiter
+from services.scheduler import scheduler, in_context
+from services.single_flight import single_flight, fingerprint
+from services.mp3_utils import audio_payload, iter_audio_payload, parse_frame_header, pause_frames
+from services.audio_formats import OUTPUT_FORMATS, join_segments, audio_info
+from services.tts_engines import create_engine
+from services.audio_cache import audio_file_cache
+
+# Silence inserted after each chunk, by the boundary that ends it. Pauses are
+# pre-encoded MP3 frames rather than punctuation, so they cost nothing to
+# synthesize and always last the same.
+PAUSE_SECONDS = {
+    'sentence': int(os.environ.get('TTS_PAUSE_SENTENCE_MS', 250)) / 1000,
+    'paragraph': int(os.environ.get('TTS_PAUSE_PARAGRAPH_MS', 750)) / 1000,
+    'chapter': int(os.environ.get('TTS_PAUSE_CHAPTER_MS', 2000)) / 1000,
+    'end': 0,
+}
+
+# Price per million characters by model, and the speaking rate used to
+# forecast how long a text will play before it is rendered
+PRICE_PER_MILLION_CHARS = {
+    'tts-1': float(os.environ.get('TTS_PRICE_TTS_1', 15.00)),
+    'tts-1-hd': float(os.environ.get('TTS_PRICE_TTS_1_HD', 30.00)),
+}
+SPEECH_CHARS_PER_SECOND = float(os.environ.get('TTS_SPEECH_CHARS_PER_SECOND', 15))
+
+# Editor previews of a selection: short chunks keep the first request, and so
+# the time to first byte, small; longer selections belong in a full render
+PREVIEW_CHUNK_CHARS = int(os.environ.get('TTS_PREVIEW_CHUNK_CHARS', 300))
+PREVIEW_MAX_CHARS = int(os.environ.get('TTS_PREVIEW_MAX_CHARS', 1000))
+
+# Quality tiers. Drafts (previews, iteration, full-book renders) use the fast
+# model; chapters marked final are promoted to the HD model.
+QUALITY_TIERS = {
+    'draft': os.environ.get('TTS_DRAFT_MODEL', 'tts-1'),
+    'final': os.environ.get('TTS_FINAL_MODEL', 'tts-1-hd'),
+}
+
+
+def chunk_pauses(chunks):
+    """Seconds of silence to insert after each planned chunk"""
+    return [PAUSE_SECONDS.get(chunk['boundary'], 0) for chunk in chunks]
+
 
 class TTSService:
     def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+        # Speech engine chosen by TTS_ENGINE; 'local' runs the pipeline offline
+        self.engine = create_engine()
         self.voices = ['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer']
-        self.model = 'tts-1'  # or 'tts-1-hd' for higher quality
+        self.model = QUALITY_TIERS['draft']  # Default model; see model_for for the final tier
+        
+        # Long manuscripts are split into chunks and synthesized concurrently
+        self.max_chunk_chars = int(os.environ.get('TTS_CHUNK_MAX_CHARS', DEFAULT_MAX_CHARS))
+        self.max_workers = int(os.environ.get('TTS_MAX_WORKERS', 4))
+        # Synthesis time per character, learned from completed calls; seeds plan forecasts
+        self.seconds_per_char = float(os.environ.get('TTS_SECONDS_PER_CHAR', 0.01))
         
         # Setup S3/Wasabi for audio storage
         self.s3_client = None
@@ -33,36 +89,145 @@ class TTSService:
             except Exception as e:
                 logging.warning(f"Failed to initialize S3 client: {e}")
 
-    def optimize_text_for_speech(self, text):
+    def optimize_text_for_speech(self, text, lexicon=None):
         """
         Optimize text for better speech synthesis since OpenAI TTS doesn't support SSML.
-        Uses punctuation and formatting for natural pauses and flow.
+        Line breaks become sentence breaks for natural pauses; see services/text_normalizer.py.
+        A project's pronunciation lexicon, if given, respells its terms, and the
+        text front-end then spells out numbers, dates, abbreviations and symbols
+        (services/text_frontend.py) around them. Respelled terms are never expanded.
         """
         if not text or not text.strip():
             return ""
-            
-        # Clean up the text
-        optimized = text.strip()
         
-        # Add chapter breaks with longer pauses
-        optimized = optimized.replace('\n\n\n', '.\n\n')
+        normalized = normalize_text(text)
+        return expand_text(normalized, respellings=lexicon.spans(normalized) if lexicon else ())
+
+    def plan_synthesis(self, text, lexicon=None, max_chars=None):
+        """
+        Split text into chunks of up to max_chars (TTS_CHUNK_MAX_CHARS by
+        default) and optimize each one for speech.
+        Chunks that grow past the API input limit during optimization are split again.
+        """
+        max_chars = max_chars or self.max_chunk_chars
+        planned = []
+        for chunk in plan_chunks(text, max_chars):
+            optimized = self.optimize_text_for_speech(chunk['text'], lexicon)
+            if len(optimized) > TTS_INPUT_LIMIT:
+                pieces = plan_chunks(optimized, max_chars)
+                for piece in pieces[:-1]:
+                    planned.append({'text': piece['text'], 'boundary': 'sentence'})
+                planned.append({'text': pieces[-1]['text'], 'boundary': chunk['boundary']})
+            elif optimized:
+                planned.append({'text': optimized, 'boundary': chunk['boundary']})
         
-        # Ensure proper sentence endings
-        optimized = optimized.replace('\n', '. ')
+        for index, chunk in enumerate(planned):
+            chunk['index'] = index
+        return planned
+
+    def model_for(self, tier):
+        """API model for a quality tier ('draft' or 'final')"""
+        return QUALITY_TIERS.get(tier, self.model)
+
+    def engine_model_for(self, model=None):
+        """Model name as seen by the rate limiter and segment cache for the current engine"""
+        return self.engine.limiter_key(model or self.model)
+
+    @property
+    def engine_model(self):
+        return self.engine_model_for(self.model)
+
+    def synthesize_chunk(self, text, voice, response_format='mp3', model=None):
+        """Synthesize a single chunk of text and return its audio bytes"""
+        model = model or self.model
+        with scheduler.slot(len(text)):
+            started = time.monotonic()
+            audio = rate_limiter.call(
+                self.engine_model_for(model),
+                len(text),
+                lambda: self.engine.synthesize(text, voice, model, response_format)
+            )
+            # Moving average; calls that waited on retries still count, as they will for the next plan
+            observed = (time.monotonic() - started) / max(1, len(text))
+            self.seconds_per_char += 0.1 * (observed - self.seconds_per_char)
+            return audio
+
+    def synthesize_cached(self, text, voice, response_format='mp3', model=None):
+        """
+        Return (audio bytes, cache hit) for a chunk, only calling the TTS API
+        when the segment cache has no audio for this text, voice, model and format
+        """
+        key = segment_key(text, voice, self.engine_model_for(model), response_format)
+        cached = segment_cache.get(key, response_format)
+        if cached is not None:
+            return cached, True
         
-        # Add pauses after chapter markers
-        optimized = optimized.replace('Chapter ', '... Chapter ')
+        audio = self.synthesize_chunk(text, voice, response_format, model)
+        segment_cache.put(key, audio, response_format)
+        return audio, False
+
+    def plan_id(self, chunks, voice, response_format='mp3', model=None):
+        """Fingerprint of a chunk plan, so checkpoints are only reused for identical work"""
+        # MP3 plans keep the fingerprint they had before other formats existed
+        engine_model = self.engine_model_for(model)
+        prefix = f"{voice}:{engine_model}" if response_format == 'mp3' else f"{voice}:{engine_model}:{response_format}"
+        digest = hashlib.sha256(prefix.encode('utf-8'))
+        for chunk in chunks:
+            digest.update(b'\x00' + chunk['text'].encode('utf-8'))
+        return digest.hexdigest()
+
+    def synthesize_chunks(self, chunks, voice, progress_callback=None, checkpoint=None, response_format='mp3', model=None):
+        """
+        Synthesize chunks on a bounded worker pool, returning (audio, cache hit)
+        pairs in chunk order. progress_callback receives the completed fraction.
+        With a checkpoint, chunks it restores are skipped and every chunk that
+        finishes is recorded, so a retried render continues where it stopped.
+        """
+        if not chunks:
+            return []
         
-        # Ensure proper punctuation for natural pauses
-        lines = optimized.split('. ')
-        lines = [line.strip() + '.' if line.strip() and not line.strip().endswith(('.', '!', '?')) else line.strip() for line in lines]
-        optimized = ' '.join(lines)
+        results = [None] * len(chunks)
+        if checkpoint:
+            for position, audio in checkpoint.restore(self.plan_id(chunks, voice, response_format, model), chunks, response_format).items():
+                results[position] = (audio, True)
+        pending = [position for position, result in enumerate(results) if result is None]
+        done = len(chunks) - len(pending)
+        if done:
+            logging.info(f"Resuming render: {done} of {len(chunks)} chunks restored from checkpoint")
+            if progress_callback:
+                progress_callback(done / len(chunks))
+        if not pending:
+            return results
         
-        return optimized
+        workers = max(1, min(self.max_workers, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts') as executor:
+            futures = {
+                executor.submit(in_context(self.synthesize_cached), chunks[position]['text'], voice, response_format, model): position
+                for position in pending
+            }
+            try:
+                for future in as_completed(futures):
+                    position = futures[future]
+                    results[position] = future.result()
+                    done += 1
+                    if checkpoint:
+                        key = segment_key(chunks[position]['text'], voice, self.engine_model_for(model), response_format)
+                        checkpoint.save(position, key, len(results[position][0]))
+                    if progress_callback:
+                        progress_callback(done / len(chunks))
+            except BaseException:
+                # Don't keep paying for chunks once the render has failed or been cancelled
+                for future in futures:
+                    future.cancel()
+                raise
+        return results
 
-    def generate_audio(self, text, voice='alloy', project_id=None, chapter_id=None):
+    def generate_audio(self, text, voice='alloy', project_id=None, chapter_id=None, progress_callback=None, checkpoint=None, lexicon=None, response_format='mp3', model=None):
         """
-        Generate audio from text using OpenAI TTS API
+        Generate audio from text using OpenAI TTS API, in one of OUTPUT_FORMATS.
+        model defaults to the draft tier. The chunk plan does not depend on the
+        model, so a final-tier render splits the text exactly as its drafts did
+        and only chunks without HD audio in the segment cache are synthesized.
         """
         try:
             if not text or not text.strip():
@@ -70,54 +235,35 @@ class TTSService:
             
             if voice not in self.voices:
                 voice = 'alloy'  # Default voice
+            model = model or self.model
             
-            # Optimize text for better speech synthesis
-            optimized_text = self.optimize_text_for_speech(text)
+            if response_format not in OUTPUT_FORMATS:
+                raise ValueError(f"Unsupported output format: {response_format}")
+            segment_format = OUTPUT_FORMATS[response_format]['segment_format']
+            if segment_format not in self.engine.formats:
+                raise ValueError(f"The {self.engine.name} engine cannot render {response_format}")
             
-            # Generate audio using OpenAI TTS
-            logging.info(f"Generating audio with voice '{voice}' for {len(optimized_text)} characters")
-            
-            response = self.client.audio.speech.create(
-                model=self.model,
-                voice=voice,
-                input=optimized_text,
-                response_format='mp3'
-            )
-            
-            # Create a unique filename
-            text_hash = hashlib.md5(optimized_text.encode()).hexdigest()[:8]
-            filename = f"audio_{project_id}_{chapter_id}_{text_hash}.mp3" if chapter_id else f"audio_{project_id}_{text_hash}.mp3"
-            
-            # Save to temporary file first
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
+            # Split into chunks below the API input limit and optimize each for speech
+            chunks = self.plan_synthesis(text, lexicon)
+            if not chunks:
+                raise ValueError("Text content is required for audio generation")
+            optimized_text = ' '.join(chunk['text'] for chunk in chunks)
             
-            # Upload to S3/Wasabi if configured
-            audio_url = None
-            if self.s3_client:
-                try:
-                    s3_key = f"audio/{filename}"
-                    self.s3_client.upload_file(temp_file_path, self.bucket_name, s3_key)
-                    audio_url = f"{os.environ.get('WASABI_ENDPOINT')}/{self.bucket_name}/{s3_key}"
-                    logging.info(f"Audio uploaded to S3: {audio_url}")
-                except Exception as e:
-                    logging.error(f"Failed to upload to S3: {e}")
+            # Generate audio using OpenAI TTS
+            logging.info(f"Generating audio with voice '{voice}' and model '{model}' for {len(optimized_text)} characters in {len(chunks)} chunks")
             
-            # Clean up temp file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+            def render():
+                results = self.synthesize_chunks(chunks, voice, progress_callback, checkpoint, segment_format, model)
+                audio_content = join_segments(response_format, [audio for audio, _ in results], chunk_pauses(chunks))
+                cached_chunks = sum(1 for _, hit in results if hit)
+                logging.info(f"Segment cache served {cached_chunks} of {len(chunks)} chunks")
+                result = self.store_render(audio_content, optimized_text, voice, project_id, chapter_id, len(chunks), cached_chunks, response_format)
+                result['model'] = model
+                return result
             
-            return {
-                'success': True,
-                'audio_url': audio_url,
-                'filename': filename,
-                'duration_estimate': len(optimized_text) / 150,  # Rough estimate: 150 chars per minute
-                'voice': voice,
-                'text_length': len(optimized_text)
-            }
+            # Identical renders already in flight (double clicks, retried requests) share one result
+            key = fingerprint('generate_audio', self.plan_id(chunks, voice, response_format, model), project_id, chapter_id)
+            return single_flight.do(key, render)
             
         except Exception as e:
             logging.error(f"TTS generation error: {e}")
@@ -126,27 +272,191 @@ class TTSService:
                 'error': 'Failed to generate audio. Please try again later.'
             }
 
+    def store_render(self, audio_content, optimized_text, voice, project_id=None, chapter_id=None, chunk_count=1, cached_chunks=0, response_format='mp3'):
+        """
+        Upload a finished render and describe it in the result format returned by generate_audio
+        """
+        # Create a unique filename; each format gets its own key
+        text_hash = hashlib.md5(optimized_text.encode()).hexdigest()[:8]
+        extension = OUTPUT_FORMATS[response_format]['extension']
+        filename = f"audio_{project_id}_{chapter_id}_{text_hash}.{extension}" if chapter_id else f"audio_{project_id}_{text_hash}.{extension}"
+        
+        # Upload to S3/Wasabi if configured, straight from memory
+        audio_url = None
+        storage_key = None
+        if self.s3_client:
+            try:
+                s3_key = f"audio/{filename}"
+                self.s3_client.upload_fileobj(
+                    BytesIO(audio_content),
+                    self.bucket_name,
+                    s3_key,
+                    ExtraArgs={'ContentType': OUTPUT_FORMATS[response_format]['content_type']},
+                    Config=TRANSFER_CONFIG
+                )
+                storage_key = s3_key
+                audio_url = f"{os.environ.get('WASABI_ENDPOINT')}/{self.bucket_name}/{s3_key}"
+                logging.info(f"Audio uploaded to S3: {audio_url}")
+                # Seed the serving cache so the first playback doesn't download it again
+                audio_file_cache.put(s3_key, audio_content)
+            except Exception as e:
+                logging.error(f"Failed to upload to S3: {e}")
+        
+        # Exact runtime from the stream headers; fall back to the text estimate
+        info = audio_info(response_format, audio_content)
+        duration_seconds = info['duration_seconds'] if info else len(optimized_text) / 150 * 60
+        
+        return {
+            'success': True,
+            'audio_url': audio_url,
+            'storage_key': storage_key,
+            'filename': filename,
+            'duration_seconds': round(duration_seconds, 3),
+            'duration_estimate': duration_seconds / 60,  # Minutes
+            'format': response_format,
+            'bitrate_kbps': info.get('bitrate_kbps') if info else None,
+            'frame_count': info.get('frames') if info else None,
+            'voice': voice,
+            'text_length': len(optimized_text),
+            'chunk_count': chunk_count,
+            'cached_chunks': cached_chunks
+        }
+
+    def stream_chunk(self, text, voice):
+        """
+        Yield MP3 bytes for one chunk as the API produces them, caching the
+        complete segment once the stream finishes
+        """
+        key = segment_key(text, voice, self.engine_model, 'mp3')
+        cached = segment_cache.get(key, 'mp3')
+        if cached is not None:
+            yield cached
+            return
+        
+        audio = bytearray()
+        with scheduler.slot(len(text)), rate_limiter.limited(self.engine_model, len(text)):
+            for data in self.engine.stream(text, voice, self.model, 'mp3'):
+                audio += data
+                yield data
+        segment_cache.put(key, bytes(audio), 'mp3')
+
+    def stream_audio(self, text, voice='alloy', project_id=None, chapter_id=None, on_complete=None, lexicon=None, store=True, max_chars=None,
+                     prefetch_priority='chapter'):
+        """
+        Generator yielding MP3 bytes while the audio is synthesized. The first
+        chunk streams straight from the API while later chunks are prefetched
+        on the worker pool. Everything sent is teed into a buffer; once the
+        whole text has streamed the render is stored and on_complete receives
+        the same result dict generate_audio returns. If the client disconnects
+        early nothing is stored and pending chunks are cancelled. With
+        store=False only the segment cache keeps the audio. Prefetched chunks
+        are scheduled at prefetch_priority.
+        """
+        if voice not in self.voices:
+            voice = 'alloy'
+        
+        chunks = self.plan_synthesis(text, lexicon, max_chars)
+        if not chunks:
+            return
+        optimized_text = ' '.join(chunk['text'] for chunk in chunks)
+        logging.info(f"Streaming audio with voice '{voice}' for {len(optimized_text)} characters in {len(chunks)} chunks")
+        
+        tee = bytearray()
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(chunks) - 1)), thread_name_prefix='tts-stream')
+        try:
+            # In a long stream only the first chunk is on the listener's critical path
+            synthesize = in_context(self.synthesize_cached, priority=prefetch_priority)
+            prefetched = [executor.submit(synthesize, chunk['text'], voice) for chunk in chunks[1:]]
+            
+            pauses = chunk_pauses(chunks)
+            for data in iter_audio_payload(self.stream_chunk(chunks[0]['text'], voice)):
+                tee += data
+                yield data
+            
+            for future, pause in zip(prefetched, pauses):
+                audio, _ = future.result()
+                # Pause after the previous chunk, in the format the stream already uses
+                frame = parse_frame_header(tee, 0)
+                audio = (pause_frames(frame, pause) if frame and pause else b'') + audio_payload(audio)
+                tee += audio
+                yield audio
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if not store:
+            return
+        result = self.store_render(bytes(tee), optimized_text, voice, project_id, chapter_id, len(chunks))
+        if on_complete:
+            on_complete(result)
+
+    def stream_preview(self, text, voice='alloy', lexicon=None):
+        """
+        Stream MP3 of a short passage (an editor selection) without storing a
+        render. Chunks are sentence-sized so the first one comes back quickly,
+        and all of them stay interactive since the listener reaches the last
+        within seconds. Every chunk lands in the segment cache, so replaying
+        the same passage calls nothing.
+        """
+        return self.stream_audio(text, voice, lexicon=lexicon, store=False, max_chars=PREVIEW_CHUNK_CHARS,
+                                 prefetch_priority='interactive')
+
     def get_available_voices(self):
         """Get list of available voices"""
         return self.voices
 
-    def estimate_cost(self, text):
+    def billable_chunks(self, chunks, voice, model=None):
+        """Character counts of the planned chunks the segment cache can't serve"""
+        engine_model = self.engine_model_for(model)
+        return [
+            len(chunk['text']) for chunk in chunks
+            if not segment_cache.contains(segment_key(chunk['text'], voice, engine_model, 'mp3'))
+        ]
+
+    def estimate_wall_clock(self, billable, model=None):
         """
-        Estimate cost for TTS generation
-        OpenAI TTS-1: $15.00 per 1M characters
+        Seconds to synthesize chunks of the given character counts at the
+        concurrency the pipeline can use right now: the worker pool, the
+        limiter's current concurrency and the per-user scheduler cap, and no
+        faster than the rate limit buckets admit them
         """
-        if not text:
-            return 0
-        
-        char_count = len(text)
-        cost_per_char = 15.00 / 1_000_000  # $15 per million characters
-        estimated_cost = char_count * cost_per_char
-        
+        if not billable:
+            return 0.0
+        engine_model = self.engine_model_for(model)
+        limits = rate_limiter.stats(engine_model)
+        concurrency = max(1, min(self.max_workers, int(limits['concurrency_limit']), scheduler.user_concurrency))
+        compute = max(sum(billable) / concurrency, max(billable)) * self.seconds_per_char
+        admission = rate_limiter.admission_seconds(engine_model, len(billable), sum(billable))
+        return max(compute, admission)
+
+    def forecast(self, chunks, voice, billable=None, model=None):
+        """Describe what rendering the planned chunks would cost, without synthesizing anything"""
+        model = model or self.model
+        if billable is None:
+            billable = self.billable_chunks(chunks, voice, model)
+        characters = sum(len(chunk['text']) for chunk in chunks)
+        price = PRICE_PER_MILLION_CHARS.get(model, PRICE_PER_MILLION_CHARS['tts-1'])
+        audio_seconds = characters / SPEECH_CHARS_PER_SECOND + sum(chunk_pauses(chunks))
         return {
-            'character_count': char_count,
-            'estimated_cost_usd': round(estimated_cost, 4),
-            'estimated_duration_minutes': char_count / 150  # Rough estimate
+            'model': model,
+            'chunk_count': len(chunks),
+            'cached_chunks': len(chunks) - len(billable),
+            'character_count': characters,
+            'billable_characters': sum(billable),
+            'estimated_cost_usd': round(sum(billable) * price / 1_000_000, 4),
+            'estimated_audio_seconds': round(audio_seconds, 1),
+            'estimated_duration_minutes': audio_seconds / 60,
+            'estimated_render_seconds': round(self.estimate_wall_clock(billable, model), 1)
         }
 
+    def estimate_cost(self, text, voice='alloy', lexicon=None):
+        """
+        Forecast cost, playing time and render time for text, using the same
+        normalizer and chunk plan as a real render. Chunks already in the
+        segment cache are not billed.
+        """
+        if voice not in self.voices:
+            voice = 'alloy'
+        return self.forecast(self.plan_synthesis(text or '', lexicon), voice)
+
 # Global TTS service instance
 tts_service = TTSService()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from services.tts_service import tts_service
+from services.segment_cache import segment_cache, segment_key
+from services.chunking_service import split_paragraphs, split_sentences
+from services.chapter_audio import html_to_text
+from services.scheduler import in_context
+
+# Read in every voice when no manuscript text is chosen. Its samples are
+# shared by all users, so after the first request they are always cache hits.
+STANDARD_PASSAGE = (
+    "The lighthouse keeper had not spoken to anyone in three weeks. "
+    "Still, every evening he climbed the hundred and twelve steps, lit the lamp, "
+    "and wondered who, out there in the dark, might be watching for it."
+)
+SAMPLE_MAX_CHARS = 400
+
+
+def sample_passage(text):
+    """First paragraph of text, cut back to whole sentences under SAMPLE_MAX_CHARS"""
+    paragraphs = split_paragraphs(html_to_text(text or ''))
+    if not paragraphs:
+        return None
+
+    passage = ''
+    for sentence in split_sentences(paragraphs[0]):
+        candidate = f"{passage} {sentence}".strip()
+        if len(candidate) > SAMPLE_MAX_CHARS:
+            break
+        passage = candidate
+    return passage or paragraphs[0][:SAMPLE_MAX_CHARS]
+
+
+def _render(text, voice):
+    audio, hit = tts_service.synthesize_cached(text, voice)
+    return segment_key(text, voice, tts_service.engine_model, 'mp3'), hit
+
+
+def render_voice_samples(text=None, lexicon=None):
+    """
+    Render the passage in every voice at once, one thread per voice, so the
+    whole gallery takes about as long as a single sample. Samples live in the
+    segment cache keyed on the passage, which makes the standard passage a
+    global cache entry and custom passages per content hash.
+    Returns (spoken text, [{'voice', 'key', 'cached'}]).
+    """
+    spoken = tts_service.optimize_text_for_speech(text or STANDARD_PASSAGE, lexicon)
+    voices = tts_service.get_available_voices()
+
+    with ThreadPoolExecutor(max_workers=len(voices), thread_name_prefix='voice-sample') as executor:
+        futures = {voice: executor.submit(in_context(_render), spoken, voice) for voice in voices}
+
+    samples = []
+    for voice, future in futures.items():
+        try:
+            key, hit = future.result()
+            samples.append({'voice': voice, 'key': key, 'cached': hit})
+        except Exception as e:
+            logging.error(f"Voice sample error for {voice}: {e}")
+            samples.append({'voice': voice, 'key': None, 'cached': False, 'error': 'Sample unavailable'})
+    return spoken, samples
+
+
+def load_sample(key):
+    """MP3 bytes of a rendered sample, or None"""
+    return segment_cache.get(key, 'mp3')
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Sentence splitting and chunk planning for TTS synthesis
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.chunking_service import plan_chunks, split_sentences
+
+
+def test_titles_and_initials_do_not_end_sentences():
+    sentences = split_sentences('He left at 3 p.m. Then Dr. Who came. J. R. Tolkien wrote it. The U.S. is big.')
+    assert sentences == ['He left at 3 p.m. Then Dr. Who came.', 'J. R. Tolkien wrote it.', 'The U.S. is big.']
+
+
+def test_sentence_ends_still_split():
+    assert split_sentences('She cried "Stop!" He ran. It ended?') == ['She cried "Stop!"', 'He ran.', 'It ended?']
+
+
+def test_chunks_never_end_on_a_title():
+    text = 'Then Dr. Smith arrived at 3 p.m. and met Mr. Jones on Baker St. near the park. ' * 20
+    for max_chars in (60, 300):
+        for chunk in plan_chunks(text, max_chars):
+            assert not chunk['text'].endswith(('Dr.', 'Mr.', 'p.m.')), chunk['text']
+            assert len(chunk['text']) <= max_chars
+
+
+def test_oversized_sentence_keeps_title_with_name():
+    texts = [chunk['text'] for chunk in plan_chunks('We met the old Dr. Smith at home today and', 20)]
+    assert 'Dr. Smith at home' in texts
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Text front-end expansion around pronunciation lexicon respellings
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.text_frontend import expand_text, annotate_text
+
+
+def test_title_before_respelled_name_expands():
+    text = 'Then Dr. Nguyen arrived.'
+    respellings = [(9, 15, 'Win')]
+    assert expand_text(text) == 'Then Doctor Nguyen arrived.'
+    assert expand_text(text, respellings=respellings) == 'Then Doctor Win arrived.'
+
+
+def test_number_before_respelled_term_reads_as_without_lexicon():
+    text = 'Model 3000X ships in 1984 Nguyen.'
+    assert expand_text(text) == 'Model 3000X ships in nineteen eighty-four Nguyen.'
+    respelled = expand_text(text, respellings=[(10, 11, 'Ex'), (26, 32, 'Win')])
+    assert respelled == 'Model 3000Ex ships in nineteen eighty-four Win.'
+
+
+def test_respelled_terms_are_never_expanded():
+    text = 'They left Area 51 at 3:45pm.'
+    respellings = [(10, 17, 'Area Fifty-One')]
+    assert expand_text(text, respellings=respellings) == 'They left Area Fifty-One at three forty-five PM.'
+    spans = annotate_text(text, respellings=respellings)
+    assert [(span['rule'], span['text']) for span in spans] == [('lexicon', 'Area 51'), ('time', '3:45pm.')]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+MysticEcho Audio Worker
+Runs queued audio generation jobs outside the web process.
+
+    python worker.py
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import logging
+import threading
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+from models import AudioJob
+from services import job_queue
+from services import speculative
+from services.audio_jobs import run_job, settle_job, JobCancelled
+
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2))
+HEARTBEAT_INTERVAL = max(1, job_queue.LEASE_SECONDS // 3)
+
+
+class Heartbeat(threading.Thread):
+    """Keeps a claimed job's lease alive and notices lost leases or cancellation"""
+
+    def __init__(self, job_id, worker_id):
+        super().__init__(daemon=True, name=f"heartbeat-{job_id}")
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.progress = 0.0
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                with app.app_context():
+                    if not job_queue.heartbeat(self.job_id, self.worker_id, self.progress):
+                        logging.warning(f"Job {self.job_id}: lease lost or cancellation requested")
+                        self.lost.set()
+                        return
+            except Exception as e:
+                logging.error(f"Heartbeat error for job {self.job_id}: {e}")
+
+    def update_progress(self, fraction):
+        self.progress = round(fraction, 4)
+        if self.lost.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+def process_job(job, worker_id):
+    """Run one claimed job to completion, failure or cancellation"""
+    heartbeat = Heartbeat(job.id, worker_id)
+    heartbeat.start()
+    try:
+        result = run_job(job, heartbeat.update_progress)
+        if heartbeat.lost.is_set():
+            raise JobCancelled(f"Job {job.id} was cancelled")
+        job_queue.complete(job.id, worker_id, result)
+        logging.info(f"Job {job.id} succeeded")
+    except Exception as e:
+        db.session.rollback()
+        status = job_queue.fail(job.id, worker_id, e)
+        logging.error(f"Job {job.id} attempt {job.attempts} failed ({status}): {e}")
+        if status in ('failed', 'cancelled'):
+            settle_job(db.session.get(AudioJob, job.id))
+    finally:
+        heartbeat.stopped.set()
+
+
+def run_worker():
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    logging.info(f"Audio worker {worker_id} starting (poll every {POLL_INTERVAL}s)")
+    next_speculation = 0.0
+
+    while True:
+        try:
+            with app.app_context():
+                job = job_queue.claim_next(worker_id)
+                if job:
+                    process_job(job, worker_id)
+                    continue
+                # Idle: pre-render settled chapters, a bounded pass at a time so queued jobs go first
+                if time.monotonic() >= next_speculation:
+                    next_speculation = time.monotonic() + speculative.IDLE_INTERVAL_SECONDS
+                    if speculative.run_idle_pass():
+                        next_speculation = 0.0
+                        continue
+        except Exception as e:
+            logging.error(f"Worker loop error: {e}")
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    try:
+        run_worker()
+    except KeyboardInterrupt:
+        print("👋 Audio worker stopped")